@@ -0,0 +1,161 @@
+"""
+LLM调用的自适应并发控制器（AIMD）
+- 延迟稳定且并发窗口被占满时，窗口加1（加性增长）
+- 遇到429/超时，或最近的p95延迟明显高于基线时，窗口乘以backoff_factor（乘性退避）
+当前窗口、在途请求数和排队数可通过snapshot()查看。
+"""
+
+import asyncio
+import functools
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_ERROR_NAMES = {
+    "RateLimitError",
+    "APITimeoutError",
+    "APIConnectionError",
+    "TimeoutError",
+}
+
+
+def is_throttle_error(error):
+    """判断异常是否表示后端过载（429、超时、连接被拒）"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    return type(error).__name__ in THROTTLE_ERROR_NAMES
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        initial_limit=5,
+        min_limit=1,
+        max_limit=64,
+        backoff_factor=0.5,
+        latency_tolerance=1.0,
+        sample_size=32,
+        name="llm",
+    ):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.name = name
+
+        self.in_flight = 0
+        self.waiting = 0
+        self.baseline_p95 = None
+        self._latencies = deque(maxlen=sample_size)
+        self._successes_since_change = 0
+        self._saturated = False
+        self._cooldown = 0
+        self._condition = asyncio.Condition()
+
+        self.total_calls = 0
+        self.throttled_calls = 0
+
+    def snapshot(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "baseline_p95": self.baseline_p95,
+            "total_calls": self.total_calls,
+            "throttled_calls": self.throttled_calls,
+        }
+
+    async def acquire(self):
+        async with self._condition:
+            if self.in_flight >= self.limit:
+                self._saturated = True
+                self.waiting += 1
+                try:
+                    await self._condition.wait_for(lambda: self.in_flight < self.limit)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            if self.in_flight >= self.limit:
+                self._saturated = True
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _set_limit(self, new_limit, reason):
+        new_limit = max(self.min_limit, min(self.max_limit, new_limit))
+        if new_limit != self.limit:
+            log = logger.debug if new_limit > self.limit else logger.info
+            log(
+                f"[{self.name}] concurrency {self.limit} -> {new_limit} ({reason}), "
+                f"in flight {self.in_flight}, queued {self.waiting}"
+            )
+            self.limit = new_limit
+        self._successes_since_change = 0
+        self._saturated = False
+
+    def _back_off(self, reason):
+        # 一次退避后，至少等当前窗口内的请求都完成再允许下一次退避，避免同一波失败把窗口压到底
+        if self._cooldown > 0:
+            return
+        self._set_limit(int(self.limit * self.backoff_factor), reason)
+        self._cooldown = self.limit
+        self._latencies.clear()
+
+    def on_success(self, latency):
+        self.total_calls += 1
+        self._cooldown = max(0, self._cooldown - 1)
+        self._latencies.append(latency)
+        self._successes_since_change += 1
+
+        if len(self._latencies) < self._latencies.maxlen:
+            return
+        p95 = percentile(self._latencies, 0.95)
+        if self.baseline_p95 is None or p95 < self.baseline_p95:
+            self.baseline_p95 = p95
+        elif p95 > self.baseline_p95 * (1 + self.latency_tolerance):
+            self._back_off(f"p95 {p95:.1f}s vs baseline {self.baseline_p95:.1f}s")
+            return
+        else:
+            # 基线缓慢上移，适应后端正常的负载变化
+            self.baseline_p95 = 0.95 * self.baseline_p95 + 0.05 * p95
+
+        if self._saturated and self._successes_since_change >= self.limit:
+            self._set_limit(self.limit + 1, "latency stable")
+
+    def on_throttle(self, error):
+        self.total_calls += 1
+        self.throttled_calls += 1
+        self._back_off(type(error).__name__)
+
+    def wrap(self, func):
+        """把异步函数包装为受控调用（可作为装饰器使用）"""
+
+        @functools.wraps(func)
+        async def limited(*args, **kwargs):
+            await self.acquire()
+            start = time.monotonic()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                if is_throttle_error(e):
+                    self.on_throttle(e)
+                raise
+            else:
+                self.on_success(time.monotonic() - start)
+                return result
+            finally:
+                await self.release()
+
+        return limited
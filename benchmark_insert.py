@@ -0,0 +1,184 @@
+"""
+离线插入基准测试
+在后台线程中启动mock_openai_server，用临时的WORKING_DIR / INSERT_DIR / EMBEDDING_CACHE_DIR
+以子进程方式运行insert.py，统计耗时与吞吐，用于在没有网络的情况下发现插入流程的性能回退：
+
+    python benchmark_insert.py --input inputs/doupo50.txt --latency 0.2 --runs 3
+
+LightRAG用tiktoken切分chunk，编码文件（gpt-4o-mini对应o200k_base）首次使用时需要下载。
+开始计时之前会先在TIKTOKEN_CACHE_DIR（或--tiktoken-cache-dir，未设置时为tiktoken的默认缓存目录）
+中加载一次编码，insert.py子进程使用同一个缓存目录：缓存中已有该编码时整个基准测试无需联网，
+没有时需要联网运行一次，或把其他机器上的缓存文件复制到该目录。
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import tiktoken
+from lightrag import LightRAG
+
+from mock_openai_server import add_server_arguments, server_options, start_in_thread
+from telemetry import SUMMARY_FILENAME
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def seed_tokenizer_cache(cache_dir=None):
+    """加载LightRAG使用的tiktoken编码，使缓存目录中有编码文件，返回编码名
+
+    cache_dir会写入TIKTOKEN_CACHE_DIR，由insert.py子进程继承。
+    """
+    if cache_dir:
+        os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+    return tiktoken.encoding_for_model(LightRAG.tiktoken_model_name).name
+
+
+def run_once(input_path, base_url, embedding_dim, keep_dir=None, extra_env=None):
+    """在全新的临时目录中运行一次insert.py，返回本次的统计结果"""
+    run_dir = keep_dir or tempfile.mkdtemp(prefix="insert_bench_")
+    insert_dir = os.path.join(run_dir, "inputs")
+    working_dir = os.path.join(run_dir, "working_dir")
+    os.makedirs(insert_dir, exist_ok=True)
+    shutil.copy(input_path, insert_dir)
+
+    env = os.environ.copy()
+    env.update(
+        {
+            "OPENAI_API_BASE": base_url,
+            "OPENAI_API_KEY": "mock",
+            "OPENAI_CHAT_MODEL": "mock-chat",
+            "OPENAI_EMBEDDINGS_MODEL": "mock-embedding",
+            "EMBEDDING_DIM": str(embedding_dim),
+            "WORKING_DIR": working_dir,
+            "INSERT_DIR": insert_dir,
+            "EMBEDDING_CACHE_DIR": os.path.join(run_dir, "embedding_cache"),
+        }
+    )
+    env.update(extra_env or {})
+
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, os.path.join(SCRIPT_DIR, "insert.py")],
+        cwd=run_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        check=False,
+    )
+    elapsed = time.perf_counter() - start
+    succeeded = "INSERT_COMPLETED_SUCCESSFULLY" in process.stdout
+
+    result = {"seconds": elapsed, "succeeded": succeeded}
+    summary_path = os.path.join(working_dir, SUMMARY_FILENAME)
+    if os.path.exists(summary_path):
+        with open(summary_path, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+        result["chunks"] = summary["chunks"]
+        for kind, stats in summary["kinds"].items():
+            result[f"{kind}_calls"] = stats["calls"]
+            result[f"{kind}_p95"] = stats["latency_p95"]
+    if not succeeded:
+        result["stderr_tail"] = process.stderr[-2000:]
+
+    if keep_dir is None:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="离线插入基准测试",
+        epilog="tiktoken的编码文件需要已在缓存目录中（首次使用需联网下载一次），"
+        "见--tiktoken-cache-dir",
+    )
+    parser.add_argument(
+        "--input", default=os.path.join(SCRIPT_DIR, "inputs", "doupo50.txt")
+    )
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--keep-dir", help="保留最后一次运行的工作目录到该路径")
+    parser.add_argument("--output", help="把结果以JSON写入该文件")
+    parser.add_argument(
+        "--tiktoken-cache-dir",
+        default=os.getenv("TIKTOKEN_CACHE_DIR"),
+        help="tiktoken编码文件的缓存目录（默认TIKTOKEN_CACHE_DIR，未设置时为tiktoken的默认目录）；"
+        "其中没有LightRAG使用的编码时需要联网下载一次",
+    )
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        encoding = seed_tokenizer_cache(args.tiktoken_cache_dir)
+    except Exception as e:
+        sys.exit(
+            f"Cannot load the tiktoken encoding for {LightRAG.tiktoken_model_name}: {e}\n"
+            "Run once with network access, or copy the tiktoken cache into "
+            "--tiktoken-cache-dir / TIKTOKEN_CACHE_DIR."
+        )
+    print(
+        f"Tokenizer: {encoding} (cache: {os.getenv('TIKTOKEN_CACHE_DIR', 'default')})"
+    )
+
+    server = start_in_thread(**server_options(args))
+    with open(args.input, "r", encoding="utf-8") as f:
+        input_chars = len(f.read())
+    print(f"Mock server: {server.base_url}, input: {args.input} ({input_chars} chars)")
+
+    runs = []
+    try:
+        for i in range(args.runs):
+            keep_dir = args.keep_dir if i == args.runs - 1 else None
+            if keep_dir:
+                shutil.rmtree(keep_dir, ignore_errors=True)
+            result = run_once(
+                args.input, server.base_url, args.embedding_dim, keep_dir=keep_dir
+            )
+            result["chars_per_sec"] = input_chars / result["seconds"]
+            if result.get("chunks"):
+                result["chunks_per_sec"] = result["chunks"] / result["seconds"]
+            runs.append(result)
+            status = "✅" if result["succeeded"] else "❌"
+            print(
+                f"{status} run {i + 1}/{args.runs}: {result['seconds']:.1f}s, "
+                f"{result['chars_per_sec']:.0f} chars/s, "
+                f"{result.get('chunks', 0)} chunks, "
+                f"{result.get('llm_calls', 0)} LLM calls, "
+                f"{result.get('embedding_calls', 0)} embedding calls"
+            )
+            if not result["succeeded"]:
+                print(result["stderr_tail"])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    seconds = [r["seconds"] for r in runs if r["succeeded"]]
+    report = {
+        "input": args.input,
+        "input_chars": input_chars,
+        "server": server_options(args),
+        "server_stats": dict(server.stats),
+        "runs": runs,
+    }
+    if seconds:
+        report["median_seconds"] = statistics.median(seconds)
+        report["median_chars_per_sec"] = input_chars / report["median_seconds"]
+        print(
+            f"Median: {report['median_seconds']:.1f}s "
+            f"({report['median_chars_per_sec']:.0f} chars/s) over {len(seconds)} runs"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(0 if len(seconds) == len(runs) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+插入过程的崩溃安全检查点
+LightRAG每处理完一个文档就把内存中的存储写回WORKING_DIR，但各个文件是直接覆盖写入的，
+doc_status又先于图谱落盘，进程在中途被杀掉时工作目录可能处于不一致甚至损坏的状态。
+
+这里在每次落盘后（持有图谱合并锁，保证没有进行到一半的合并）记下各存储文件的大小和修改时间，
+释放锁后再在后台线程中把它们复制成一份检查点，复制期间合并照常进行；
+复制完成后文件有任何变化说明期间又发生了落盘，这份副本被丢弃，下次落盘后重试：
+    WORKING_DIR/.checkpoint/            最近一次完整的检查点
+    WORKING_DIR/.checkpoint/checkpoint.json  {"created_at", "files", "doc_status"}
+先写到临时目录再改名替换，任何时刻退出都至少保留一份完整的检查点。
+
+insert.py --resume 会先用检查点覆盖工作目录，再继续处理：已完成的文档被跳过，
+未完成的文档由LightRAG重新处理，其中已经完成抽取的chunk直接命中共享的LLM响应缓存。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+
+from lightrag.kg.shared_storage import get_graph_db_lock
+
+from snapshot_store import clone_file
+from telemetry import SUMMARY_FILENAME, TRACE_FILENAME
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIRNAME = ".checkpoint"
+STATE_FILENAME = "checkpoint.json"
+# insert.py的日志
+LOG_FILENAME = "insert.log"
+# 只追加的遥测文件和日志不参与检查点，恢复时也不会被覆盖
+EXCLUDED_FILES = {TRACE_FILENAME, SUMMARY_FILENAME, LOG_FILENAME}
+
+
+class CheckpointManager:
+    def __init__(self, working_dir, min_interval=30):
+        self.working_dir = working_dir
+        self.min_interval = min_interval
+        self.path = os.path.join(working_dir, CHECKPOINT_DIRNAME)
+        self._last_saved = 0.0
+        self._saving = False
+
+    def _storage_files(self):
+        return sorted(
+            name
+            for name in os.listdir(self.working_dir)
+            if name not in EXCLUDED_FILES
+            and not name.endswith(".tmp")
+            and os.path.isfile(os.path.join(self.working_dir, name))
+        )
+
+    def _latest(self):
+        """返回最近一次完整检查点的目录（替换过程中退出时退回到旧的那份）"""
+        for path in (self.path, self.path + ".old"):
+            if os.path.exists(os.path.join(path, STATE_FILENAME)):
+                return path
+        return None
+
+    def _file_stats(self, files):
+        stats = {}
+        for name in files:
+            st = os.stat(os.path.join(self.working_dir, name))
+            stats[name] = (st.st_size, st.st_mtime_ns)
+        return stats
+
+    def due(self):
+        return (
+            not self._saving
+            and time.monotonic() - self._last_saved >= self.min_interval
+        )
+
+    def snapshot_state(self):
+        """记下当前的存储文件及其大小/修改时间（在持有图谱锁、没有落盘进行时调用）"""
+        files = self._storage_files()
+        return files, self._file_stats(files)
+
+    def save(self, doc_status=None, force=False, state=None):
+        """把当前工作目录复制为新的检查点；距上次保存不足min_interval秒时跳过
+
+        state为snapshot_state()的结果时，复制完成后校验文件没有变化，
+        有变化（复制期间又发生了落盘）则丢弃这份副本并返回False。
+        """
+        now = time.monotonic()
+        if not force and now - self._last_saved < self.min_interval:
+            return False
+
+        files, stats = state or self.snapshot_state()
+        tmp_path = self.path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in files:
+            # 支持reflink的文件系统上不复制数据
+            clone_file(
+                os.path.join(self.working_dir, name), os.path.join(tmp_path, name)
+            )
+        if state is not None and (
+            self._storage_files() != files or self._file_stats(files) != stats
+        ):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            logger.info("Working dir changed during checkpoint copy, retrying later")
+            return False
+        checkpoint_state = {
+            "created_at": time.time(),
+            "files": files,
+            "doc_status": doc_status,
+        }
+        with open(os.path.join(tmp_path, STATE_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(checkpoint_state, f, ensure_ascii=False, indent=2)
+
+        old_path = self.path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.rename(self.path, old_path)
+        os.rename(tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        self._last_saved = now
+        logger.info(f"Checkpoint saved ({len(files)} files, doc status {doc_status})")
+        return True
+
+    def restore(self):
+        """用最近的检查点覆盖工作目录中的存储文件，返回检查点状态（没有检查点时返回None）"""
+        path = self._latest()
+        if path is None:
+            return None
+        with open(os.path.join(path, STATE_FILENAME), "r", encoding="utf-8") as f:
+            state = json.load(f)
+
+        # 检查点之后新建的文件属于未完成的落盘，直接删除
+        for name in self._storage_files():
+            if name not in state["files"]:
+                os.remove(os.path.join(self.working_dir, name))
+        for name in state["files"]:
+            target = os.path.join(self.working_dir, name)
+            shutil.copy2(os.path.join(path, name), target + ".tmp")
+            os.replace(target + ".tmp", target)
+        return state
+
+    def clear(self):
+        for suffix in ("", ".tmp", ".old"):
+            shutil.rmtree(self.path + suffix, ignore_errors=True)
+
+    def attach(self, rag):
+        """在LightRAG每次落盘之后保存检查点"""
+        insert_done = rag._insert_done
+
+        async def insert_done_with_checkpoint(*args, **kwargs):
+            state = None
+            # 持有图谱锁：落盘期间不会有文档处于合并的中途
+            async with get_graph_db_lock(enable_logging=False):
+                await insert_done(*args, **kwargs)
+                # doc_status不在_insert_done的落盘列表里，这里一起写回，保证与图谱一致
+                await rag.doc_status.index_done_callback()
+                if self.due():
+                    doc_status = await rag.doc_status.get_status_counts()
+                    state = self.snapshot_state()
+                    self._saving = True
+            if state is None:
+                return
+            # 复制在锁外的线程中进行，不阻塞合并和事件循环
+            try:
+                await asyncio.to_thread(self.save, doc_status, True, state)
+            finally:
+                self._saving = False
+
+        rag._insert_done = insert_done_with_checkpoint
@@ -0,0 +1,294 @@
+"""
+抽取前的近重复chunk检测
+网上抓取的小说里充斥着重复的章节标题、作者的话和反复转载的段落，这些chunk每个都要走一遍
+entity_extraction + entity_continue_extraction，抽出来的还是同样的实体和关系。
+
+这里包装LightRAG的chunking_func，在chunk进入抽取之前：
+    1. 规范化空白后内容完全相同的chunk直接判为重复
+    2. 其余chunk计算字符n-gram的MinHash签名，用LSH分桶找候选，
+       估计的Jaccard相似度不低于阈值的判为近重复
+重复的chunk照常写入text_chunks/chunks_vdb（检索内容不变），只是不做实体抽取，
+由先插入的那一份代表它。
+
+索引保存在WORKING_DIR/chunk_dedup_index.json，随检查点一起保存和恢复，
+增量插入和--resume时与之前插入过的chunk比较。可用环境变量调整：
+    CHUNK_DEDUP               设为1开启（默认0，开启后图谱与不去重时不完全相同）
+    CHUNK_DEDUP_THRESHOLD     近重复判定的Jaccard阈值（默认0.85）
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import zlib
+
+import numpy as np
+from lightrag.utils import compute_mdhash_id
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "chunk_dedup_index.json"
+
+# Mersenne素数2^61-1，MinHash的置换为 (a * x + b) mod P
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text):
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def shingle_hashes(text, size):
+    """字符n-gram的32位哈希（中文文本没有空格分词，按字符切片）"""
+    text = normalize(text)
+    if len(text) <= size:
+        shingles = {text}
+    else:
+        shingles = {text[i : i + size] for i in range(len(text) - size + 1)}
+    return np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+class ChunkDeduplicator:
+    def __init__(
+        self,
+        working_dir,
+        threshold=0.85,
+        num_perm=128,
+        bands=16,
+        shingle_size=5,
+        seed=1,
+    ):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands")
+        self.path = os.path.join(working_dir, INDEX_FILENAME)
+        self.params = {
+            "threshold": threshold,
+            "num_perm": num_perm,
+            "bands": bands,
+            "shingle_size": shingle_size,
+            "seed": seed,
+        }
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        # a, b < 2^31，保证 a * x + b 在uint64内不溢出（x为32位哈希）
+        self._a = rng.randint(1, 1 << 31, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm).astype(np.uint64)
+
+        # chunk_id -> {"doc_id", "digest", "signature"}
+        self._chunks = {}
+        self._digests = {}
+        self._buckets = [{} for _ in range(bands)]
+        # doc_id -> 该文档被跳过的chunk所对应的代表chunk_id
+        self._duplicates = {}
+        # 本次运行中不做抽取的 (doc_id, chunk_id)
+        self._skip_extraction = set()
+        self.stats = {"chunks": 0, "exact_duplicates": 0, "near_duplicates": 0}
+        self._load()
+
+    def signature(self, text):
+        hashes = shingle_hashes(text, self.shingle_size)
+        permuted = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME
+        return (permuted & MAX_HASH).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows : (band + 1) * self.rows].tobytes()
+
+    def _add(self, chunk_id, doc_id, digest, signature):
+        self._chunks[chunk_id] = {
+            "doc_id": doc_id,
+            "digest": digest,
+            "signature": signature,
+        }
+        self._digests.setdefault(digest, chunk_id)
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, []).append(chunk_id)
+
+    def find_duplicate(self, content, signature=None):
+        """返回 (重复的chunk_id, 相似度)；没有重复时返回 (None, 0.0)"""
+        digest = hashlib.md5(normalize(content).encode("utf-8")).hexdigest()
+        if digest in self._digests:
+            return self._digests[digest], 1.0
+        if signature is None:
+            signature = self.signature(content)
+        candidates = {
+            chunk_id
+            for band, key in self._band_keys(signature)
+            for chunk_id in self._buckets[band].get(key, ())
+        }
+        best, best_similarity = None, 0.0
+        for chunk_id in candidates:
+            similarity = float(
+                np.mean(self._chunks[chunk_id]["signature"] == signature)
+            )
+            if similarity > best_similarity:
+                best, best_similarity = chunk_id, similarity
+        if best_similarity >= self.threshold:
+            return best, best_similarity
+        return None, 0.0
+
+    def mark_duplicates(self, doc_id, chunks):
+        """找出chunks中与已索引chunk重复的部分，其余加入索引；返回重复chunk的id集合
+
+        重复的chunk会在抽取时被跳过（见attach），但仍然正常存储。
+        """
+        duplicates = set()
+        for chunk in chunks:
+            chunk_id = compute_mdhash_id(chunk["content"], prefix="chunk-")
+            self.stats["chunks"] += 1
+            # 中断后重新处理同一个文档时，它的chunk已经在索引里，不能算作重复
+            if self._chunks.get(chunk_id, {}).get("doc_id") == doc_id:
+                continue
+            digest = hashlib.md5(
+                normalize(chunk["content"]).encode("utf-8")
+            ).hexdigest()
+            signature = self.signature(chunk["content"])
+            duplicate_of, similarity = self.find_duplicate(chunk["content"], signature)
+            if duplicate_of is None:
+                self._add(chunk_id, doc_id, digest, signature)
+                continue
+            kind = "exact_duplicates" if digest in self._digests else "near_duplicates"
+            self.stats[kind] += 1
+            self._duplicates.setdefault(doc_id, set()).add(duplicate_of)
+            duplicates.add(chunk_id)
+            logger.info(
+                f"Skipping extraction of chunk {chunk['chunk_order_index']} of {doc_id}: "
+                f"duplicate of {duplicate_of} (similarity {similarity:.2f})"
+            )
+        return duplicates
+
+    def wrap(self, chunking_func):
+        """包装LightRAG的chunking_func，切分之后立即标记重复的chunk（返回的chunk不变）"""
+
+        def chunking_with_dedup(tokenizer, content, *args, **kwargs):
+            chunks = chunking_func(tokenizer, content, *args, **kwargs)
+            # 与LightRAG的doc_id计算方式一致（content已经过clean_text）
+            doc_id = compute_mdhash_id(content, prefix="doc-")
+            self._skip_extraction.update(
+                (doc_id, chunk_id) for chunk_id in self.mark_duplicates(doc_id, chunks)
+            )
+            return chunks
+
+        return chunking_with_dedup
+
+    def dependent_docs(self, doc_ids):
+        """有chunk因与这些文档的chunk重复而被跳过的其他文档（递归）
+
+        这些文档被删除后，依赖它们的文档缺失的内容也必须重新抽取。
+        """
+        affected = set(doc_ids)
+        frontier = set(doc_ids)
+        while frontier:
+            representatives = {
+                chunk_id
+                for chunk_id, entry in self._chunks.items()
+                if entry["doc_id"] in frontier
+            }
+            frontier = {
+                doc_id
+                for doc_id, targets in self._duplicates.items()
+                if doc_id not in affected and targets & representatives
+            }
+            affected |= frontier
+        return affected - set(doc_ids)
+
+    def forget_docs(self, doc_ids):
+        """从索引中删除这些文档的chunk（文档被删除、需要重新抽取时调用）"""
+        doc_ids = set(doc_ids)
+        for doc_id in doc_ids:
+            self._duplicates.pop(doc_id, None)
+        removed = {
+            chunk_id
+            for chunk_id, entry in self._chunks.items()
+            if entry["doc_id"] in doc_ids
+        }
+        if not removed:
+            return
+        entries = {k: v for k, v in self._chunks.items() if k not in removed}
+        self._chunks, self._digests = {}, {}
+        self._buckets = [{} for _ in range(self.bands)]
+        for chunk_id, entry in entries.items():
+            self._add(chunk_id, entry["doc_id"], entry["digest"], entry["signature"])
+
+    def attach(self, rag):
+        """抽取时跳过被标记为重复的chunk，并在LightRAG每次落盘时一起保存索引
+        （检查点会在其后复制工作目录）"""
+        insert_done = rag._insert_done
+        process_graph = rag._process_entity_relation_graph
+
+        async def insert_done_with_index(*args, **kwargs):
+            await insert_done(*args, **kwargs)
+            self.save()
+
+        async def process_graph_without_duplicates(chunks, *args, **kwargs):
+            chunks = {
+                chunk_id: chunk
+                for chunk_id, chunk in chunks.items()
+                if (chunk.get("full_doc_id"), chunk_id) not in self._skip_extraction
+            }
+            # 整个文档都是重复内容时没有需要抽取的chunk（extract_entities不接受空输入）
+            if not chunks:
+                return []
+            return await process_graph(chunks, *args, **kwargs)
+
+        rag._insert_done = insert_done_with_index
+        rag._process_entity_relation_graph = process_graph_without_duplicates
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable {self.path}: {e}")
+            return
+        if data.get("params") != self.params:
+            logger.info("Chunk dedup parameters changed, rebuilding index")
+            return
+        for chunk_id, entry in data["chunks"].items():
+            signature = np.array(entry["signature"], dtype=np.uint32)
+            self._add(chunk_id, entry["doc_id"], entry["digest"], signature)
+        self._duplicates = {
+            doc_id: set(targets) for doc_id, targets in data["duplicates"].items()
+        }
+
+    def save(self):
+        data = {
+            "params": self.params,
+            "chunks": {
+                chunk_id: {**entry, "signature": entry["signature"].tolist()}
+                for chunk_id, entry in self._chunks.items()
+            },
+            "duplicates": {
+                doc_id: sorted(targets) for doc_id, targets in self._duplicates.items()
+            },
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def report(self, max_gleaning=1):
+        """本次运行的去重统计，以及估计节省的LLM调用次数
+
+        每个chunk的抽取调用数：1次初次抽取 + max_gleaning次补充抽取
+        + (max_gleaning - 1)次是否继续的判断。
+        """
+        skipped = self.stats["exact_duplicates"] + self.stats["near_duplicates"]
+        calls_per_chunk = 1 + max_gleaning + max(max_gleaning - 1, 0)
+        return {
+            **self.stats,
+            "skipped": skipped,
+            "llm_calls_saved": skipped * calls_per_chunk,
+        }
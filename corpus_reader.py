@@ -0,0 +1,65 @@
+"""
+大文件流式读取工具
+按固定大小的块增量读取文本，并优先在章节标题、其次在段落边界处切分，
+保证任意时刻内存中只保留一个有界片段，与文件总大小无关。
+"""
+
+import re
+
+# 章节标题，例如 "第1章 陨落的天才"、"第一百二十回"
+CHAPTER_PATTERN = re.compile(
+    r"^[ \t　]*第[0-9零一二三四五六七八九十百千万两]+[章节回卷]", re.MULTILINE
+)
+
+DEFAULT_SEGMENT_CHARS = 100_000
+DEFAULT_BLOCK_CHARS = 1 << 20
+
+
+def find_segment_cut(text, max_chars):
+    """在text[:max_chars]中寻找最合适的切分位置
+
+    优先级：最后一个章节标题的起点 > 最后一个空行（段落边界）> 最后一个换行 > 硬切分。
+    切点过于靠前（不足max_chars的1/4）时视为无效，避免产生碎片片段。
+    """
+    window = text[:max_chars]
+    min_cut = max_chars // 4
+
+    chapter_cut = 0
+    for match in CHAPTER_PATTERN.finditer(window):
+        chapter_cut = match.start()
+    if chapter_cut >= min_cut:
+        return chapter_cut
+
+    for boundary in ("\n\n", "\n"):
+        pos = window.rfind(boundary)
+        if pos >= min_cut:
+            return pos + len(boundary)
+
+    return max_chars
+
+
+def iter_text_segments(
+    file_path,
+    max_chars=DEFAULT_SEGMENT_CHARS,
+    block_chars=DEFAULT_BLOCK_CHARS,
+    encoding="utf-8",
+):
+    """增量读取file_path，逐个产出长度不超过max_chars的文本片段
+
+    只包含空白字符的片段会被跳过。峰值内存约为 max_chars + block_chars 个字符。
+    """
+    pending = ""
+    with open(file_path, "r", encoding=encoding) as f:
+        while True:
+            block = f.read(block_chars)
+            pending += block
+            while len(pending) > max_chars:
+                cut = find_segment_cut(pending, max_chars)
+                segment, pending = pending[:cut], pending[cut:]
+                if segment.strip():
+                    yield segment
+            if not block:
+                break
+
+    if pending.strip():
+        yield pending
@@ -0,0 +1,169 @@
+"""
+跨工作目录共享的embedding磁盘缓存
+以(模型, 文本sha256)为键，向量按行追加到float32矩阵文件中并通过内存映射读取，
+所有实验/工作目录共用同一份缓存，只有从未见过的文本才会请求embedding接口。
+
+目录结构（每个模型一个子目录）：
+    <cache_dir>/<model>/meta.json     {"model": ..., "dim": ...}
+    <cache_dir>/<model>/ids.bin       每行32字节的sha256摘要，行号即矩阵行号
+    <cache_dir>/<model>/vectors.f32   行优先的float32矩阵
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台退化为进程内互斥
+    fcntl = None
+
+DIGEST_SIZE = 32
+
+
+def text_digest(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """单个embedding模型的追加式向量缓存
+
+    多个进程可以同时读写：追加时持有文件锁，先写向量再写摘要，
+    读取时以两者中较短的一方为准，因此进程中途退出也不会出现错位的行。
+    """
+
+    def __init__(self, cache_dir, model):
+        self.model = model or "default"
+        self.dir = os.path.join(cache_dir, re.sub(r"[^\w.-]+", "_", self.model))
+        os.makedirs(self.dir, exist_ok=True)
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.ids_path = os.path.join(self.dir, "ids.bin")
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.lock_path = os.path.join(self.dir, ".lock")
+
+        self.dim = None
+        self.rows = {}  # 摘要 -> 行号
+        self._ids_offset = 0
+        self._matrix = None
+        self.hits = 0
+        self.misses = 0
+        self._refresh()
+
+    def _refresh(self):
+        """读取其他进程追加的新行，并重新映射向量矩阵"""
+        if self.dim is None:
+            if not os.path.exists(self.meta_path):
+                return
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+
+        row_bytes = self.dim * 4
+        vector_rows = (
+            os.path.getsize(self.vectors_path) // row_bytes
+            if os.path.exists(self.vectors_path)
+            else 0
+        )
+        known_rows = self._ids_offset // DIGEST_SIZE
+        if os.path.exists(self.ids_path) and vector_rows > known_rows:
+            with open(self.ids_path, "rb") as f:
+                f.seek(self._ids_offset)
+                new_ids = f.read((vector_rows - known_rows) * DIGEST_SIZE)
+            start = known_rows
+            for i in range(len(new_ids) // DIGEST_SIZE):
+                digest = new_ids[i * DIGEST_SIZE : (i + 1) * DIGEST_SIZE]
+                self.rows.setdefault(digest, start + i)
+            self._ids_offset += len(new_ids) - len(new_ids) % DIGEST_SIZE
+
+        total_rows = self._ids_offset // DIGEST_SIZE
+        if total_rows and (self._matrix is None or len(self._matrix) != total_rows):
+            self._matrix = np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(total_rows, self.dim),
+            )
+
+    def _truncate_partial_rows(self):
+        """截掉上次追加中途退出留下的半行，保证两个文件的行号对齐（需持有文件锁）"""
+        rows = self._ids_offset // DIGEST_SIZE
+        for path, row_bytes in (
+            (self.ids_path, DIGEST_SIZE),
+            (self.vectors_path, self.dim * 4),
+        ):
+            if os.path.exists(path) and os.path.getsize(path) > rows * row_bytes:
+                os.truncate(path, rows * row_bytes)
+
+    def lookup(self, texts):
+        """返回与texts等长的列表，命中的位置为向量，未命中为None"""
+        digests = [text_digest(t) for t in texts]
+        if any(d not in self.rows for d in digests):
+            self._refresh()
+        return [
+            np.array(self._matrix[self.rows[d]]) if d in self.rows else None
+            for d in digests
+        ]
+
+    def add(self, texts, vectors):
+        """追加新向量（已存在的文本会被忽略）"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.dim is None and not os.path.exists(self.meta_path):
+                    # _refresh不持锁读取meta.json，先写临时文件再替换，其他进程读不到半个文件
+                    tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+                    with open(tmp_path, "w", encoding="utf-8") as f:
+                        json.dump({"model": self.model, "dim": vectors.shape[1]}, f)
+                    os.replace(tmp_path, self.meta_path)
+                self._refresh()
+                if vectors.shape[1] != self.dim:
+                    raise ValueError(
+                        f"Embedding dim {vectors.shape[1]} does not match cached dim {self.dim} for {self.model}"
+                    )
+                self._truncate_partial_rows()
+
+                new_digests = []
+                new_vectors = []
+                for text, vector in zip(texts, vectors):
+                    digest = text_digest(text)
+                    if digest in self.rows or digest in new_digests:
+                        continue
+                    new_digests.append(digest)
+                    new_vectors.append(vector)
+                if not new_digests:
+                    return
+
+                with open(self.vectors_path, "ab") as f:
+                    f.write(np.stack(new_vectors).tobytes())
+                with open(self.ids_path, "ab") as f:
+                    f.write(b"".join(new_digests))
+                self._refresh()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    async def get_or_compute(self, texts, compute_func, stats=None):
+        """先查缓存，只把未命中的文本（去重后）交给compute_func计算
+
+        stats: 可选字典，会被填入本次调用的cache_hits / cache_misses
+        """
+        cached = self.lookup(texts)
+        missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+        hits = len(texts) - sum(v is None for v in cached)
+        self.hits += hits
+        self.misses += len(missing)
+        if stats is not None:
+            stats["cache_hits"] = hits
+            stats["cache_misses"] = len(missing)
+
+        if missing:
+            computed = np.asarray(await compute_func(missing), dtype=np.float32)
+            self.add(missing, computed)
+            by_text = dict(zip(missing, computed))
+            cached = [by_text[t] if v is None else v for t, v in zip(texts, cached)]
+
+        return np.stack(cached)
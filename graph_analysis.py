@@ -1,6 +1,15 @@
 import os
 import json
-from lightrag.utils import xml_to_json
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from graphml_stream import iter_graphml, read_graphml
+
+GRAPHML_FILENAME = "graph_chunk_entity_relation.graphml"
+# Older runs cached the converted graph here; still read when no GraphML is present
+LEGACY_GRAPH_JSON_FILENAME = "graph_data.json"
 
 
 # --- Evaluation Configuration ---
@@ -21,31 +30,8 @@ W_DETAIL_UNSUPERVISED_WEIGHT = 1.0 / 3.0
 W_DIVERSITY_UNSUPERVISED_WEIGHT = 1.0 / 3.0
 W_STRENGTH_UNSUPERVISED_WEIGHT = 1.0 / 3.0
 
-
-def convert_xml_to_json(xml_path, output_path):
-    """Converts XML file to JSON and saves the output."""
-    if not os.path.exists(xml_path):
-        print(f"Error: XML File not found - {xml_path}")
-        return None
-    try:
-        json_data = xml_to_json(xml_path)  # This is the call to the imported function
-        if json_data:
-            # Ensure 'nodes' and 'edges' keys exist, defaulting to empty lists
-            if "nodes" not in json_data:
-                json_data["nodes"] = []
-            if "edges" not in json_data:
-                json_data["edges"] = []
-
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(json_data, f, ensure_ascii=False, indent=2)
-            # print(f"JSON file created: {output_path}") # Reduced verbosity
-            return json_data
-        else:
-            print(f"Failed to convert XML to JSON (empty result): {xml_path}")
-            return None
-    except Exception as e:
-        print(f"Error during XML to JSON conversion for {xml_path}: {e}")
-        return None
+# Pass 1 loads and measures experiments in this many worker processes (one graph each)
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", str(os.cpu_count() or 1)))
 
 
 def process_in_batches(tx, query, data, batch_size):
@@ -58,146 +44,320 @@ def process_in_batches(tx, query, data, batch_size):
 # --- Unsupervised Evaluation Helper Functions ---
 
 
-def get_graph_data_and_config(experiment_dir_path):
-    """Loads graph data from JSON and eval config for an experiment."""
-    graph_json_path = os.path.join(experiment_dir_path, "graph_data.json")
-    graphml_path = os.path.join(
-        experiment_dir_path, "graph_chunk_entity_relation.graphml"
-    )
+def load_protagonist_id(experiment_dir_path):
+    """Reads the protagonist from the experiment's eval_config.json, if any."""
     eval_config_path = os.path.join(experiment_dir_path, "eval_config.json")
+    if not os.path.exists(eval_config_path):
+        return DEFAULT_PROTAGONIST_ID
+    try:
+        with open(eval_config_path, "r", encoding="utf-8") as f:
+            eval_config = json.load(f)
+        return eval_config.get("protagonist_id", DEFAULT_PROTAGONIST_ID)
+    except Exception as e:
+        print(
+            f"Error loading eval_config.json from {eval_config_path}: {e}. Using default protagonist."
+        )
+        return DEFAULT_PROTAGONIST_ID
+
+
+def _load_legacy_graph_json(graph_json_path):
+    try:
+        with open(graph_json_path, "r", encoding="utf-8") as f:
+            graph_data = json.load(f)
+    except Exception as e:
+        print(f"Error loading graph data from {graph_json_path}: {e}")
+        return None
+    if not isinstance(graph_data, dict):
+        return None
+    graph_data.setdefault("nodes", [])
+    graph_data.setdefault("edges", [])
+    return graph_data
+
+
+def get_graph_data_and_config(experiment_dir_path):
+    """
+    Loads graph data and eval config for an experiment.
+    The graph is read from GraphML as {"nodes": [...], "edges": [...]}; use
+    load_graph_tables when the graph does not need to be held as Python dicts.
+    """
+    graphml_path = os.path.join(experiment_dir_path, GRAPHML_FILENAME)
+    graph_json_path = os.path.join(experiment_dir_path, LEGACY_GRAPH_JSON_FILENAME)
 
-    graph_data = None
-    # Prefer JSON, but convert from GraphML if JSON is missing or older
-    if os.path.exists(graph_json_path):
+    if os.path.exists(graphml_path):
         try:
-            # Check if GraphML is newer than JSON; if so, reconvert
-            if os.path.exists(graphml_path) and os.path.getmtime(
-                graphml_path
-            ) > os.path.getmtime(graph_json_path):
-                print(f"Re-converting newer GraphML for {experiment_dir_path}")
-                graph_data = convert_xml_to_json(graphml_path, graph_json_path)
-            else:
-                with open(graph_json_path, "r", encoding="utf-8") as f:
-                    graph_data = json.load(f)
-                # Basic validation
-                if "nodes" not in graph_data or "edges" not in graph_data:
-                    print(
-                        f"Warning: JSON graph data in {graph_json_path} is missing 'nodes' or 'edges'. Attempting GraphML conversion."
-                    )
-                    if os.path.exists(graphml_path):
-                        graph_data = convert_xml_to_json(graphml_path, graph_json_path)
-                    else:
-                        graph_data = None  # Cannot recover
-        except json.JSONDecodeError:
-            print(
-                f"Error decoding JSON from {graph_json_path}. Attempting GraphML conversion."
-            )
-            if os.path.exists(graphml_path):
-                graph_data = convert_xml_to_json(graphml_path, graph_json_path)
-            else:
-                graph_data = None  # Cannot recover
+            graph_data = read_graphml(graphml_path)
         except Exception as e:
-            print(
-                f"Error loading graph data from {graph_json_path}: {e}. Attempting GraphML conversion."
-            )
-            if os.path.exists(graphml_path):
-                graph_data = convert_xml_to_json(graphml_path, graph_json_path)
-            else:
-                graph_data = None
-
-    elif os.path.exists(graphml_path):
-        print(
-            f"JSON graph data not found for {experiment_dir_path}, converting from GraphML."
-        )
-        graph_data = convert_xml_to_json(graphml_path, graph_json_path)
+            print(f"Error reading GraphML {graphml_path}: {e}")
+            graph_data = None
+    elif os.path.exists(graph_json_path):
+        graph_data = _load_legacy_graph_json(graph_json_path)
     else:
         return None, DEFAULT_PROTAGONIST_ID, {"error": "GraphML file not found"}
 
-    if not graph_data:  # If conversion or loading failed
+    if graph_data is None:  # If reading failed
         return (
             None,
             DEFAULT_PROTAGONIST_ID,
             {"error": "Failed to load or convert graph data"},
         )
 
-    # Ensure nodes and edges are lists, even if empty
-    if "nodes" not in graph_data:
-        graph_data["nodes"] = []
-    if "edges" not in graph_data:
-        graph_data["edges"] = []
-
-    protagonist_id = DEFAULT_PROTAGONIST_ID
-    if os.path.exists(eval_config_path):
-        try:
-            with open(eval_config_path, "r", encoding="utf-8") as f:
-                eval_config = json.load(f)
-            protagonist_id = eval_config.get("protagonist_id", DEFAULT_PROTAGONIST_ID)
-        except Exception as e:
-            print(
-                f"Error loading eval_config.json from {eval_config_path}: {e}. Using default protagonist."
-            )
+    return graph_data, load_protagonist_id(experiment_dir_path), {}
 
-    return graph_data, protagonist_id, {}  # Empty dict for no error
 
+def _description_length(description, label=None):
+    # Fallback to 'label' for edges if 'description' is missing, as per typical graph structures
+    if not description and isinstance(label, str):
+        description = label
+    return len(description) if isinstance(description, str) else 0
 
-def calculate_protagonist_centrality_unsupervised(graph_data, protagonist_id):
-    """Calculates Protagonist Centrality for unsupervised evaluation."""
-    if not graph_data or not graph_data.get("nodes"):
-        return 0.0
 
-    nodes = graph_data["nodes"]
-    edges = graph_data.get("edges", [])
-    num_total_entities = len(nodes)
+def _edge_strength(edge):
+    # Assuming strength is in 'weight' or 'strength'. Prioritize 'strength'.
+    strength = edge.get("strength", edge.get("weight"))
+    return strength if isinstance(strength, (int, float)) else np.nan
 
-    if not protagonist_id or not any(
-        node.get("id") == protagonist_id for node in nodes
-    ):
-        # print(f"Warning: Protagonist '{protagonist_id}' not found or not specified.")
-        return 0.0
 
-    if num_total_entities <= 1:  # If only protagonist or no other nodes
-        return 0.0
+class GraphTables:
+    """
+    Columnar view of a graph for vectorized evaluation.
+
+    Node ids (including ids that only appear as edge endpoints) are interned to
+    integer codes; node_ids[code] maps a code back to the id. Rows:
+      node_codes        int32, one per node record (duplicates kept, as in graph_data)
+      node_desc_len     int32, length of each node description (0 if not a string)
+      edge_source/target int32 codes, -1 for a missing endpoint
+      edge_weight       float64, 'strength' or 'weight' of each edge, NaN if not numeric
+      edge_desc_len     int32, description length of each edge ('label' as fallback)
+      edge_label        int32 codes into labels, -1 for a missing label
+    """
 
-    connected_to_protagonist = set()
-    for edge in edges:
-        source = edge.get("source")
-        target = edge.get("target")
-        if source == protagonist_id and target:
-            connected_to_protagonist.add(target)
-        elif target == protagonist_id and source:
-            connected_to_protagonist.add(source)
+    def __init__(
+        self,
+        node_ids,
+        labels,
+        node_codes,
+        node_desc_len,
+        edge_source,
+        edge_target,
+        edge_weight,
+        edge_desc_len,
+        edge_label,
+    ):
+        self.node_ids = node_ids
+        self.labels = labels
+        self.node_codes = node_codes
+        self.node_desc_len = node_desc_len
+        self.edge_source = edge_source
+        self.edge_target = edge_target
+        self.edge_weight = edge_weight
+        self.edge_desc_len = edge_desc_len
+        self.edge_label = edge_label
+        self._code_of = None
+
+    @classmethod
+    def from_graph_data(cls, graph_data):
+        return UnsupervisedMetricsAccumulator().add_graph(graph_data).tables()
+
+    @classmethod
+    def from_graphml(cls, graphml_path):
+        accumulator = UnsupervisedMetricsAccumulator()
+        return accumulator.add_elements(iter_graphml(graphml_path)).tables()
+
+    @property
+    def nodes_count(self):
+        return len(self.node_codes)
+
+    @property
+    def edges_count(self):
+        return len(self.edge_source)
+
+    def code_of(self, node_id):
+        if self._code_of is None:
+            self._code_of = {node: code for code, node in enumerate(self.node_ids)}
+        return self._code_of.get(node_id, -1)
+
+    def degrees(self):
+        """Degree of every interned node id (self-loops count twice)."""
+        endpoints = np.concatenate([self.edge_source, self.edge_target])
+        return np.bincount(endpoints[endpoints >= 0], minlength=len(self.node_ids))
+
+    def protagonist_centrality(self, protagonist_id):
+        protagonist = self.code_of(protagonist_id) if protagonist_id else -1
+        if protagonist < 0 or not np.any(self.node_codes == protagonist):
+            return 0.0
+        # Denominator is (Total entities - 1) as per formula
+        if self.nodes_count <= 1:
+            return 0.0
+        source, target = self.edge_source, self.edge_target
+        outgoing = (source == protagonist) & (target >= 0)
+        incoming = (target == protagonist) & (source >= 0) & ~outgoing
+        neighbors = np.concatenate([target[outgoing], source[incoming]])
+        return len(np.unique(neighbors)) / (self.nodes_count - 1)
+
+    def connectivity_score(self):
+        # Formula: 1 - (orphan_nodes / total_entities) which is num_connected_nodes / total_entities
+        if self.nodes_count == 0:
+            return 0.0
+        return int(np.count_nonzero(self.degrees())) / self.nodes_count
+
+    def average_description_length(self):
+        # Nodes and edges count towards the average even without a description
+        item_count = self.nodes_count + self.edges_count
+        if item_count == 0:
+            return 0.0
+        total = self.node_desc_len.sum(dtype=np.int64) + self.edge_desc_len.sum(
+            dtype=np.int64
+        )
+        return int(total) / item_count
+
+    def relation_diversity(self):
+        if self.edges_count == 0:
+            return 0.0
+        labelled = self.edge_label[self.edge_label >= 0]
+        used_codes = np.bincount(labelled, minlength=len(self.labels))
+        return int(np.count_nonzero(used_codes)) / self.edges_count
+
+    def average_relation_strength(self):
+        weights = self.edge_weight[~np.isnan(self.edge_weight)]
+        if len(weights) == 0:
+            return 0.0  # No edges with valid strength values
+        return float(weights.mean())
+
+    def raw_metrics(self, protagonist_id):
+        """The raw metrics record that Pass 2 normalizes (see score_raw_metrics)."""
+        return {
+            "nodes_count": self.nodes_count,
+            "edges_count": self.edges_count,
+            "protagonist_centrality": self.protagonist_centrality(protagonist_id),
+            "connectivity_score": self.connectivity_score(),
+            "raw_scope": self.nodes_count,
+            "raw_avg_desc_len": self.average_description_length(),
+            "relationship_diversity": self.relation_diversity(),
+            "raw_avg_rel_strength": self.average_relation_strength(),
+        }
+
+
+class UnsupervisedMetricsAccumulator:
+    """
+    Collects the columns of GraphTables in a single pass over nodes and edges.
+    Nodes and edges can be fed in any order (e.g. straight from a parser), so the
+    graph is never held as Python dicts; call result() once everything is added.
+    """
 
-    # Denominator is (Total entities - 1) as per formula
-    denominator = num_total_entities - 1
-    if (
-        denominator <= 0
-    ):  # Should be caught by num_total_entities <= 1, but as a safeguard
-        return 0.0
+    def __init__(self, protagonist_id=None):
+        self.protagonist_id = protagonist_id
+        self.node_ids = {}
+        self.labels = {}
+        self.node_codes = array("i")
+        self.node_desc_len = array("i")
+        self.edge_source = array("i")
+        self.edge_target = array("i")
+        self.edge_weight = array("d")
+        self.edge_desc_len = array("i")
+        self.edge_label = array("i")
+
+    def _intern(self, node_id):
+        if not node_id:
+            return -1
+        return self.node_ids.setdefault(node_id, len(self.node_ids))
+
+    def add_node(self, node):
+        # Interned directly (not via _intern) so that an empty id still counts as a node
+        node_id = node.get("id")
+        self.node_codes.append(self.node_ids.setdefault(node_id, len(self.node_ids)))
+        self.node_desc_len.append(_description_length(node.get("description", "")))
+
+    def add_edge(self, edge):
+        self.edge_source.append(self._intern(edge.get("source")))
+        self.edge_target.append(self._intern(edge.get("target")))
+        label = edge.get("label")
+        self.edge_label.append(
+            self.labels.setdefault(label, len(self.labels)) if label else -1
+        )
+        self.edge_desc_len.append(
+            _description_length(edge.get("description", ""), label)
+        )
+        self.edge_weight.append(_edge_strength(edge))
+
+    def add_graph(self, graph_data):
+        """Bulk version of add_node/add_edge for an in-memory graph, one column at a time."""
+        if not graph_data:
+            return self
+        nodes = graph_data.get("nodes", [])
+        edges = graph_data.get("edges", [])
+        node_ids = self.node_ids
+        labels = self.labels
+
+        self.node_codes.extend(
+            [node_ids.setdefault(node.get("id"), len(node_ids)) for node in nodes]
+        )
+        self.node_desc_len.extend(
+            [_description_length(node.get("description", "")) for node in nodes]
+        )
+        for column, key in ((self.edge_source, "source"), (self.edge_target, "target")):
+            column.extend(
+                [
+                    node_ids.setdefault(endpoint, len(node_ids)) if endpoint else -1
+                    for endpoint in (edge.get(key) for edge in edges)
+                ]
+            )
+        self.edge_label.extend(
+            [
+                labels.setdefault(label, len(labels)) if label else -1
+                for label in (edge.get("label") for edge in edges)
+            ]
+        )
+        self.edge_desc_len.extend(
+            [
+                _description_length(edge.get("description", ""), edge.get("label"))
+                for edge in edges
+            ]
+        )
+        self.edge_weight.extend([_edge_strength(edge) for edge in edges])
+        return self
+
+    def add_elements(self, elements):
+        """Consumes (kind, element) pairs as produced by graphml_stream.iter_graphml."""
+        for kind, element in elements:
+            if kind == "node":
+                self.add_node(element)
+            elif kind == "edge":
+                self.add_edge(element)
+        return self
+
+    def tables(self):
+        def column(values, dtype):
+            return np.frombuffer(values, dtype=dtype) if values else np.empty(0, dtype)
+
+        return GraphTables(
+            node_ids=list(self.node_ids),
+            labels=list(self.labels),
+            node_codes=column(self.node_codes, np.int32),
+            node_desc_len=column(self.node_desc_len, np.int32),
+            edge_source=column(self.edge_source, np.int32),
+            edge_target=column(self.edge_target, np.int32),
+            edge_weight=column(self.edge_weight, np.float64),
+            edge_desc_len=column(self.edge_desc_len, np.int32),
+            edge_label=column(self.edge_label, np.int32),
+        )
 
-    return len(connected_to_protagonist) / denominator
+    def result(self):
+        return self.tables().raw_metrics(self.protagonist_id)
 
 
-def calculate_connectivity_score_unsupervised(graph_data):
-    """Calculates Connectivity Score for unsupervised evaluation."""
-    if not graph_data or not graph_data.get("nodes"):
-        return 0.0  # Or 1.0 if interpreting "no orphans" in an empty graph? Formula implies 0.
+def compute_raw_metrics(graph_data, protagonist_id):
+    """Computes all raw unsupervised metrics of a loaded graph in one traversal."""
+    return GraphTables.from_graph_data(graph_data).raw_metrics(protagonist_id)
 
-    nodes = graph_data["nodes"]
-    edges = graph_data.get("edges", [])
-    num_total_entities = len(nodes)
 
-    if num_total_entities == 0:
-        return 0.0  # No nodes, no connections.
+def calculate_protagonist_centrality_unsupervised(graph_data, protagonist_id):
+    """Calculates Protagonist Centrality for unsupervised evaluation."""
+    return compute_raw_metrics(graph_data, protagonist_id)["protagonist_centrality"]
 
-    nodes_with_connections = set()
-    for edge in edges:
-        if edge.get("source"):
-            nodes_with_connections.add(edge.get("source"))
-        if edge.get("target"):
-            nodes_with_connections.add(edge.get("target"))
 
-    # Formula: 1 - (orphan_nodes / total_entities) which is num_connected_nodes / total_entities
-    return len(nodes_with_connections) / num_total_entities
+def calculate_connectivity_score_unsupervised(graph_data):
+    """Calculates Connectivity Score for unsupervised evaluation."""
+    return compute_raw_metrics(graph_data, None)["connectivity_score"]
 
 
 def calculate_raw_scope_score_unsupervised(graph_data):
@@ -209,73 +369,43 @@ def calculate_raw_scope_score_unsupervised(graph_data):
 
 def calculate_average_description_length_unsupervised(graph_data):
     """Calculates the average length of descriptions for entities and relationships."""
-    if not graph_data:
-        return 0.0
-
-    nodes = graph_data.get("nodes", [])
-    edges = graph_data.get("edges", [])
-
-    total_desc_length = 0
-    item_count = 0
-
-    for node in nodes:
-        description = node.get("description", "")
-        if isinstance(description, str):
-            total_desc_length += len(description)
-        item_count += 1  # Count node even if no description, for average base
-
-    for edge in edges:
-        description = edge.get("description", "")
-        # Fallback to 'label' for edges if 'description' is missing, as per typical graph structures
-        if not description and isinstance(edge.get("label"), str):
-            description = edge.get("label", "")
-        if isinstance(description, str):
-            total_desc_length += len(description)
-        item_count += 1  # Count edge even if no description
-
-    if item_count == 0:
-        return 0.0
-    return total_desc_length / item_count
+    return compute_raw_metrics(graph_data, None)["raw_avg_desc_len"]
 
 
 def calculate_relation_diversity_unsupervised(graph_data):
     """Calculates Relationship Diversity."""
-    if not graph_data or not graph_data.get("edges"):
-        return 0.0
-
-    edges = graph_data["edges"]
-    num_total_relations = len(edges)
-
-    if num_total_relations == 0:
-        return 0.0
-
-    # Assuming relationship types are in the 'label' field of edges
-    relation_types = {edge.get("label") for edge in edges if edge.get("label")}
-
-    return len(relation_types) / num_total_relations
+    return compute_raw_metrics(graph_data, None)["relationship_diversity"]
 
 
 def calculate_average_relation_strength_unsupervised(graph_data):
     """Calculates the average strength of relationships."""
-    if not graph_data or not graph_data.get("edges"):
-        return 0.0
+    return compute_raw_metrics(graph_data, None)["raw_avg_rel_strength"]
 
-    edges = graph_data["edges"]
-    if not edges:
-        return 0.0
 
-    total_strength = 0
-    strength_count = 0
-    for edge in edges:
-        # Assuming strength is in 'weight' or 'strength'. Prioritize 'strength'.
-        strength = edge.get("strength", edge.get("weight"))
-        if isinstance(strength, (int, float)):
-            total_strength += strength
-            strength_count += 1
+def load_graph_tables(experiment_dir_path):
+    """
+    Like get_graph_data_and_config, but returns the graph as GraphTables.
+    GraphML is streamed straight into the columns, one element at a time.
+    """
+    graphml_path = os.path.join(experiment_dir_path, GRAPHML_FILENAME)
+    if not os.path.exists(graphml_path):
+        graph_data, protagonist_id, error_info = get_graph_data_and_config(
+            experiment_dir_path
+        )
+        if error_info:
+            return None, protagonist_id, error_info
+        return GraphTables.from_graph_data(graph_data), protagonist_id, {}
 
-    if strength_count == 0:
-        return 0.0  # No edges with valid strength values
-    return total_strength / strength_count
+    try:
+        graph_tables = GraphTables.from_graphml(graphml_path)
+    except Exception as e:
+        print(f"Error reading GraphML {graphml_path}: {e}")
+        return (
+            None,
+            DEFAULT_PROTAGONIST_ID,
+            {"error": "Failed to load or convert graph data"},
+        )
+    return graph_tables, load_protagonist_id(experiment_dir_path), {}
 
 
 # --- Helper for empty results ---
@@ -302,66 +432,48 @@ def _create_empty_unsupervised_results(error_message=""):
 
 
 # --- Main Unsupervised Evaluation Function ---
-def evaluate_graph_unsupervised(
-    graph_data,
-    protagonist_id,
-    raw_scope_for_this_experiment,  # Pass the already calculated raw scope
-    raw_avg_desc_len_for_this_experiment,  # Pass the already calculated raw avg desc len
-    raw_avg_rel_strength_for_this_experiment,  # Pass the already calculated raw avg rel strength
+def score_raw_metrics(
+    raw_metrics,
     max_overall_raw_scope,
     max_overall_raw_avg_desc_len,
     max_overall_raw_avg_rel_strength,
 ):
     """
-    Calculates all unsupervised evaluation scores for a single graph.
+    Pass 2: turns a raw metrics record (see UnsupervisedMetricsAccumulator.result)
+    into the final unsupervised scores, normalized by the maxima over all experiments.
     """
-    if not graph_data:
-        return _create_empty_unsupervised_results("Graph data is None")
-
-    nodes_count = len(graph_data.get("nodes", []))
-    edges_count = len(graph_data.get("edges", []))
-
-    # Focus Score
-    protagonist_centrality = calculate_protagonist_centrality_unsupervised(
-        graph_data, protagonist_id
-    )
-    focus_score = protagonist_centrality  # Focus_Score = Protagonist_Centrality
+    # Focus_Score = Protagonist_Centrality
+    focus_score = raw_metrics["protagonist_centrality"]
 
     # Structure Score
-    connectivity_score = calculate_connectivity_score_unsupervised(graph_data)
-    # raw_scope_score is already calculated in Pass 1 (raw_scope_for_this_experiment)
-
+    connectivity_score = raw_metrics["connectivity_score"]
     normalized_scope_score = 0.0
     if max_overall_raw_scope > 0:
-        normalized_scope_score = raw_scope_for_this_experiment / max_overall_raw_scope
+        normalized_scope_score = raw_metrics["raw_scope"] / max_overall_raw_scope
 
     structure_score = (W_CONN_UNSUPERVISED_WEIGHT * connectivity_score) + (
         W_SCOPE_UNSUPERVISED_WEIGHT * normalized_scope_score
     )
 
     # Richness Score
-    # raw_avg_desc_length is already calculated in Pass 1
     normalized_avg_desc_length = 0.0
     if max_overall_raw_avg_desc_len > 0:
         normalized_avg_desc_length = (
-            raw_avg_desc_len_for_this_experiment / max_overall_raw_avg_desc_len
+            raw_metrics["raw_avg_desc_len"] / max_overall_raw_avg_desc_len
         )
 
-    relationship_diversity = calculate_relation_diversity_unsupervised(graph_data)
+    relationship_diversity = raw_metrics["relationship_diversity"]
 
-    # raw_avg_rel_strength is already calculated in Pass 1
     normalized_avg_rel_strength = 0.0
     if max_overall_raw_avg_rel_strength > 0:
         normalized_avg_rel_strength = (
-            raw_avg_rel_strength_for_this_experiment / max_overall_raw_avg_rel_strength
+            raw_metrics["raw_avg_rel_strength"] / max_overall_raw_avg_rel_strength
         )
 
     richness_score = (
         (W_DETAIL_UNSUPERVISED_WEIGHT * normalized_avg_desc_length)
         + (W_DIVERSITY_UNSUPERVISED_WEIGHT * relationship_diversity)
-        + (
-            W_STRENGTH_UNSUPERVISED_WEIGHT * normalized_avg_rel_strength
-        )  # Corrected variable name here
+        + (W_STRENGTH_UNSUPERVISED_WEIGHT * normalized_avg_rel_strength)
     )
 
     # Final Novel Graph Score
@@ -373,24 +485,118 @@ def evaluate_graph_unsupervised(
 
     return {
         "error": None,
-        "nodes_count": nodes_count,
-        "edges_count": edges_count,
-        "protagonist_centrality": protagonist_centrality,
+        "nodes_count": raw_metrics["nodes_count"],
+        "edges_count": raw_metrics["edges_count"],
+        "protagonist_centrality": raw_metrics["protagonist_centrality"],
         "focus_score": focus_score,
         "connectivity_score": connectivity_score,
-        "raw_scope_score": raw_scope_for_this_experiment,  # Include for reference
+        "raw_scope_score": raw_metrics["raw_scope"],  # Include for reference
         "normalized_scope_score": normalized_scope_score,
         "structure_score": structure_score,
-        "raw_avg_desc_length": raw_avg_desc_len_for_this_experiment,  # Include for reference
+        "raw_avg_desc_length": raw_metrics["raw_avg_desc_len"],  # For reference
         "normalized_avg_desc_length": normalized_avg_desc_length,
         "relationship_diversity": relationship_diversity,
-        "raw_avg_rel_strength": raw_avg_rel_strength_for_this_experiment,  # Include for reference
+        "raw_avg_rel_strength": raw_metrics["raw_avg_rel_strength"],  # For reference
         "normalized_avg_rel_strength": normalized_avg_rel_strength,
         "richness_score": richness_score,
         "novel_graph_score": novel_graph_score,
     }
 
 
+def evaluate_graph_unsupervised(
+    graph_data,
+    protagonist_id,
+    raw_scope_for_this_experiment,  # Pass the already calculated raw scope
+    raw_avg_desc_len_for_this_experiment,  # Pass the already calculated raw avg desc len
+    raw_avg_rel_strength_for_this_experiment,  # Pass the already calculated raw avg rel strength
+    max_overall_raw_scope,
+    max_overall_raw_avg_desc_len,
+    max_overall_raw_avg_rel_strength,
+):
+    """
+    Calculates all unsupervised evaluation scores for a single graph.
+    """
+    if not graph_data:
+        return _create_empty_unsupervised_results("Graph data is None")
+
+    raw_metrics = compute_raw_metrics(graph_data, protagonist_id)
+    raw_metrics["raw_scope"] = raw_scope_for_this_experiment
+    raw_metrics["raw_avg_desc_len"] = raw_avg_desc_len_for_this_experiment
+    raw_metrics["raw_avg_rel_strength"] = raw_avg_rel_strength_for_this_experiment
+    return score_raw_metrics(
+        raw_metrics,
+        max_overall_raw_scope,
+        max_overall_raw_avg_desc_len,
+        max_overall_raw_avg_rel_strength,
+    )
+
+
+def score_graphs_unsupervised(experiments):
+    """
+    Scores a batch of graphs against each other (Pass 1 + Pass 2 without the tobe scan).
+    experiments maps a name to (graph_data, protagonist_id); normalization uses the
+    maxima of this batch. Returns {name: scores}.
+    """
+    raw_metrics = {
+        name: compute_raw_metrics(graph_data, protagonist_id)
+        for name, (graph_data, protagonist_id) in experiments.items()
+        if graph_data
+    }
+    max_scope = max((m["raw_scope"] for m in raw_metrics.values()), default=0)
+    max_desc_len = max(
+        (m["raw_avg_desc_len"] for m in raw_metrics.values()), default=0.0
+    )
+    max_rel_strength = max(
+        (m["raw_avg_rel_strength"] for m in raw_metrics.values()), default=0.0
+    )
+
+    results = {}
+    for name in experiments:
+        if name not in raw_metrics:
+            results[name] = _create_empty_unsupervised_results("Graph data is None")
+            continue
+        results[name] = score_raw_metrics(
+            raw_metrics[name], max_scope, max_desc_len, max_rel_strength
+        )
+    return results
+
+
+def collect_experiment_metrics(experiment_path):
+    """
+    Pass 1 for one tobe experiment: loads the graph and returns only its raw metrics
+    record, so it can run in a worker process without sending the graph back.
+    """
+    experiment_dir_name = os.path.basename(experiment_path)
+    graph_tables, protagonist_id, error_info = load_graph_tables(experiment_path)
+
+    if error_info or graph_tables is None:
+        return {
+            "dir_name": experiment_dir_name,
+            "error": error_info.get("error")
+            or "No graph data loaded after get_graph_data_and_config (safeguard)",
+            "raw_metrics": None,  # No data to process
+            "protagonist_id": None,
+            "raw_scope": 0,
+            "raw_avg_desc_len": 0.0,
+            "raw_avg_rel_strength": 0.0,
+            "nodes_count_initial": 0,
+            "edges_count_initial": 0,
+        }
+
+    raw_metrics = graph_tables.raw_metrics(protagonist_id)
+    return {
+        "dir_name": experiment_dir_name,
+        "raw_metrics": raw_metrics,
+        "protagonist_id": protagonist_id,
+        "raw_scope": raw_metrics["raw_scope"],
+        "raw_avg_desc_len": raw_metrics["raw_avg_desc_len"],
+        "raw_avg_rel_strength": raw_metrics["raw_avg_rel_strength"],
+        "nodes_count_initial": raw_metrics["nodes_count"],
+        "edges_count_initial": raw_metrics["edges_count"],
+        "error": None,  # Explicitly set no error for successful pass 1
+    }
+
+
 # --- Main Execution Logic ---
 if __name__ == "__main__":
     tobe_dir = "./tobe"
@@ -400,80 +606,36 @@ if __name__ == "__main__":
         print(f"Error: Directory '{tobe_dir}' not found or is not a directory.")
         exit()
 
-    print("--- Starting Unsupervised Evaluation: Pass 1 (Data Collection) ---")
-    for experiment_dir_name in sorted(
-        os.listdir(tobe_dir)
-    ):  # Sort for consistent order
-        experiment_path = os.path.join(tobe_dir, experiment_dir_name)
-        if not os.path.isdir(experiment_path):
-            continue
-
-        print(f"Processing (Pass 1): {experiment_dir_name}")
-        graph_data, protagonist_id, error_info = get_graph_data_and_config(
-            experiment_path
-        )
+    experiment_dir_names = [
+        name
+        for name in sorted(os.listdir(tobe_dir))  # Sort for consistent order
+        # 跳过快照存储的.blobs和临时目录
+        if not name.startswith(".") and os.path.isdir(os.path.join(tobe_dir, name))
+    ]
+    workers = max(1, min(EVAL_WORKERS, len(experiment_dir_names)))
 
-        if error_info:
-            print(
-                f"  Skipping {experiment_dir_name} due to error: {error_info.get('error')}"
-            )
-            all_experiment_data_for_pass1.append(
-                {
-                    "dir_name": experiment_dir_name,
-                    "error": error_info.get("error"),
-                    "graph_data": None,  # No data to process
-                    "protagonist_id": None,
-                    "raw_scope": 0,
-                    "raw_avg_desc_len": 0.0,
-                    "raw_avg_rel_strength": 0.0,
-                    "nodes_count_initial": 0,
-                    "edges_count_initial": 0,
-                }
-            )
-            continue
+    print(
+        f"--- Starting Unsupervised Evaluation: Pass 1 (Data Collection, {workers} workers) ---"
+    )
+    experiment_paths = [os.path.join(tobe_dir, name) for name in experiment_dir_names]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pass1_records = list(pool.map(collect_experiment_metrics, experiment_paths))
+    else:
+        pass1_records = [collect_experiment_metrics(p) for p in experiment_paths]
 
-        if not graph_data:  # Should be caught by error_info, but as a safeguard
+    # Records arrive in directory order; only the small raw-metric records are kept
+    for experiment_data in pass1_records:
+        experiment_dir_name = experiment_data["dir_name"]
+        print(f"Processing (Pass 1): {experiment_dir_name}")
+        all_experiment_data_for_pass1.append(experiment_data)
+        if experiment_data["error"]:
             print(
-                f"  Skipping {experiment_dir_name}: No graph data loaded (should have been caught by error_info)."
-            )
-            all_experiment_data_for_pass1.append(
-                {
-                    "dir_name": experiment_dir_name,
-                    "error": "No graph data loaded after get_graph_data_and_config (safeguard)",
-                    "graph_data": None,
-                    "protagonist_id": None,
-                    "raw_scope": 0,
-                    "raw_avg_desc_len": 0.0,
-                    "raw_avg_rel_strength": 0.0,
-                    "nodes_count_initial": 0,
-                    "edges_count_initial": 0,
-                }
+                f"  Skipping {experiment_dir_name} due to error: {experiment_data['error']}"
             )
             continue
-
-        raw_scope = calculate_raw_scope_score_unsupervised(graph_data)
-        raw_avg_desc_len = calculate_average_description_length_unsupervised(graph_data)
-        raw_avg_rel_strength = calculate_average_relation_strength_unsupervised(
-            graph_data
-        )
-        nodes_count_initial = len(graph_data.get("nodes", []))
-        edges_count_initial = len(graph_data.get("edges", []))
-
-        all_experiment_data_for_pass1.append(
-            {
-                "dir_name": experiment_dir_name,
-                "graph_data": graph_data,
-                "protagonist_id": protagonist_id,
-                "raw_scope": raw_scope,
-                "raw_avg_desc_len": raw_avg_desc_len,
-                "raw_avg_rel_strength": raw_avg_rel_strength,
-                "nodes_count_initial": nodes_count_initial,
-                "edges_count_initial": edges_count_initial,
-                "error": None,  # Explicitly set no error for successful pass 1
-            }
-        )
         print(
-            f"  Collected: Nodes={nodes_count_initial}, Edges={edges_count_initial}, Scope={raw_scope}, AvgDescLen={raw_avg_desc_len:.2f}, AvgRelStr={raw_avg_rel_strength:.2f}"
+            f"  Collected: Nodes={experiment_data['nodes_count_initial']}, Edges={experiment_data['edges_count_initial']}, Scope={experiment_data['raw_scope']}, AvgDescLen={experiment_data['raw_avg_desc_len']:.2f}, AvgRelStr={experiment_data['raw_avg_rel_strength']:.2f}"
         )
 
     # Calculate overall maximums for normalization after Pass 1
@@ -485,7 +647,7 @@ if __name__ == "__main__":
     valid_pass1_data = [
         d
         for d in all_experiment_data_for_pass1
-        if d.get("error") is None and d.get("graph_data") is not None
+        if d.get("error") is None and d.get("raw_metrics") is not None
     ]
 
     if valid_pass1_data:
@@ -527,7 +689,7 @@ if __name__ == "__main__":
         dir_name = experiment_data["dir_name"]
         print(f"Processing (Pass 2): {dir_name}")
 
-        if experiment_data.get("error") or not experiment_data.get("graph_data"):
+        if experiment_data.get("error") or not experiment_data.get("raw_metrics"):
             print(
                 f"  Skipping {dir_name} due to error in Pass 1: {experiment_data.get('error', 'No graph data')}"
             )
@@ -553,17 +715,11 @@ if __name__ == "__main__":
 
             continue
 
-        eval_scores = evaluate_graph_unsupervised(
-            graph_data=experiment_data["graph_data"],
-            protagonist_id=experiment_data["protagonist_id"],
-            raw_scope_for_this_experiment=experiment_data["raw_scope"],
-            raw_avg_desc_len_for_this_experiment=experiment_data["raw_avg_desc_len"],
-            raw_avg_rel_strength_for_this_experiment=experiment_data[
-                "raw_avg_rel_strength"
-            ],
-            max_overall_raw_scope=max_overall_raw_scope,
-            max_overall_raw_avg_desc_len=max_overall_raw_avg_desc_len,
-            max_overall_raw_avg_rel_strength=max_overall_raw_avg_rel_strength,
+        eval_scores = score_raw_metrics(
+            experiment_data["raw_metrics"],
+            max_overall_raw_scope,
+            max_overall_raw_avg_desc_len,
+            max_overall_raw_avg_rel_strength,
         )
         final_results_unsupervised[dir_name] = eval_scores
         print(f"  Calculated Scores for {dir_name}:")
@@ -10,6 +10,8 @@ from pyvis.network import Network
 import random
 import os
 
+from graphml_stream import iter_graphml
+
 # Load the GraphML file
 # G = nx.read_graphml("./dickens/graph_chunk_entity_relation.graphml")
 
@@ -35,9 +37,23 @@ import os
 # net.show("knowledge_graph.html")
 
 
+def load_graph(graph_path):
+    """按流读取GraphML构造NetworkX图，不像nx.read_graphml那样先解析整个XML文档"""
+    G = nx.Graph()
+    for kind, element in iter_graphml(graph_path):
+        if kind == "graph":
+            if element.get("edgedefault") == "directed":
+                G = nx.DiGraph()
+        elif kind == "node":
+            G.add_node(element.pop("id"), **element)
+        else:
+            G.add_edge(element.pop("source"), element.pop("target"), **element)
+    return G
+
+
 def generate_visualization(graph_path, output_path):
     """Generates a visualization for a given graph file."""
-    G = nx.read_graphml(graph_path)
+    G = load_graph(graph_path)
     net = Network(
         height="100vh", notebook=True, cdn_resources="remote"
     )  # Use remote CDN resources
@@ -52,7 +68,11 @@ def generate_visualization(graph_path, output_path):
         if "description" in edge:
             edge["title"] = edge["description"]
 
-    net.show(output_path)
+    # tobe中的文件是与其他快照共享的硬链接，不能原地改写，写临时文件后替换
+    # （pyvis要求文件名以.html结尾）
+    tmp_path = os.path.join(os.path.dirname(output_path), ".knowledge_graph.tmp.html")
+    net.show(tmp_path)
+    os.replace(tmp_path, output_path)
     print(f"Visualization saved to {output_path}")
 
 
@@ -64,7 +84,8 @@ def generate_visualization(graph_path, output_path):
 tobe_dir = "./tobe"
 for subdir in os.listdir(tobe_dir):
     subdir_path = os.path.join(tobe_dir, subdir)
-    if os.path.isdir(subdir_path):
+    # 跳过快照存储的.blobs和临时目录
+    if not subdir.startswith(".") and os.path.isdir(subdir_path):
         graph_file = os.path.join(subdir_path, "graph_chunk_entity_relation.graphml")
         if os.path.exists(graph_file):
             output_html = os.path.join(subdir_path, "knowledge_graph.html")
@@ -0,0 +1,86 @@
+"""
+GraphML的流式读取
+nx.read_graphml和lightrag的xml_to_json都先把整个XML文档解析进内存，再构造出图谱或
+{"nodes": [...], "edges": [...]}，百万条边的图谱要占用数倍于文件大小的内存。
+
+这里用iterparse逐个读取元素，按<key>声明的attr.name/attr.type转换属性类型，
+元素处理完立即清除并从父元素上摘掉，内存占用不随图谱大小增长：
+    for kind, element in iter_graphml(path):
+        kind为"graph"时element是<graph>的属性（如edgedefault），总是最先产生
+        kind为"node"时element是{"id", **属性}
+        kind为"edge"时element是{"source", "target", **属性}
+"""
+
+import xml.etree.ElementTree as ET
+
+GRAPHML_NS = "{http://graphml.graphdrawing.org/xmlns}"
+KEY_TAG = GRAPHML_NS + "key"
+GRAPH_TAG = GRAPHML_NS + "graph"
+NODE_TAG = GRAPHML_NS + "node"
+EDGE_TAG = GRAPHML_NS + "edge"
+DATA_TAG = GRAPHML_NS + "data"
+DEFAULT_TAG = GRAPHML_NS + "default"
+
+
+def convert_value(text, attr_type):
+    """按GraphML的attr.type转换<data>的文本，空文本取该类型的零值"""
+    text = text or ""
+    if attr_type in ("double", "float"):
+        return float(text) if text.strip() else 0.0
+    if attr_type in ("int", "long"):
+        return int(text) if text.strip() else 0
+    if attr_type == "boolean":
+        return text.strip().lower() in ("true", "1")
+    return text
+
+
+def iter_graphml(path):
+    """逐个产生 (kind, element)，见模块说明"""
+    # key id -> (attr.name, attr.type)；声明了<default>的key按作用域记录默认值
+    keys = {}
+    defaults = {"node": {}, "edge": {}}
+    graph = None
+
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if elem.tag == GRAPH_TAG and graph is None:
+                graph = elem
+                yield "graph", dict(elem.attrib)
+            continue
+
+        if elem.tag == KEY_TAG:
+            name = elem.get("attr.name") or elem.get("id")
+            attr_type = elem.get("attr.type")
+            keys[elem.get("id")] = (name, attr_type)
+            default = elem.find(DEFAULT_TAG)
+            if default is not None:
+                value = convert_value(default.text, attr_type)
+                domain = elem.get("for", "all")
+                for kind in ("node", "edge"):
+                    if domain in (kind, "all"):
+                        defaults[kind][name] = value
+        elif elem.tag in (NODE_TAG, EDGE_TAG):
+            kind = "node" if elem.tag == NODE_TAG else "edge"
+            if kind == "node":
+                element = {"id": elem.get("id")}
+            else:
+                element = {"source": elem.get("source"), "target": elem.get("target")}
+            for name, value in defaults[kind].items():
+                element.setdefault(name, value)
+            for data in elem.iter(DATA_TAG):
+                name, attr_type = keys.get(data.get("key"), (data.get("key"), None))
+                element[name] = convert_value(data.text, attr_type)
+            elem.clear()
+            # 摘掉已处理的元素，<graph>下不会堆积空元素
+            if graph is not None and len(graph) and graph[-1] is elem:
+                del graph[-1]
+            yield kind, element
+
+
+def read_graphml(path):
+    """一次读出完整的 {"nodes": [...], "edges": [...]}（需要随机访问整个图谱时使用）"""
+    graph_data = {"nodes": [], "edges": []}
+    for kind, element in iter_graphml(path):
+        if kind != "graph":
+            graph_data[kind + "s"].append(element)
+    return graph_data
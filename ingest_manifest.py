@@ -0,0 +1,93 @@
+"""
+增量插入清单
+在WORKING_DIR中记录每个输入文件的内容哈希、插入时使用的提示词哈希以及对应的doc_id，
+重复运行insert.py时，内容和提示词都未变化的文件在任何LLM/Embedding调用之前就被跳过。
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+
+# 影响实体抽取结果的提示词条目
+EXTRACTION_PROMPT_KEYS = [
+    "DEFAULT_LANGUAGE",
+    "DEFAULT_TUPLE_DELIMITER",
+    "DEFAULT_RECORD_DELIMITER",
+    "DEFAULT_COMPLETION_DELIMITER",
+    "DEFAULT_ENTITY_TYPES",
+    "entity_extraction",
+    "entity_extraction_examples",
+    "entity_continue_extraction",
+    "entity_if_loop_extraction",
+    "summarize_entity_descriptions",
+]
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """分块计算文件内容的sha256，不把整个文件读入内存"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def compute_prompt_hash(prompts):
+    """计算当前生效的抽取提示词的哈希"""
+    payload = {key: prompts.get(key) for key in EXTRACTION_PROMPT_KEYS}
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class IngestManifest:
+    """WORKING_DIR/ingest_manifest.json 的读写封装
+
+    文件格式：
+        {"files": {文件路径: {"content_hash", "prompt_hash", "doc_ids", "updated_at"}}}
+    只有成功处理的文件才会被记录。
+    """
+
+    def __init__(self, working_dir):
+        self.path = os.path.join(working_dir, MANIFEST_FILENAME)
+        self.files = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def find(self, content_hash, prompt_hash):
+        """查找内容与提示词都相同的已插入记录（文件被改名也能命中）"""
+        for entry in self.files.values():
+            if (
+                entry["content_hash"] == content_hash
+                and entry["prompt_hash"] == prompt_hash
+            ):
+                return entry
+        return None
+
+    def stale_doc_ids(self, file_path, keep_doc_ids=()):
+        """该路径此前插入、但内容或提示词已变化的doc_id（需要先从LightRAG中删除）"""
+        entry = self.files.get(file_path)
+        if not entry:
+            return []
+        return [d for d in entry["doc_ids"] if d not in keep_doc_ids]
+
+    def record(self, file_path, content_hash, prompt_hash, doc_ids):
+        self.files[file_path] = {
+            "content_hash": content_hash,
+            "prompt_hash": prompt_hash,
+            "doc_ids": list(doc_ids),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def forget(self, file_path):
+        self.files.pop(file_path, None)
+
+    def save(self):
+        """先写临时文件再替换，避免进程中途退出留下半个清单"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
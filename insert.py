@@ -1,75 +1,292 @@
 import os
+import json
+import argparse
 from dotenv import load_dotenv
 import asyncio
 import logging
+import signal
+import xml.etree.ElementTree as ET
+from functools import partial
+import lightrag.lightrag as lightrag_module
 from lightrag import LightRAG
-from lightrag.llm.openai import openai_complete_if_cache, openai_embed
-from lightrag.utils import EmbeddingFunc
+from lightrag.utils import EmbeddingFunc, clean_text, compute_mdhash_id
 import numpy as np
 from lightrag.kg.shared_storage import initialize_pipeline_status
+from lightrag.operate import chunking_by_token_size
+from lightrag.base import DocStatus
 from lightrag.prompt import PROMPTS
-
-print(
-    f"使用PROMPT{PROMPTS['entity_extraction']}和{PROMPTS['entity_continue_extraction']}进行实体抽取"
+from adaptive_limiter import AdaptiveConcurrencyLimiter
+from checkpoint import LOG_FILENAME, CheckpointManager
+from chunk_dedup import ChunkDeduplicator
+from corpus_reader import iter_text_segments
+from embedding_cache import EmbeddingCache
+from ingest_manifest import IngestManifest, compute_prompt_hash, file_sha256
+from llm_response_cache import LLMResponseCache, request_key
+from mmap_vector_store import register_mmap_vector_storage
+from openai_client import (
+    chat_complete_attempt,
+    close_openai_client,
+    embed_texts,
+    with_chat_retry,
+)
+from pipeline_settings import chunking_settings, extraction_settings
+from pre_extraction_stage import PreExtractionStage
+from process_supervisor import EVENT_PREFIX
+from prompt_overrides import (
+    apply_prompt_overrides,
+    load_prompt_overrides,
+    parse_prompt_argument,
 )
+from telemetry import Telemetry
+
+try:
+    import resource
+except ImportError:  # 非POSIX平台无法读取峰值内存
+    resource = None
+
+load_dotenv()
 
+WORKING_DIR = os.getenv("WORKING_DIR", "./dickens")
+if not os.path.exists(WORKING_DIR):
+    os.mkdir(WORKING_DIR)
 
 # 设置简单的日志记录 - 同时输出到控制台和文件
+# 日志写在工作目录中，并行运行的多个版本不会写进同一个文件
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
     handlers=[
-        logging.FileHandler("insert.log"),
+        logging.FileHandler(os.path.join(WORKING_DIR, LOG_FILENAME)),
         logging.StreamHandler(),  # 添加控制台输出
     ],
 )
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+INSERT_DIR = os.getenv("INSERT_DIR", "inputs")
+# 影响切分和抽取结果的参数，与source_modifier.py计算sweep_hash时读取的相同（见pipeline_settings.py）
+PIPELINE_SETTINGS = extraction_settings()
+# 同时处于抽取阶段的文档数上限（交给LightRAG的max_parallel_insert控制）
+MAX_PARALLEL_INSERT = int(os.getenv("MAX_PARALLEL_INSERT", "4"))
+# 超过该大小(字节)的文件走流式插入，按章节/段落切成不超过STREAM_SEGMENT_CHARS字符的片段
+STREAM_THRESHOLD_BYTES = PIPELINE_SETTINGS["stream_threshold_bytes"]
+STREAM_SEGMENT_CHARS = PIPELINE_SETTINGS["stream_segment_chars"]
 
-WORKING_DIR = os.getenv("WORKING_DIR", "./dickens")
-if not os.path.exists(WORKING_DIR):
-    os.mkdir(WORKING_DIR)
+# 切分参数（与LightRAG读取的环境变量相同），预抽取阶段的key也由它们计算
+CHUNK_SIZE = PIPELINE_SETTINGS["chunk_token_size"]
+CHUNK_OVERLAP_SIZE = PIPELINE_SETTINGS["chunk_overlap_token_size"]
 
+# 与提示词无关的预抽取阶段（切分、chunk向量、full_docs）的缓存目录，见pre_extraction_stage.py
+STAGE_CACHE_DIR = os.getenv("STAGE_CACHE_DIR", "./stage_cache")
 
-async def llm_model_func(
-    prompt, system_prompt=None, history_messages=[], keyword_extraction=False, **kwargs
-) -> str:
-    return await openai_complete_if_cache(
-        model=os.getenv("OPENAI_CHAT_MODEL") or "gpt-4o",
+# 向量存储后端，默认使用内存映射的.npy存储（见mmap_vector_store.py）；
+# 设为NanoVectorDBStorage可回到原来的vdb_*.json
+VECTOR_STORAGE = PIPELINE_SETTINGS["vector_storage"]
+register_mmap_vector_storage()
+
+# 所有工作目录共享的embedding缓存（按模型+文本哈希寻址）
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+embedding_cache = EmbeddingCache(
+    EMBEDDING_CACHE_DIR, os.getenv("OPENAI_EMBEDDINGS_MODEL")
+)
+
+# 常见embedding模型的向量维度，启动时无需发起探测请求；其他模型可用EMBEDDING_DIM覆盖
+EMBEDDING_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+    "bge-m3": 1024,
+    "BAAI/bge-m3": 1024,
+    "nomic-embed-text": 768,
+    "text-embedding-v3": 1024,
+}
+EMBEDDING_DIM_FILE = os.path.join(WORKING_DIR, "embedding_dim.json")
+
+# 两次检查点之间的最短间隔（秒），检查点在每个文档落盘后保存
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", "30"))
+
+# 跳过完全重复和近重复chunk的实体抽取（见chunk_dedup.py），默认关闭
+CHUNK_DEDUP = PIPELINE_SETTINGS["chunk_dedup"]
+CHUNK_DEDUP_THRESHOLD = float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.85"))
+# 每个chunk的补充抽取轮数（LightRAG默认1），也用于估计去重节省的LLM调用
+ENTITY_EXTRACT_MAX_GLEANING = PIPELINE_SETTINGS["entity_extract_max_gleaning"]
+
+# 只对按文档和位置分层抽样的这部分chunk做抽取（source_modifier.py --halving逐步淘汰版本时使用）
+CHUNK_SAMPLE_FRACTION = float(os.getenv("CHUNK_SAMPLE_FRACTION", "1"))
+GOLDEN_RATIO_CONJUGATE = (5**0.5 - 1) / 2
+
+# 每次LLM/Embedding调用的遥测，追踪文件写入WORKING_DIR/llm_trace.jsonl
+telemetry = Telemetry(WORKING_DIR)
+# 设置后在运行结束时额外导出Prometheus文本格式的指标
+TELEMETRY_PROMETHEUS_FILE = os.getenv("TELEMETRY_PROMETHEUS_FILE")
+
+# LLM并发窗口在[LLM_MIN_ASYNC, LLM_MAX_ASYNC]之间根据延迟和限流情况自适应调整
+llm_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=int(os.getenv("LLM_INITIAL_ASYNC", "5")),
+    min_limit=int(os.getenv("LLM_MIN_ASYNC", "1")),
+    max_limit=int(os.getenv("LLM_MAX_ASYNC", "32")),
+)
+
+
+# 所有工作目录/提示词版本共享的LLM响应缓存（按模型+完整请求内容寻址）
+LLM_CACHE_FILE = os.getenv("LLM_CACHE_FILE", "./llm_response_cache.sqlite")
+llm_response_cache = LLMResponseCache(
+    LLM_CACHE_FILE,
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", "1024")) * 1024 * 1024,
+    max_age_days=float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", "90")),
+)
+
+
+# 重试在并发窗口之外：每次尝试单独占用窗口、单独向llm_limiter报告结果，
+# 429在第一次出现时就触发乘性退避，重试的等待期间也不占用窗口
+@with_chat_retry
+@llm_limiter.wrap
+async def call_llm(
+    model, prompt, system_prompt, history_messages, call_stats=None, **kwargs
+):
+    # 所有调用复用同一个带连接池的客户端（见openai_client.py）
+    return await chat_complete_attempt(
+        model=model,
         prompt=prompt,
         system_prompt=system_prompt,
         history_messages=history_messages,
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_API_BASE"),
+        call_stats=call_stats,
         **kwargs,
     )
 
 
-async def embedding_func(texts: list[str]) -> np.ndarray:
-    return await openai_embed(
-        texts,
-        model=os.getenv("OPENAI_EMBEDDINGS_MODEL"),
-        api_key=os.getenv("OPENAI_API_KEY"),
-        base_url=os.getenv("OPENAI_API_BASE"),
+async def llm_model_func(
+    prompt, system_prompt=None, history_messages=[], keyword_extraction=False, **kwargs
+) -> str:
+    kwargs.pop("hashing_kv", None)
+    model = os.getenv("OPENAI_CHAT_MODEL") or "gpt-4o"
+    key = request_key(model, prompt, system_prompt, history_messages, **kwargs)
+    async with telemetry.track("llm") as call:
+        # 命中共享缓存时不占用并发窗口
+        response = llm_response_cache.get(key)
+        call["cache_hits"] = int(response is not None)
+        call["cache_misses"] = int(response is None)
+        if response is None:
+            response = await call_llm(
+                model,
+                prompt,
+                system_prompt,
+                history_messages,
+                call_stats=call,
+                **kwargs,
+            )
+            llm_response_cache.put(key, model, response)
+        return response
+
+
+async def fetch_embeddings(texts: list[str], call_stats=None) -> np.ndarray:
+    return await embed_texts(
+        texts, model=os.getenv("OPENAI_EMBEDDINGS_MODEL"), call_stats=call_stats
     )
 
 
+async def embedding_func(texts: list[str]) -> np.ndarray:
+    # 只有缓存中没有的文本才会请求embedding接口
+    async with telemetry.track("embedding", texts=len(texts)) as call:
+        return await embedding_cache.get_or_compute(
+            texts, partial(fetch_embeddings, call_stats=call), stats=call
+        )
+
+
+def read_embedding_dim_record(model):
+    """读取工作目录中持久化的维度记录（模型不一致时视为无效）"""
+    if not os.path.exists(EMBEDDING_DIM_FILE):
+        return None
+    try:
+        with open(EMBEDDING_DIM_FILE, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable {EMBEDDING_DIM_FILE}: {e}")
+        return None
+    return record.get("dim") if record.get("model") == model else None
+
+
+def write_embedding_dim_record(model, dim):
+    with open(EMBEDDING_DIM_FILE, "w", encoding="utf-8") as f:
+        json.dump({"model": model, "dim": dim}, f)
+
+
 async def get_embedding_dim():
-    test_text = ["This is a test sentence."]
-    embedding = await embedding_func(test_text)
-    embedding_dim = embedding.shape[1]
+    """确定embedding维度，按以下顺序解析，只有都无法确定时才发起一次真实的探测请求：
+
+    1. 环境变量 EMBEDDING_DIM
+    2. 工作目录中的 embedding_dim.json
+    3. 静态表 EMBEDDING_DIMS
+    4. 共享embedding缓存中记录的维度
+    """
+    model = os.getenv("OPENAI_EMBEDDINGS_MODEL")
+    recorded_dim = read_embedding_dim_record(model)
+    if os.getenv("EMBEDDING_DIM"):
+        embedding_dim, source = int(os.getenv("EMBEDDING_DIM")), "EMBEDDING_DIM"
+    elif recorded_dim:
+        embedding_dim, source = recorded_dim, EMBEDDING_DIM_FILE
+    elif model in EMBEDDING_DIMS:
+        embedding_dim, source = EMBEDDING_DIMS[model], "static model table"
+    elif embedding_cache.dim:
+        embedding_dim, source = embedding_cache.dim, "embedding cache"
+    else:
+        test_text = ["This is a test sentence."]
+        embedding = await embedding_func(test_text)
+        embedding_dim, source = embedding.shape[1], "live probe"
+
+    logger.info(f"Embedding dimension {embedding_dim} resolved from {source}")
+    if source != EMBEDDING_DIM_FILE:
+        write_embedding_dim_record(model, embedding_dim)
     return embedding_dim
 
 
-async def initialize_rag():
+def sample_chunks(chunks, fraction):
+    """从一个文档的chunks中分层抽取约fraction比例的chunk
+
+    第i个chunk的排序键为 i*φ mod 1（低差异序列），任意比例下选中的chunk都均匀分布在整个文档中，
+    且比例增大时选中的集合只增不减：已经抽取过的chunk在更大的样本中直接命中LLM响应缓存。
+    第0个chunk的键为0，每个文档至少保留一个chunk。
+    """
+    if fraction >= 1:
+        return chunks
+    return [
+        chunk
+        for i, chunk in enumerate(chunks)
+        if (i * GOLDEN_RATIO_CONJUGATE) % 1 < fraction
+    ]
+
+
+def sampling_chunking_func(chunking_func, fraction):
+    def chunking_with_sample(tokenizer, content, *args, **kwargs):
+        return sample_chunks(
+            chunking_func(tokenizer, content, *args, **kwargs), fraction
+        )
+
+    return chunking_with_sample
+
+
+async def initialize_rag(chunk_dedup=None, stage=None):
     embedding_dimension = await get_embedding_dim()
-    logger.info(f"Detected embedding dimension: {embedding_dimension}")
+    chunking_func = chunking_by_token_size
+    if stage:
+        chunking_func = stage.wrap(chunking_func)
+    if CHUNK_SAMPLE_FRACTION < 1:
+        chunking_func = sampling_chunking_func(chunking_func, CHUNK_SAMPLE_FRACTION)
+    if chunk_dedup:
+        chunking_func = chunk_dedup.wrap(chunking_func)
 
     rag = LightRAG(
         working_dir=WORKING_DIR,
         llm_model_func=llm_model_func,
-        llm_model_max_async=5,
+        # 实际并发由llm_limiter控制，这里只作为上限
+        llm_model_max_async=llm_limiter.max_limit,
+        max_parallel_insert=MAX_PARALLEL_INSERT,
+        chunk_token_size=CHUNK_SIZE,
+        chunk_overlap_token_size=CHUNK_OVERLAP_SIZE,
+        entity_extract_max_gleaning=ENTITY_EXTRACT_MAX_GLEANING,
+        vector_storage=VECTOR_STORAGE,
+        # 抽取结果由共享的llm_response_cache缓存，不再写入每个工作目录的kv_store_llm_response_cache.json
+        enable_llm_cache_for_entity_extract=False,
+        chunking_func=chunking_func,
         embedding_func=EmbeddingFunc(
             embedding_dim=embedding_dimension,
             max_token_size=8192,
@@ -79,35 +296,522 @@ async def initialize_rag():
 
     await rag.initialize_storages()
     await initialize_pipeline_status()
+    if chunk_dedup:
+        chunk_dedup.attach(rag)
     logger.info("RAG instance initialized successfully")
 
     return rag
 
 
-async def main():
+def emit_event(event, **fields):
+    """向标准输出写一行结构化进度事件（由process_supervisor.py解析）"""
+    payload = json.dumps({"event": event, **fields}, ensure_ascii=False, default=str)
+    print(f"{EVENT_PREFIX}{payload}", flush=True)
+
+
+def attach_progress_events(rag):
+    """LightRAG每次落盘（每处理完一个文档）后输出当前的文档状态统计"""
+    insert_done = rag._insert_done
+
+    async def insert_done_with_progress(*args, **kwargs):
+        await insert_done(*args, **kwargs)
+        emit_event("progress", doc_status=await rag.doc_status.get_status_counts())
+
+    rag._insert_done = insert_done_with_progress
+
+
+def attach_step_timers(rag):
+    """分别计时实体抽取和合并（遥测中的extract / merge，见Telemetry.step）
+
+    LightRAG在process_document中调用_process_entity_relation_graph抽取，
+    再调用lightrag.lightrag模块中的merge_nodes_and_edges合并，两者都在这里包装。
+    """
+    process_graph = rag._process_entity_relation_graph
+    merge_nodes_and_edges = lightrag_module.merge_nodes_and_edges
+
+    async def timed_process_graph(*args, **kwargs):
+        async with telemetry.step("extract"):
+            return await process_graph(*args, **kwargs)
+
+    async def timed_merge_nodes_and_edges(*args, **kwargs):
+        async with telemetry.step("merge"):
+            return await merge_nodes_and_edges(*args, **kwargs)
+
+    rag._process_entity_relation_graph = timed_process_graph
+    lightrag_module.merge_nodes_and_edges = timed_merge_nodes_and_edges
+
+
+def handle_termination(signum, frame):
+    """收到SIGTERM/SIGINT时立即退出
+
+    LightRAG的流水线任务不会及时响应取消，asyncio.run退出时会一直等待它们。
+    已完成的文档在检查点中，已完成的LLM调用在共享缓存中，用--resume即可继续，
+    这里只需要写出遥测追踪并关闭缓存。
+    """
+    logger.warning(f"Received signal {signum}, exiting (continue with --resume)")
+    print(f"INSERT_FAILED: interrupted by signal {signum}", flush=True)
+    telemetry.close()
+    llm_response_cache.close()
+    logging.shutdown()
+    os._exit(128 + signum)
+
+
+def list_input_files(insert_dir):
+    """列出待插入的.txt文件（排序保证每次运行顺序一致）"""
+    return sorted(
+        os.path.join(insert_dir, file)
+        for file in os.listdir(insert_dir)
+        if file.endswith(".txt")
+    )
+
+
+async def open_pre_extraction_stage(content_hashes):
+    """按输入文件和所有影响切分/向量的参数定位预抽取阶段（不一定已经构建）"""
+    settings = {**chunking_settings(), "embedding_dim": await get_embedding_dim()}
+    return PreExtractionStage(STAGE_CACHE_DIR, content_hashes, settings)
+
+
+def iter_documents(file_paths):
+    """按insert_files的方式把文件拆成LightRAG文档：(文件路径, 文本)"""
+    for file_path in file_paths:
+        if os.path.getsize(file_path) >= STREAM_THRESHOLD_BYTES:
+            for segment in iter_text_segments(
+                file_path, max_chars=STREAM_SEGMENT_CHARS
+            ):
+                yield file_path, segment
+        else:
+            with open(file_path, "r", encoding="utf-8") as f:
+                yield file_path, f.read()
+
+
+async def build_stage():
+    """只构建INSERT_DIR的预抽取阶段（切分、chunk向量、full_docs），不调用LLM
+
+    在WORKING_DIR（应为空目录）中构建后发布到STAGE_CACHE_DIR，已存在时直接返回。
+    """
+    try:
+        file_paths = list_input_files(INSERT_DIR)
+        stage = await open_pre_extraction_stage(
+            {file_path: file_sha256(file_path) for file_path in file_paths}
+        )
+        if stage.exists():
+            logger.info(f"Pre-extraction stage {stage.key} already built")
+        else:
+            logger.info(f"Building pre-extraction stage {stage.key} for {INSERT_DIR}")
+            chunk_dedup = (
+                ChunkDeduplicator(WORKING_DIR, threshold=CHUNK_DEDUP_THRESHOLD)
+                if CHUNK_DEDUP
+                else None
+            )
+            rag = await initialize_rag()
+            await stage.build(
+                rag, iter_documents(file_paths), chunking_by_token_size, chunk_dedup
+            )
+            state = stage.publish(WORKING_DIR)
+            logger.info(
+                f"Pre-extraction stage {stage.key}: {state['documents']} documents, "
+                f"{state['chunks']} chunks"
+            )
+            logger.info(
+                f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses"
+            )
+        emit_event("stage", key=stage.key, path=stage.path)
+        print("INSERT_COMPLETED_SUCCESSFULLY", flush=True)
+
+        await close_openai_client()
+        telemetry.close()
+        llm_response_cache.close()
+    except Exception as e:
+        logger.error(f"An error occurred: {e}")
+        print(f"INSERT_FAILED: {e}", flush=True)
+        raise
+
+
+async def get_doc_statuses(rag, contents):
+    """按内容计算doc_id并查询LightRAG中的文档状态
+
+    LightRAG在单个文档失败时只记录FAILED状态而不抛异常，因此需要逐个查询。
+    """
+    statuses = []
+    for content in contents:
+        doc_id = compute_mdhash_id(clean_text(content), prefix="doc-")
+        doc = await rag.doc_status.get_by_id(doc_id) or {}
+        statuses.append(
+            {
+                "doc_id": doc_id,
+                "status": DocStatus(doc["status"]).value if doc else "missing",
+                "chunks": doc.get("chunks_count", 0),
+                "error": doc.get("error"),
+            }
+        )
+    return statuses
+
+
+async def insert_file_streaming(rag, file_path):
+    """大文件流式插入：逐段读取，每凑满MAX_PARALLEL_INSERT个片段送入LightRAG一次
+
+    内存中只保留一批片段，峰值与文件大小无关。返回该文件的汇总结果。
+    """
+    logger.info(
+        f"Streaming {file_path} in segments of up to {STREAM_SEGMENT_CHARS} characters"
+    )
+    segments_total = 0
+    segments_failed = 0
+    chunks = 0
+    first_error = None
+    batch = []
+
+    doc_ids = []
+
+    async def flush():
+        nonlocal segments_failed, chunks, first_error
+        await rag.ainsert(batch, file_paths=[file_path] * len(batch))
+        for status in await get_doc_statuses(rag, batch):
+            doc_ids.append(status["doc_id"])
+            chunks += status["chunks"]
+            if status["status"] != DocStatus.PROCESSED:
+                segments_failed += 1
+                first_error = first_error or status["error"] or status["status"]
+        batch.clear()
+
+    for segment in iter_text_segments(file_path, max_chars=STREAM_SEGMENT_CHARS):
+        batch.append(segment)
+        segments_total += 1
+        if len(batch) >= MAX_PARALLEL_INSERT:
+            await flush()
+            logger.info(f"  {file_path}: {segments_total} segments inserted")
+    if batch:
+        await flush()
+
+    return {
+        "file": file_path,
+        "doc_ids": doc_ids,
+        "status": DocStatus.FAILED.value
+        if segments_failed
+        else DocStatus.PROCESSED.value,
+        "chunks": chunks,
+        "error": (
+            f"{segments_failed}/{segments_total} segments failed: {first_error}"
+            if segments_failed
+            else None
+        ),
+    }
+
+
+async def insert_files(rag, file_paths):
+    """插入所有文件，返回每个文件的处理结果：{"file", "doc_ids", "status", "chunks", "error"}
+
+    普通文件一次性全部入队，由LightRAG按max_parallel_insert并发抽取；
+    超过STREAM_THRESHOLD_BYTES的大文件逐个流式插入。
+    """
+    small_files = [p for p in file_paths if os.path.getsize(p) < STREAM_THRESHOLD_BYTES]
+    large_files = [p for p in file_paths if p not in small_files]
+
+    results = {}
+    if small_files:
+        contents = []
+        for file_path in small_files:
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            logger.info(f"File {file_path} has {len(content)} characters")
+            contents.append(content)
+
+        logger.info(
+            f"Inserting {len(contents)} files (max {MAX_PARALLEL_INSERT} in flight)..."
+        )
+        await rag.ainsert(contents, file_paths=small_files)
+        statuses = await get_doc_statuses(rag, contents)
+        for file_path, status in zip(small_files, statuses):
+            doc_id = status.pop("doc_id")
+            results[file_path] = {"file": file_path, "doc_ids": [doc_id], **status}
+
+    for file_path in large_files:
+        results[file_path] = await insert_file_streaming(rag, file_path)
+
+    return [results[p] for p in file_paths]
+
+
+def plan_ingestion(manifest, file_paths, prompt_hash):
+    """按(内容哈希, 提示词哈希)把文件分成需要插入和可以跳过的两组
+
+    返回 (to_insert, skipped, content_hashes)，skipped为{文件路径: 清单记录}。
+    """
+    to_insert = []
+    skipped = {}
+    content_hashes = {}
+    for file_path in file_paths:
+        content_hash = file_sha256(file_path)
+        content_hashes[file_path] = content_hash
+        entry = manifest.find(content_hash, prompt_hash)
+        if entry:
+            skipped[file_path] = entry
+        else:
+            to_insert.append(file_path)
+    return to_insert, skipped, content_hashes
+
+
+def reinsert_dedup_dependents(manifest, chunk_dedup, to_insert, skipped):
+    """未变化的文件如果有chunk以即将被删除的文档中的chunk为代表而被跳过，也需要重新插入"""
+    keep_doc_ids = {d for entry in skipped.values() for d in entry["doc_ids"]}
+    stale_doc_ids = {
+        d
+        for file_path in to_insert
+        for d in manifest.stale_doc_ids(file_path, keep_doc_ids)
+    }
+    dependents = chunk_dedup.dependent_docs(stale_doc_ids)
+    moved = [
+        file_path
+        for file_path, entry in skipped.items()
+        if dependents.intersection(entry["doc_ids"])
+    ]
+    for file_path in moved:
+        logger.info(
+            f"Re-inserting {file_path}: its duplicate chunks were represented by a removed document"
+        )
+        skipped.pop(file_path)
+    return to_insert + moved, skipped
+
+
+async def delete_stale_docs(rag, manifest, to_insert, skipped, chunk_dedup=None):
+    """删除内容或提示词已变化的文件此前插入的文档，使其能够按新内容/新提示词重新抽取"""
+    keep_doc_ids = {d for entry in skipped.values() for d in entry["doc_ids"]}
+    for file_path in to_insert:
+        stale_doc_ids = manifest.stale_doc_ids(file_path, keep_doc_ids)
+        for doc_id in stale_doc_ids:
+            logger.info(f"Removing stale document {doc_id} of {file_path}")
+            await rag.adelete_by_doc_id(doc_id)
+        if chunk_dedup:
+            chunk_dedup.forget_docs(stale_doc_ids)
+        manifest.forget(file_path)
+
+
+def log_insert_summary(results):
+    """输出每个文件的成功/失败汇总，返回失败文件数"""
+    marks = {DocStatus.PROCESSED: "✅", "skipped": "⏭️"}
+    failed = [r for r in results if r["status"] not in marks]
+    logger.info("Per-file insert summary:")
+    for r in results:
+        mark = marks.get(r["status"], "❌")
+        line = f"  {mark} {r['file']}: {r['status']} ({r['chunks']} chunks)"
+        if r["error"]:
+            line += f" - {r['error']}"
+        logger.info(line)
+    logger.info(
+        f"Files succeeded: {len(results) - len(failed)}/{len(results)}, failed: {len(failed)}"
+    )
+    return len(failed)
+
+
+def log_telemetry_summary(results, chunk_dedup=None):
+    """输出并保存本次运行的调用遥测汇总"""
+    chunks = sum(r["chunks"] for r in results)
+    extra = {}
+    if chunk_dedup:
+        extra["chunk_dedup"] = chunk_dedup.report(
+            max_gleaning=ENTITY_EXTRACT_MAX_GLEANING
+        )
+        logger.info(
+            f"Chunk dedup: skipped {extra['chunk_dedup']['skipped']}/"
+            f"{extra['chunk_dedup']['chunks']} chunks "
+            f"({extra['chunk_dedup']['exact_duplicates']} exact, "
+            f"{extra['chunk_dedup']['near_duplicates']} near-duplicate), "
+            f"~{extra['chunk_dedup']['llm_calls_saved']} LLM calls saved"
+        )
+    summary = telemetry.write_summary(chunks, **extra)
+    logger.info(
+        "Stage wall times: "
+        + ", ".join(
+            f"{stage} {seconds:.1f}s" for stage, seconds in summary["stages"].items()
+        )
+    )
+    for kind, stats in summary["kinds"].items():
+        logger.info(
+            f"{kind}: {stats['calls']} calls, {stats['errors']} errors, "
+            f"{stats['retries']} retries, "
+            f"p50/p95/p99 {stats['latency_p50']:.2f}/{stats['latency_p95']:.2f}/"
+            f"{stats['latency_p99']:.2f}s, "
+            f"{stats['prompt_tokens']}+{stats['completion_tokens']} tokens "
+            f"({stats['tokens_per_sec']:.1f} tokens/s), "
+            f"cache hit rate {stats['cache_hit_rate']:.1%}, "
+            f"{stats['calls_per_chunk']:.2f} calls/chunk"
+        )
+    if TELEMETRY_PROMETHEUS_FILE:
+        telemetry.write_prometheus(TELEMETRY_PROMETHEUS_FILE, chunks)
+        logger.info(f"Prometheus metrics written to {TELEMETRY_PROMETHEUS_FILE}")
+    return summary
+
+
+def count_graph_elements(graphml_path):
+    """逐个元素解析GraphML，返回 (节点数, 边数)，不把整个图读入内存"""
+    nodes = edges = 0
+    if not os.path.exists(graphml_path):
+        return nodes, edges
+    for _, element in ET.iterparse(graphml_path):
+        tag = element.tag.rsplit("}", 1)[-1]
+        if tag == "node":
+            nodes += 1
+        elif tag == "edge":
+            edges += 1
+        element.clear()
+    return nodes, edges
+
+
+def emit_performance_report(summary):
+    """输出本次运行的性能报告事件（source_modifier.py把它写进每个版本的结果行）"""
+    llm = summary["kinds"].get("llm", {})
+    embedding = summary["kinds"].get("embedding", {})
+    nodes, edges = count_graph_elements(
+        os.path.join(WORKING_DIR, "graph_chunk_entity_relation.graphml")
+    )
+    # Linux上ru_maxrss的单位为KB
+    peak_rss_mb = (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource else None
+    )
+    emit_event(
+        "report",
+        stages=summary["stages"],
+        chunks=summary["chunks"],
+        llm_calls=llm.get("calls", 0),
+        prompt_tokens=llm.get("prompt_tokens", 0),
+        completion_tokens=llm.get("completion_tokens", 0),
+        llm_cache_hit_rate=llm.get("cache_hit_rate", 0.0),
+        embedding_calls=embedding.get("calls", 0),
+        peak_rss_mb=peak_rss_mb,
+        graph_nodes=nodes,
+        graph_edges=edges,
+    )
+
+
+async def main(resume=False, prompt_overrides=None, use_stage=False):
     try:
         logger.info("Starting RAG insertion process")
+        telemetry.start_stage("prepare")
 
-        # Initialize RAG instance
-        rag = await initialize_rag()
+        # 提示词覆盖直接作用于内存中的PROMPTS，必须在计算提示词哈希之前
+        if prompt_overrides:
+            apply_prompt_overrides(prompt_overrides)
+            logger.info(f"Prompt overrides applied: {sorted(prompt_overrides)}")
+        print(
+            f"使用PROMPT{PROMPTS['entity_extraction']}和{PROMPTS['entity_continue_extraction']}进行实体抽取"
+        )
+
+        checkpoints = CheckpointManager(WORKING_DIR, CHECKPOINT_INTERVAL)
+        if resume:
+            state = checkpoints.restore()
+            if state:
+                logger.info(
+                    f"Resuming from checkpoint saved at {state['created_at']:.0f} "
+                    f"(doc status {state['doc_status']})"
+                )
+            else:
+                logger.info("No checkpoint found, resuming from working dir as is")
+        else:
+            checkpoints.clear()
 
-        insert_dir = "inputs"
-        logger.info(f"Processing files from directory: {insert_dir}")
+        logger.info(f"Processing files from directory: {INSERT_DIR}")
+        file_paths = list_input_files(INSERT_DIR)
 
-        files_processed = 0
-        for file in os.listdir(insert_dir):
-            if file.endswith(".txt"):
-                logger.info(f"Inserting {file} into RAG...")
-                with open(f"{insert_dir}/{file}", "r", encoding="utf-8") as f:
-                    content = f.read()
-                    logger.info(f"File {file} has {len(content)} characters")
-                    await rag.ainsert(content)
-                files_processed += 1
-                logger.info(f"Successfully inserted {file}")
+        # 在任何LLM/Embedding调用之前，根据清单跳过内容和提示词都未变化的文件
+        prompt_hash = compute_prompt_hash(PROMPTS)
+        if CHUNK_SAMPLE_FRACTION < 1:
+            # 只抽取了部分chunk的文件不能算作按该提示词完整插入过
+            prompt_hash = f"{prompt_hash}@sample{CHUNK_SAMPLE_FRACTION}"
+            logger.info(f"Extracting a {CHUNK_SAMPLE_FRACTION:.1%} sample of chunks")
+        manifest = IngestManifest(WORKING_DIR)
+        to_insert, skipped, content_hashes = plan_ingestion(
+            manifest, file_paths, prompt_hash
+        )
 
+        stage = None
+        if use_stage:
+            stage = await open_pre_extraction_stage(content_hashes)
+            if not stage.exists():
+                logger.warning(
+                    f"Pre-extraction stage {stage.key} not built, running all stages"
+                )
+                stage = None
+            elif not os.path.exists(
+                os.path.join(WORKING_DIR, "kv_store_full_docs.json")
+            ):
+                # 只往空的工作目录里复制，已有的文档（增量插入、--resume）不能被覆盖
+                stage.seed(WORKING_DIR)
+
+        # 在恢复检查点和复制预抽取阶段之后加载，保证索引与工作目录中的其他存储一致
+        chunk_dedup = (
+            ChunkDeduplicator(WORKING_DIR, threshold=CHUNK_DEDUP_THRESHOLD)
+            if CHUNK_DEDUP
+            else None
+        )
+        if chunk_dedup:
+            to_insert, skipped = reinsert_dedup_dependents(
+                manifest, chunk_dedup, to_insert, skipped
+            )
         logger.info(
-            f"✅ Insert completed successfully! Processed {files_processed} files"
+            f"{len(to_insert)} files to insert, {len(skipped)} unchanged files skipped"
         )
+        emit_event("planned", files=len(file_paths), to_insert=len(to_insert))
+
+        results = {
+            file_path: {
+                "file": file_path,
+                "doc_ids": entry["doc_ids"],
+                "status": "skipped",
+                "chunks": 0,
+                "error": None,
+            }
+            for file_path, entry in skipped.items()
+        }
+        for file_path, entry in skipped.items():
+            manifest.record(
+                file_path, entry["content_hash"], prompt_hash, entry["doc_ids"]
+            )
+
+        if to_insert:
+            # Initialize RAG instance
+            telemetry.start_stage("initialize")
+            rag = await initialize_rag(chunk_dedup, stage)
+            checkpoints.attach(rag)
+            attach_progress_events(rag)
+            attach_step_timers(rag)
+            await delete_stale_docs(rag, manifest, to_insert, skipped, chunk_dedup)
+            # 切分、实体抽取与合并在LightRAG中按文档交错进行，作为一个阶段计时，
+            # 其中抽取和合并另由attach_step_timers单独计时
+            telemetry.start_stage("insert")
+            for result in await insert_files(rag, to_insert):
+                results[result["file"]] = result
+                if result["status"] == DocStatus.PROCESSED:
+                    manifest.record(
+                        result["file"],
+                        content_hashes[result["file"]],
+                        prompt_hash,
+                        result["doc_ids"],
+                    )
+        manifest.save()
+        telemetry.start_stage(None)
+
+        results = [results[p] for p in file_paths]
+        failed_count = log_insert_summary(results)
+        emit_event(
+            "inserted",
+            files=len(results),
+            failed=failed_count,
+            chunks=sum(r["chunks"] for r in results),
+        )
+
+        if failed_count:
+            raise RuntimeError(f"{failed_count}/{len(results)} files failed to insert")
+        # 全部完成后不再需要检查点
+        checkpoints.clear()
+
+        logger.info(f"✅ Insert completed successfully! Processed {len(results)} files")
+
+        logger.info(
+            f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses"
+        )
+        logger.info(f"LLM concurrency limiter: {llm_limiter.snapshot()}")
+        logger.info(f"LLM response cache: {llm_response_cache.stats()}")
+        summary = log_telemetry_summary(results, chunk_dedup)
+        emit_performance_report(summary)
 
         # 检查生成的文件
         logger.info("Checking generated files in working directory:")
@@ -118,14 +822,17 @@ async def main():
                 logger.info(f"  - {item}: {size} bytes")
 
         # 显示成功完成的消息到标准输出（供 source_modifier.py 捕获）
-        print("INSERT_COMPLETED_SUCCESSFULLY")
+        print("INSERT_COMPLETED_SUCCESSFULLY", flush=True)
 
         # 确保所有异步任务完成并清理资源
         logger.info("Cleaning up resources...")
+        await close_openai_client()
+        telemetry.close()
+        llm_response_cache.close()
 
     except Exception as e:
         logger.error(f"An error occurred: {e}")
-        print(f"INSERT_FAILED: {e}")
+        print(f"INSERT_FAILED: {e}", flush=True)
         raise
     finally:
         # 强制退出以确保进程结束
@@ -136,8 +843,50 @@ async def main():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把INSERT_DIR中的文本插入LightRAG")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="从上次中断时的检查点继续，而不是直接使用工作目录中的文件",
+    )
+    parser.add_argument(
+        "--prompts",
+        default=os.getenv("PROMPT_OVERRIDES_FILE"),
+        help="提示词覆盖文件（JSON对象，键为PROMPTS中的条目名），默认读取PROMPT_OVERRIDES_FILE",
+    )
+    parser.add_argument(
+        "--prompt",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="覆盖单个提示词，VALUE以@开头时从文件读取；可重复，优先于--prompts",
+    )
+    parser.add_argument(
+        "--stage",
+        action="store_true",
+        help="使用STAGE_CACHE_DIR中与输入和切分参数匹配的预抽取阶段，只运行抽取与合并",
+    )
+    parser.add_argument(
+        "--build-stage",
+        action="store_true",
+        help="只构建INSERT_DIR的预抽取阶段（切分、chunk向量、full_docs）后退出",
+    )
+    args = parser.parse_args()
+    overrides = load_prompt_overrides(args.prompts) if args.prompts else {}
+    overrides.update(parse_prompt_argument(a) for a in args.prompt)
+    signal.signal(signal.SIGTERM, handle_termination)
+    signal.signal(signal.SIGINT, handle_termination)
     try:
-        asyncio.run(main())
+        if args.build_stage:
+            asyncio.run(build_stage())
+        else:
+            asyncio.run(
+                main(
+                    resume=args.resume,
+                    prompt_overrides=overrides,
+                    use_stage=args.stage,
+                )
+            )
     except KeyboardInterrupt:
         print("Process interrupted")
         import sys
@@ -0,0 +1,131 @@
+"""
+跨工作目录共享的LLM响应缓存
+以(模型, 完整请求内容)的sha256为键，压缩后的响应保存在单个SQLite文件中（主键索引、逐条增量写入），
+所有提示词版本/工作目录共用：重跑未修改的提示词版本时不再产生任何LLM调用，
+相同对话前缀下的补充抽取请求也能直接命中。
+
+按大小和最后使用时间淘汰：
+    LLM_CACHE_MAX_MB          缓存总大小上限（压缩后，默认1024）
+    LLM_CACHE_MAX_AGE_DAYS    超过该天数未被使用的条目会被删除（默认90）
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+# 每写入这么多条检查一次是否需要淘汰
+EVICT_EVERY = 200
+
+
+def request_key(model, prompt, system_prompt=None, history_messages=None, **params):
+    """完整请求（模型、系统提示词、历史消息、提示词、生成参数）的sha256"""
+    payload = {
+        "model": model,
+        "system_prompt": system_prompt,
+        "history_messages": history_messages or [],
+        "prompt": prompt,
+        "params": params,
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024, max_age_days=90):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # 多个insert.py进程可以同时读写同一个文件
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self.evict()
+
+    def get(self, key):
+        row = self._db.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._db.execute(
+            "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?",
+            (time.time(), key),
+        )
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, key, model, response):
+        blob = zlib.compress(response.encode("utf-8"))
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, blob, len(blob), now, now),
+        )
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """删除过期条目；总大小超限时按最后使用时间从旧到新删除，直到降到上限的90%"""
+        removed = self._db.execute(
+            "DELETE FROM responses WHERE last_used < ?",
+            (time.time() - self.max_age_seconds,),
+        ).rowcount
+        total = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+        if total > self.max_bytes:
+            target = total - int(self.max_bytes * 0.9)
+            removed += self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "  SELECT key FROM ("
+                "    SELECT key, size, SUM(size) OVER (ORDER BY last_used, key) AS freed"
+                "    FROM responses"
+                "  ) WHERE freed - size < ?"
+                ")",
+                (target,),
+            ).rowcount
+        if removed:
+            logger.info(f"Evicted {removed} entries from LLM response cache")
+
+    def stats(self):
+        entries, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        return {
+            "entries": entries,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        self._db.close()
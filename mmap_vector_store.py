@@ -0,0 +1,537 @@
+"""
+内存映射的向量存储（替代NanoVectorDB的vdb_*.json）
+NanoVectorDB把向量矩阵以base64写进JSON，加载时要解析整个文件并把所有向量放进内存。
+这里把归一化后的float32向量保存在标准.npy文件中并以内存映射方式读取，元数据写在逐行追加的JSONL旁路文件里：
+
+    vdb_<namespace>.meta.jsonl    第一行为文件头 {"embedding_dim", "vectors_file"}，
+                                  之后每行一条记录：{"row", "__id__", "__created_at__", ...元数据}
+                                  或删除标记 {"deleted": id}
+    vdb_<namespace>.<gen>.npy     (行数, 维度) 的float32矩阵，只在末尾追加
+
+更新同一个id时追加新行并让旧行失效；失效行超过一半时整体压缩为新一代的.npy文件，
+再原子替换元数据文件，因此进程在任何时刻退出都不会出现行号错位。
+
+使用方法：在创建LightRAG之前调用register_mmap_vector_storage()，并传入
+vector_storage="MmapVectorDBStorage"。工作目录中只有NanoVectorDB的vdb_<namespace>.json时，
+加载该namespace前会自动转换；也可以用以下命令批量转换：
+
+    python mmap_vector_store.py tobe
+
+tobe中的去重快照（见snapshot_store.py）转换后会重新保存，清单随之更新。
+"""
+
+import argparse
+import asyncio
+import base64
+import glob
+import json
+import logging
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, final
+
+import numpy as np
+from lightrag.base import BaseVectorStorage
+from lightrag.kg.shared_storage import (
+    get_storage_lock,
+    get_update_flag,
+    set_all_update_flags,
+)
+from lightrag.utils import compute_mdhash_id
+
+from snapshot_store import MANIFEST_FILENAME, SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+STORAGE_NAME = "MmapVectorDBStorage"
+NPY_HEADER_SIZE = 128
+# 失效行超过该比例（且至少有这么多行）时压缩
+COMPACT_DEAD_RATIO = 0.5
+COMPACT_MIN_ROWS = 1024
+
+
+def register_mmap_vector_storage():
+    """把MmapVectorDBStorage注册到LightRAG的存储表中，使vector_storage参数可以使用它"""
+    from lightrag import kg
+
+    kg.STORAGES[STORAGE_NAME] = __name__
+    kg.STORAGE_ENV_REQUIREMENTS[STORAGE_NAME] = []
+    implementations = kg.STORAGE_IMPLEMENTATIONS["VECTOR_STORAGE"]["implementations"]
+    if STORAGE_NAME not in implementations:
+        implementations.append(STORAGE_NAME)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def npy_header(rows, dim):
+    """固定长度的.npy文件头，追加行时可以原地改写行数"""
+    header = repr({"descr": "<f4", "fortran_order": False, "shape": (rows, dim)})
+    header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode()
+
+
+def read_npy_rows(path):
+    """从文件头读取行数（只信任文件头，文件头之后多出的数据是未完成的追加）"""
+    with open(path, "rb") as f:
+        np.lib.format.read_magic(f)
+        shape, _, _ = np.lib.format.read_array_header_1_0(f)
+    return shape[0]
+
+
+def write_meta_file(path, embedding_dim, vectors_file, records):
+    """写完整的元数据文件（先写临时文件再替换）"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        header = {"embedding_dim": embedding_dim, "vectors_file": vectors_file}
+        f.write(json.dumps(header) + "\n")
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def write_vectors_file(path, vectors, dim):
+    """写完整的向量文件（先写临时文件再替换，不会改写快照中共享的硬链接）"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(npy_header(len(vectors), dim))
+        f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@final
+@dataclass
+class MmapVectorDBStorage(BaseVectorStorage):
+    def __post_init__(self):
+        self._storage_lock = None
+        self.storage_updated = None
+
+        kwargs = self.global_config.get("vector_db_storage_cls_kwargs", {})
+        cosine_threshold = kwargs.get("cosine_better_than_threshold")
+        if cosine_threshold is None:
+            raise ValueError(
+                "cosine_better_than_threshold must be specified in vector_db_storage_cls_kwargs"
+            )
+        self.cosine_better_than_threshold = cosine_threshold
+
+        self._working_dir = self.global_config["working_dir"]
+        self._meta_file = os.path.join(
+            self._working_dir, f"vdb_{self.namespace}.meta.jsonl"
+        )
+        self._max_batch_size = self.global_config["embedding_batch_num"]
+        # 之前用NanoVectorDB运行过的工作目录：先转换，否则会当作空的向量库加载，
+        # 而文件清单又会跳过未变化的输入，实体和关系向量就一直是空的
+        nano_json = os.path.join(self._working_dir, f"vdb_{self.namespace}.json")
+        if not os.path.exists(self._meta_file) and os.path.exists(nano_json):
+            logger.warning(
+                f"Converting NanoVectorDB storage {nano_json} to {STORAGE_NAME}"
+            )
+            convert_nano_vdb(nano_json)
+        self._load()
+
+    def _load(self):
+        """读取元数据旁路文件，并以内存映射方式打开向量文件"""
+        dim = self.embedding_func.embedding_dim
+        self._rows = {}  # id -> 行号
+        self._data = {}  # id -> 元数据
+        self._pending_vectors = []  # 尚未写入磁盘的行
+        self._pending_records = []  # 尚未写入磁盘的元数据记录
+        self._matrix = None
+        self._persisted_rows = 0
+        self._meta_valid_bytes = 0
+        self._vectors_file = f"vdb_{self.namespace}.0.npy"
+
+        if not os.path.exists(self._meta_file):
+            return
+
+        with open(self._meta_file, "rb") as f:
+            header_line = f.readline()
+            header = json.loads(header_line)
+            if header["embedding_dim"] != dim:
+                raise ValueError(
+                    f"Embedding dim mismatch for {self.namespace}, "
+                    f"expected: {dim}, but loaded: {header['embedding_dim']}"
+                )
+            self._vectors_file = header["vectors_file"]
+            vectors_path = os.path.join(self._working_dir, self._vectors_file)
+            if os.path.exists(vectors_path):
+                self._persisted_rows = read_npy_rows(vectors_path)
+                if self._persisted_rows:
+                    self._matrix = np.load(vectors_path, mmap_mode="r")
+
+            valid_bytes = len(header_line)
+            for line in f:
+                # 进程中途退出时最后一行可能不完整，之后追加前会截掉
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line)
+                valid_bytes += len(line)
+                if "deleted" in record:
+                    self._rows.pop(record["deleted"], None)
+                    self._data.pop(record["deleted"], None)
+                    continue
+                row = record.pop("row")
+                if row >= self._persisted_rows:
+                    continue
+                self._rows[record["__id__"]] = row
+                self._data[record["__id__"]] = record
+            self._meta_valid_bytes = valid_bytes
+
+        logger.info(
+            f"Loaded {len(self._rows)} vectors for {self.namespace} "
+            f"({self._persisted_rows} rows in {self._vectors_file})"
+        )
+
+    async def initialize(self):
+        """Initialize storage data"""
+        self.storage_updated = await get_update_flag(self.namespace)
+        self._storage_lock = get_storage_lock(enable_logging=False)
+
+    async def _reload_if_updated(self):
+        """其他进程保存过数据时重新加载"""
+        async with self._storage_lock:
+            if self.storage_updated.value:
+                logger.info(
+                    f"Process {os.getpid()} reloading {self.namespace} due to update by another process"
+                )
+                self._load()
+                self.storage_updated.value = False
+
+    @property
+    def _total_rows(self):
+        return self._persisted_rows + len(self._pending_vectors)
+
+    def _row_vectors(self, rows):
+        """按行号取向量（包括尚未落盘的行）"""
+        rows = np.asarray(rows, dtype=np.int64)
+        result = np.empty((len(rows), self.embedding_func.embedding_dim), np.float32)
+        persisted = rows < self._persisted_rows
+        if persisted.any():
+            result[persisted] = self._matrix[rows[persisted]]
+        if (~persisted).any():
+            pending = np.stack(self._pending_vectors)
+            result[~persisted] = pending[rows[~persisted] - self._persisted_rows]
+        return result
+
+    def _unchanged(self, doc_id, value):
+        record = self._data.get(doc_id)
+        return record is not None and all(
+            record.get(k) == value.get(k) for k in self.meta_fields
+        )
+
+    async def upsert(self, data: dict[str, dict[str, Any]]) -> None:
+        """
+        Importance notes:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+        """
+        logger.debug(f"Inserting {len(data)} to {self.namespace}")
+        await self._reload_if_updated()
+        # 元数据（含content）完全相同的记录不重新计算向量，例如从预抽取阶段复制来的chunk
+        data = {k: v for k, v in data.items() if not self._unchanged(k, v)}
+        if not data:
+            return
+
+        contents = [v["content"] for v in data.values()]
+        batches = [
+            contents[i : i + self._max_batch_size]
+            for i in range(0, len(contents), self._max_batch_size)
+        ]
+        embeddings_list = await asyncio.gather(
+            *[self.embedding_func(batch) for batch in batches]
+        )
+        embeddings = np.concatenate(embeddings_list)
+        if len(embeddings) != len(data):
+            # sometimes the embedding is not returned correctly. just log it.
+            logger.error(
+                f"embedding is not 1-1 with data, {len(embeddings)} != {len(data)}"
+            )
+            return
+
+        await self._reload_if_updated()
+        current_time = int(time.time())
+        for (doc_id, value), vector in zip(data.items(), normalize(embeddings)):
+            record = {
+                "__id__": doc_id,
+                "__created_at__": current_time,
+                **{k: v for k, v in value.items() if k in self.meta_fields},
+            }
+            row = self._total_rows
+            self._pending_vectors.append(vector)
+            self._pending_records.append({"row": row, **record})
+            self._rows[doc_id] = row
+            self._data[doc_id] = record
+
+    async def query(
+        self, query: str, top_k: int, ids: list[str] | None = None
+    ) -> list[dict[str, Any]]:
+        embedding = await self.embedding_func([query], _priority=5)
+        query_vector = normalize(embedding[0])
+
+        await self._reload_if_updated()
+        if not self._rows:
+            return []
+        live_ids = list(self._rows)
+        live_rows = np.fromiter(
+            self._rows.values(), dtype=np.int64, count=len(live_ids)
+        )
+        scores = self._row_vectors(live_rows) @ query_vector
+
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            score = float(scores[i])
+            if score < self.cosine_better_than_threshold:
+                break
+            dp = self._data[live_ids[i]]
+            results.append(
+                {
+                    **dp,
+                    "__metrics__": score,
+                    "id": dp["__id__"],
+                    "distance": score,
+                    "created_at": dp.get("__created_at__"),
+                }
+            )
+        return results
+
+    @property
+    async def client_storage(self):
+        """与NanoVectorDB的内部存储格式兼容（只包含元数据，不含矩阵）"""
+        await self._reload_if_updated()
+        return {
+            "embedding_dim": self.embedding_func.embedding_dim,
+            "data": list(self._data.values()),
+        }
+
+    async def delete(self, ids: list[str]):
+        """Delete vectors with specified IDs
+
+        Importance notes:
+        1. Changes will be persisted to disk during the next index_done_callback
+        2. Only one process should updating the storage at a time before index_done_callback,
+           KG-storage-log should be used to avoid data corruption
+        """
+        await self._reload_if_updated()
+        deleted = 0
+        for doc_id in ids:
+            if self._rows.pop(doc_id, None) is not None:
+                self._data.pop(doc_id, None)
+                self._pending_records.append({"deleted": doc_id})
+                deleted += 1
+        logger.debug(f"Successfully deleted {deleted} vectors from {self.namespace}")
+
+    async def delete_entity(self, entity_name: str) -> None:
+        entity_id = compute_mdhash_id(entity_name, prefix="ent-")
+        logger.debug(f"Attempting to delete entity {entity_name} with ID {entity_id}")
+        await self.delete([entity_id])
+
+    async def delete_entity_relation(self, entity_name: str) -> None:
+        await self._reload_if_updated()
+        ids_to_delete = [
+            doc_id
+            for doc_id, dp in self._data.items()
+            if dp.get("src_id") == entity_name or dp.get("tgt_id") == entity_name
+        ]
+        logger.debug(f"Found {len(ids_to_delete)} relations for entity {entity_name}")
+        if ids_to_delete:
+            await self.delete(ids_to_delete)
+
+    def _append_to_disk(self):
+        """把新行追加到.npy文件末尾并改写文件头，再追加元数据记录"""
+        dim = self.embedding_func.embedding_dim
+        vectors_path = os.path.join(self._working_dir, self._vectors_file)
+
+        if self._pending_vectors:
+            new_rows = self._total_rows
+            mode = "r+b" if os.path.exists(vectors_path) else "w+b"
+            with open(vectors_path, mode) as f:
+                # 截掉上次未完成的追加
+                f.truncate(NPY_HEADER_SIZE + self._persisted_rows * dim * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(np.stack(self._pending_vectors).astype(np.float32).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+                f.seek(0)
+                f.write(npy_header(new_rows, dim))
+                f.flush()
+                os.fsync(f.fileno())
+            self._persisted_rows = new_rows
+            self._matrix = np.load(vectors_path, mmap_mode="r")
+            self._pending_vectors = []
+
+        if not os.path.exists(self._meta_file):
+            write_meta_file(self._meta_file, dim, self._vectors_file, [])
+            self._meta_valid_bytes = os.path.getsize(self._meta_file)
+        with open(self._meta_file, "r+b") as f:
+            f.truncate(self._meta_valid_bytes)
+            f.seek(0, os.SEEK_END)
+            for record in self._pending_records:
+                f.write((json.dumps(record, ensure_ascii=False) + "\n").encode())
+            f.flush()
+            os.fsync(f.fileno())
+            self._meta_valid_bytes = f.tell()
+        self._pending_records = []
+
+    def _compact(self):
+        """只保留有效行，写入新一代的向量文件后原子替换元数据文件"""
+        dim = self.embedding_func.embedding_dim
+        old_vectors_path = os.path.join(self._working_dir, self._vectors_file)
+        generation = int(self._vectors_file.rsplit(".", 2)[-2]) + 1
+        vectors_file = f"vdb_{self.namespace}.{generation}.npy"
+
+        ids = list(self._rows)
+        vectors = (
+            self._row_vectors(list(self._rows.values()))
+            if ids
+            else np.empty((0, dim), np.float32)
+        )
+        write_vectors_file(os.path.join(self._working_dir, vectors_file), vectors, dim)
+        write_meta_file(
+            self._meta_file,
+            dim,
+            vectors_file,
+            [{"row": row, **self._data[doc_id]} for row, doc_id in enumerate(ids)],
+        )
+        if os.path.exists(old_vectors_path):
+            os.remove(old_vectors_path)
+
+        logger.info(
+            f"Compacted {self.namespace}: {self._persisted_rows} -> {len(ids)} rows"
+        )
+        self._load()
+
+    async def index_done_callback(self) -> bool:
+        """Save data to disk"""
+        async with self._storage_lock:
+            if self.storage_updated.value:
+                logger.warning(
+                    f"Storage for {self.namespace} was updated by another process, reloading..."
+                )
+                self._load()
+                self.storage_updated.value = False
+                return False
+
+        async with self._storage_lock:
+            try:
+                self._append_to_disk()
+                dead_rows = self._persisted_rows - len(self._rows)
+                if (
+                    self._persisted_rows >= COMPACT_MIN_ROWS
+                    and dead_rows > self._persisted_rows * COMPACT_DEAD_RATIO
+                ):
+                    self._compact()
+                await set_all_update_flags(self.namespace)
+                self.storage_updated.value = False
+                return True
+            except Exception as e:
+                logger.error(f"Error saving data for {self.namespace}: {e}")
+                return False
+
+    async def get_by_id(self, id: str) -> dict[str, Any] | None:
+        await self._reload_if_updated()
+        dp = self._data.get(id)
+        if dp is None:
+            return None
+        return {**dp, "id": dp["__id__"], "created_at": dp.get("__created_at__")}
+
+    async def get_by_ids(self, ids: list[str]) -> list[dict[str, Any]]:
+        if not ids:
+            return []
+        await self._reload_if_updated()
+        return [
+            {**dp, "id": dp["__id__"], "created_at": dp.get("__created_at__")}
+            for dp in (self._data.get(i) for i in ids)
+            if dp is not None
+        ]
+
+    async def drop(self) -> dict[str, str]:
+        """Drop all vector data from storage and clean up resources"""
+        try:
+            async with self._storage_lock:
+                for path in glob.glob(
+                    os.path.join(self._working_dir, f"vdb_{self.namespace}.*")
+                ):
+                    os.remove(path)
+                self._load()
+                await set_all_update_flags(self.namespace)
+                self.storage_updated.value = False
+                logger.info(f"Process {os.getpid()} drop {self.namespace}")
+            return {"status": "success", "message": "data dropped"}
+        except Exception as e:
+            logger.error(f"Error dropping {self.namespace}: {e}")
+            return {"status": "error", "message": str(e)}
+
+
+def convert_nano_vdb(json_path, remove_json=False):
+    """把NanoVectorDB的vdb_<namespace>.json转换为内存映射格式，返回新文件的总字节数"""
+    working_dir = os.path.dirname(json_path)
+    namespace = os.path.basename(json_path)[len("vdb_") : -len(".json")]
+    with open(json_path, "r", encoding="utf-8") as f:
+        storage = json.load(f)
+
+    dim = storage["embedding_dim"]
+    vectors = np.frombuffer(base64.b64decode(storage["matrix"]), dtype=np.float32)
+    vectors = normalize(vectors.reshape(-1, dim))
+    records = [{"row": row, **dp} for row, dp in enumerate(storage["data"])]
+
+    vectors_file = f"vdb_{namespace}.0.npy"
+    meta_file = os.path.join(working_dir, f"vdb_{namespace}.meta.jsonl")
+    write_vectors_file(os.path.join(working_dir, vectors_file), vectors, dim)
+    write_meta_file(meta_file, dim, vectors_file, records)
+    if remove_json:
+        os.remove(json_path)
+    return os.path.getsize(meta_file) + os.path.getsize(
+        os.path.join(working_dir, vectors_file)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="把tobe/*/vdb_*.json转换为内存映射向量存储"
+    )
+    parser.add_argument("root", nargs="?", default="tobe", help="实验结果根目录")
+    parser.add_argument(
+        "--remove-json", action="store_true", help="转换成功后删除原JSON文件"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    json_paths = sorted(
+        glob.glob(os.path.join(args.root, "vdb_*.json"))
+        + glob.glob(os.path.join(args.root, "*", "vdb_*.json"))
+    )
+    if not json_paths:
+        logger.info(f"No vdb_*.json found under {args.root}")
+        return
+    for working_dir in sorted({os.path.dirname(p) for p in json_paths}):
+        for json_path in (p for p in json_paths if os.path.dirname(p) == working_dir):
+            json_size = os.path.getsize(json_path)
+            new_size = convert_nano_vdb(json_path, remove_json=args.remove_json)
+            logger.info(
+                f"✅ {json_path}: {json_size / 1024:.0f} KB -> {new_size / 1024:.0f} KB"
+            )
+        if os.path.exists(os.path.join(working_dir, MANIFEST_FILENAME)):
+            # 快照清单只列出保存时的文件，新增和删除的文件都要重新保存快照才能通过verify
+            working_dir = os.path.abspath(working_dir)
+            store = SnapshotStore(os.path.dirname(working_dir))
+            stats = store.save(os.path.basename(working_dir), working_dir)
+            logger.info(
+                f"📦 {working_dir}: snapshot saved again ({stats['files']} files)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+离线的OpenAI兼容替身服务（chat + embeddings）
+把OPENAI_API_BASE指向它即可在没有网络、不花钱的情况下运行insert.py / source_modifier.py：
+
+    python mock_openai_server.py --port 8765 --latency 0.2 --error-rate 0.02
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock EMBEDDING_DIM=1024 python insert.py
+
+- 实体抽取请求：从提示词中的输入文本里按词频挑出候选实体，按句内共现生成关系，
+  以PROMPTS中的 <|> / ## / <|COMPLETE|> 格式返回，同一段文本的输出总是相同
+- 补充抽取（带history）返回下一批候选实体，"YES/NO"追问固定回答NO，描述合并请求返回拼接后的描述
+- embedding由文本的sha256作为随机种子生成单位向量
+- 可注入固定/抖动延迟以及按比例返回的错误（默认429）
+- GET /stats 返回各类请求的计数
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from lightrag.prompt import PROMPTS
+
+logger = logging.getLogger(__name__)
+
+TUPLE_DELIMITER = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+RECORD_DELIMITER = PROMPTS["DEFAULT_RECORD_DELIMITER"]
+COMPLETION_DELIMITER = PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+
+# 抽取提示词中输入文本的位置：lightrag默认模板为 "Text:\n{input_text}\n######################\nOutput:"
+INPUT_TEXT_PATTERN = re.compile(r"Text:\s*\n(.*?)\n#{6,}\s*\nOutput:", re.S)
+ENTITY_TYPES_PATTERN = re.compile(r"Entity_types:\s*\[([^\]]*)\]")
+SENTENCE_SPLIT = re.compile(r"[。！？!?\n]+")
+# 候选实体：连续两个汉字，或以大写字母开头的英文单词
+TOKEN_PATTERN = re.compile(r"(?=([一-鿿]{2}))|\b([A-Z][a-zA-Z]{2,})\b")
+# 含有这些高频虚词的双字组合不作为实体
+STOP_CHARS = set(
+    "的了是在不一我他她你这那着就也都而之与和有个们来去上下中到说道把被得地吗呢吧啊么没"
+)
+
+
+def estimate_tokens(text):
+    """粗略估计token数（中文约每字一个token），只用于填充usage字段"""
+    return max(1, len(text) // 2)
+
+
+def candidate_entities(text, limit):
+    """按出现次数（相同时按首次出现位置）挑选候选实体"""
+    counts = Counter()
+    first_seen = {}
+    for i, match in enumerate(TOKEN_PATTERN.finditer(text)):
+        token = match.group(1) or match.group(2)
+        if any(c in STOP_CHARS for c in token):
+            continue
+        counts[token] += 1
+        first_seen.setdefault(token, i)
+    ranked = sorted(counts, key=lambda t: (-counts[t], first_seen[t]))
+    return [t for t in ranked if counts[t] > 1][:limit]
+
+
+def entity_type_for(name, entity_types):
+    digest = hashlib.sha256(name.encode("utf-8")).digest()
+    return entity_types[digest[0] % len(entity_types)]
+
+
+def build_extraction(text, entity_types, offset=0, limit=8, max_relations=12):
+    """生成确定性的实体/关系抽取结果；offset用于补充抽取时跳过已返回的实体"""
+    entities = candidate_entities(text, offset + limit)[offset:]
+    sentences = [s.strip() for s in SENTENCE_SPLIT.split(text) if s.strip()]
+
+    records = []
+    for name in entities:
+        sentence = next((s for s in sentences if name in s), name).replace('"', "")
+        records.append(
+            "("
+            + TUPLE_DELIMITER.join(
+                [
+                    '"entity"',
+                    f'"{name}"',
+                    f'"{entity_type_for(name, entity_types)}"',
+                    f'"{sentence[:80]}"',
+                ]
+            )
+            + ")"
+        )
+
+    pair_counts = Counter()
+    for sentence in sentences:
+        present = [name for name in entities if name in sentence]
+        for i, src in enumerate(present):
+            for tgt in present[i + 1 :]:
+                pair_counts[(src, tgt)] += 1
+    for (src, tgt), count in pair_counts.most_common(max_relations):
+        records.append(
+            "("
+            + TUPLE_DELIMITER.join(
+                [
+                    '"relationship"',
+                    f'"{src}"',
+                    f'"{tgt}"',
+                    f'"{src}与{tgt}在文中共同出现{count}次"',
+                    '"共现"',
+                    str(min(10, count)),
+                ]
+            )
+            + ")"
+        )
+    if entities:
+        records.append(
+            "("
+            + TUPLE_DELIMITER.join(
+                ['"content_keywords"', f'"{",".join(entities[:3])}"']
+            )
+            + ")"
+        )
+    return RECORD_DELIMITER.join(records) + COMPLETION_DELIMITER
+
+
+def summarize_descriptions(prompt):
+    """描述合并请求：返回实体名加上去重后的描述"""
+    match = re.search(
+        r"Entities:\s*(.*?)\n.*?Description List:\s*(.*?)\n#{3,}", prompt, re.S
+    )
+    if not match:
+        return prompt[-200:]
+    name, descriptions = match.group(1).strip(), match.group(2).strip()
+    parts = list(dict.fromkeys(p.strip() for p in descriptions.split(RECORD_DELIMITER)))
+    return f"{name}：" + "；".join(p for p in parts if p)[:500]
+
+
+def chat_response(messages, entities_per_chunk):
+    """根据请求内容生成确定性的回复文本"""
+    prompt = messages[-1]["content"] if messages else ""
+    history = [m for m in messages[:-1] if m.get("role") != "system"]
+
+    if "`YES`" in prompt and "`NO`" in prompt:
+        return "NO"
+    if "Description List:" in prompt:
+        return summarize_descriptions(prompt)
+
+    # 补充抽取：原文在第一轮的用户消息里，返回排在已返回实体之后的候选
+    source = history[0]["content"] if history else prompt
+    match = INPUT_TEXT_PATTERN.search(source)
+    if not match:
+        return f"[mock] {prompt[:200]}"
+    types_match = ENTITY_TYPES_PATTERN.search(source)
+    entity_types = (
+        [t.strip() for t in types_match.group(1).split(",") if t.strip()]
+        if types_match
+        else PROMPTS["DEFAULT_ENTITY_TYPES"]
+    )
+    rounds = sum(1 for m in history if m.get("role") == "assistant")
+    return build_extraction(
+        match.group(1),
+        entity_types,
+        offset=rounds * entities_per_chunk,
+        limit=entities_per_chunk,
+    )
+
+
+def embed(text, dim):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        error_status=429,
+        embedding_dim=1024,
+        entities_per_chunk=8,
+        seed=0,
+    ):
+        super().__init__(address, MockOpenAIHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.embedding_dim = embedding_dim
+        self.entities_per_chunk = entities_per_chunk
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def draw(self):
+        """返回(是否注入错误, 本次延迟)；使用带种子的随机数，保证同样的请求序列结果可复现"""
+        with self._lock:
+            fail = self._random.random() < self.error_rate
+            delay = self.latency * (1 + self.jitter * (2 * self._random.random() - 1))
+        return fail, max(0.0, delay)
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, dict(self.server.stats))
+        elif self.path.rstrip("/").endswith("/models"):
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [
+                        {"id": "mock-chat", "object": "model", "owned_by": "mock"},
+                        {"id": "mock-embedding", "object": "model", "owned_by": "mock"},
+                    ],
+                },
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+
+        fail, delay = server.draw()
+        time.sleep(delay)
+        if fail:
+            server.count("errors")
+            self._send_json(
+                server.error_status,
+                {"error": {"message": "Injected error", "type": "mock_error"}},
+            )
+            return
+
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            server.count("chat_requests")
+            messages = request.get("messages", [])
+            content = chat_response(messages, server.entities_per_chunk)
+            prompt_tokens = sum(
+                estimate_tokens(m.get("content") or "") for m in messages
+            )
+            completion_tokens = estimate_tokens(content)
+            self._send_json(
+                200,
+                {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", "mock-chat"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": content},
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                },
+            )
+        elif self.path.rstrip("/").endswith("/embeddings"):
+            texts = request.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            server.count("embedding_requests")
+            server.count("embedding_texts", len(texts))
+            prompt_tokens = sum(estimate_tokens(t) for t in texts)
+            self._send_json(
+                200,
+                {
+                    "object": "list",
+                    "model": request.get("model", "mock-embedding"),
+                    "data": [
+                        {
+                            "object": "embedding",
+                            "index": i,
+                            "embedding": embed(t, server.embedding_dim).tolist(),
+                        }
+                        for i, t in enumerate(texts)
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "total_tokens": prompt_tokens,
+                    },
+                },
+            )
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+def create_server(host="127.0.0.1", port=0, **options):
+    """创建服务（port=0时自动选择空闲端口），调用方负责serve_forever/shutdown"""
+    return MockOpenAIServer((host, port), **options)
+
+
+def start_in_thread(**options):
+    """在后台线程中启动服务，返回server对象（用server.shutdown()停止）"""
+    server = create_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_server_arguments(parser):
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=float(os.getenv("MOCK_LATENCY", "0")),
+        help="每个请求的平均延迟（秒）",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=float(os.getenv("MOCK_JITTER", "0")),
+        help="延迟的相对抖动幅度，0.5表示±50%%",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=float(os.getenv("MOCK_ERROR_RATE", "0")),
+        help="返回错误的请求比例",
+    )
+    parser.add_argument(
+        "--error-status",
+        type=int,
+        default=int(os.getenv("MOCK_ERROR_STATUS", "429")),
+        help="注入错误时的HTTP状态码",
+    )
+    parser.add_argument(
+        "--embedding-dim",
+        type=int,
+        default=int(os.getenv("MOCK_EMBEDDING_DIM", "1024")),
+    )
+    parser.add_argument(
+        "--entities-per-chunk",
+        type=int,
+        default=int(os.getenv("MOCK_ENTITIES_PER_CHUNK", "8")),
+    )
+    parser.add_argument("--seed", type=int, default=int(os.getenv("MOCK_SEED", "0")))
+
+
+def server_options(args):
+    return {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "embedding_dim": args.embedding_dim,
+        "entities_per_chunk": args.entities_per_chunk,
+        "seed": args.seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线的OpenAI兼容替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    server = create_server(args.host, args.port, **server_options(args))
+    logger.info(
+        f"Mock OpenAI server listening on {server.base_url} "
+        f"(latency={args.latency}s, jitter={args.jitter}, error_rate={args.error_rate}, "
+        f"embedding_dim={args.embedding_dim})"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f"Served: {dict(server.stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+进程内共享的OpenAI异步客户端
+lightrag.llm.openai中的openai_complete_if_cache / openai_embed每次调用都会新建并关闭一个客户端，
+大批量抽取时连接建立和TLS握手被重复成千上万次。这里为每个进程维护一个长连接客户端，
+使用httpx连接池保持keep-alive，安装了h2时启用HTTP/2。
+
+连接池参数可通过环境变量配置：
+    HTTP_MAX_CONNECTIONS      连接池最大连接数（默认64）
+    HTTP_MAX_KEEPALIVE        最大空闲keep-alive连接数（默认32）
+    HTTP_KEEPALIVE_EXPIRY     空闲连接保持秒数（默认60）
+    HTTP_TIMEOUT              单次请求超时秒数（默认180）
+    HTTP2                     设为0可强制关闭HTTP/2
+"""
+
+import importlib.util
+import logging
+import os
+
+import httpx
+import numpy as np
+from lightrag.utils import safe_unicode_decode
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    RateLimitError,
+)
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential,
+)
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+class InvalidResponseError(Exception):
+    """LLM返回了空内容或格式不正确的响应"""
+
+
+def http2_enabled():
+    return os.getenv("HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+
+
+def get_openai_client():
+    """返回当前进程共享的AsyncOpenAI客户端（首次调用时创建）"""
+    global _client
+    if _client is None:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "64")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "32")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+        )
+        http_client = httpx.AsyncClient(
+            limits=limits,
+            timeout=httpx.Timeout(float(os.getenv("HTTP_TIMEOUT", "180"))),
+            http2=http2_enabled(),
+        )
+        _client = AsyncOpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_API_BASE"),
+            http_client=http_client,
+            # 重试由下面的tenacity策略负责，与LightRAG原有行为保持一致
+            max_retries=0,
+        )
+        logger.info(
+            f"Created shared OpenAI client (http2={http2_enabled()}, "
+            f"max_connections={limits.max_connections})"
+        )
+    return _client
+
+
+def _count_retry(retry_state):
+    """tenacity回调：把重试次数记到调用方传入的call_stats中"""
+    call_stats = retry_state.kwargs.get("call_stats")
+    if call_stats is not None:
+        call_stats["retries"] = call_stats.get("retries", 0) + 1
+
+
+def _record_usage(call_stats, usage):
+    if call_stats is not None and usage is not None:
+        call_stats["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+        call_stats["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+
+
+async def close_openai_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def with_chat_retry(func):
+    """chat completions的重试策略：限流、超时、连接错误和空响应最多尝试3次
+
+    单独提供是为了让调用方把并发控制放在重试之内（见insert.py的call_llm），
+    每次尝试单独占用并发窗口并单独报告结果。
+    """
+    return retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=(
+            retry_if_exception_type(RateLimitError)
+            | retry_if_exception_type(APIConnectionError)
+            | retry_if_exception_type(APITimeoutError)
+            | retry_if_exception_type(InvalidResponseError)
+        ),
+        before_sleep=_count_retry,
+    )(func)
+
+
+async def chat_complete_attempt(
+    model, prompt, system_prompt=None, history_messages=None, call_stats=None, **kwargs
+):
+    """使用共享客户端调用一次chat completions（不重试），返回文本内容
+
+    call_stats: 可选字典，会被填入prompt_tokens / completion_tokens / retries
+    """
+    # LightRAG传入的内部参数，不能发给OpenAI
+    kwargs.pop("hashing_kv", None)
+    kwargs.pop("keyword_extraction", None)
+
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.extend(history_messages or [])
+    messages.append({"role": "user", "content": prompt})
+
+    response = await get_openai_client().chat.completions.create(
+        model=model, messages=messages, **kwargs
+    )
+    _record_usage(call_stats, getattr(response, "usage", None))
+    if not response.choices or not response.choices[0].message.content:
+        raise InvalidResponseError("Received empty content from OpenAI API")
+    content = response.choices[0].message.content
+    if r"\u" in content:
+        content = safe_unicode_decode(content.encode("utf-8"))
+    return content
+
+
+chat_complete = with_chat_retry(chat_complete_attempt)
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=4, max=10),
+    retry=(
+        retry_if_exception_type(RateLimitError)
+        | retry_if_exception_type(APIConnectionError)
+        | retry_if_exception_type(APITimeoutError)
+    ),
+    before_sleep=_count_retry,
+)
+async def embed_texts(texts, model, call_stats=None):
+    """使用共享客户端计算embedding，call_stats含义同chat_complete"""
+    response = await get_openai_client().embeddings.create(
+        model=model, input=texts, encoding_format="float"
+    )
+    _record_usage(call_stats, getattr(response, "usage", None))
+    return np.array([dp.embedding for dp in response.data], dtype=np.float32)
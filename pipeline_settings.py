@@ -0,0 +1,43 @@
+"""
+影响插入结果的流水线参数
+insert.py据此计算预抽取阶段的key（见pre_extraction_stage.py），source_modifier.py据此计算
+版本的sweep_hash。两处读取同一组环境变量和默认值，任何一项变化时，阶段缓存和tobe中
+已完成的版本都不会被误当作可复用的结果。
+"""
+
+import os
+
+import lightrag
+from lightrag import LightRAG
+
+
+def chunking_settings():
+    """影响切分和chunk向量的参数（embedding维度在insert.py中解析后另行加入）"""
+    chunk_dedup = os.getenv("CHUNK_DEDUP", "0") == "1"
+    return {
+        "lightrag": lightrag.__version__,
+        "tokenizer": LightRAG.tiktoken_model_name,
+        "chunk_token_size": int(os.getenv("CHUNK_SIZE", "1200")),
+        "chunk_overlap_token_size": int(os.getenv("CHUNK_OVERLAP_SIZE", "100")),
+        "stream_threshold_bytes": int(
+            os.getenv("STREAM_THRESHOLD_BYTES", str(32 * 1024 * 1024))
+        ),
+        "stream_segment_chars": int(os.getenv("STREAM_SEGMENT_CHARS", "100000")),
+        "embedding_model": os.getenv("OPENAI_EMBEDDINGS_MODEL"),
+        "vector_storage": os.getenv("VECTOR_STORAGE", "MmapVectorDBStorage"),
+        "chunk_dedup_threshold": (
+            float(os.getenv("CHUNK_DEDUP_THRESHOLD", "0.85")) if chunk_dedup else None
+        ),
+    }
+
+
+def extraction_settings():
+    """chunking_settings加上影响实体抽取的参数"""
+    return {
+        **chunking_settings(),
+        "chat_model": os.getenv("OPENAI_CHAT_MODEL") or "gpt-4o",
+        "entity_extract_max_gleaning": int(
+            os.getenv("ENTITY_EXTRACT_MAX_GLEANING", "1")
+        ),
+        "chunk_dedup": os.getenv("CHUNK_DEDUP", "0") == "1",
+    }
@@ -0,0 +1,179 @@
+"""
+与提示词无关的预抽取阶段缓存
+提示词版本之间只有实体抽取不同，但每个版本都从空的工作目录开始，重新切分chunk、
+为所有chunk计算向量并写入full_docs/text_chunks/chunks_vdb。
+
+这里对每份输入语料只做一次这些工作，结果保存为一个阶段目录：
+    STAGE_CACHE_DIR/<key>/stage.json            {"key", "settings", "files", "documents", "chunks", "created_at"}
+    STAGE_CACHE_DIR/<key>/stage_chunks.json     {doc_id: 切分结果（去重之前）}
+    STAGE_CACHE_DIR/<key>/kv_store_full_docs.json、kv_store_text_chunks.json、
+                          vdb_chunks.*、chunk_dedup_index.json、embedding_dim.json
+key由输入文件（路径+内容哈希）和所有影响切分与向量的参数计算，任何一项变化都会使用新的阶段。
+
+每个版本开始时把这些文件复制进空的工作目录，切分直接返回缓存的结果，
+chunks_vdb中内容未变化的记录不会重新计算向量，版本只需运行抽取和合并。
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+from lightrag.utils import clean_text, compute_mdhash_id
+
+from chunk_dedup import INDEX_FILENAME as CHUNK_DEDUP_INDEX_FILENAME
+from snapshot_store import clone_file
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = "stage.json"
+CHUNKS_FILENAME = "stage_chunks.json"
+# 与提示词无关、可以直接复制进版本工作目录的存储文件
+STAGE_FILES = [
+    "kv_store_full_docs.json",
+    "kv_store_text_chunks.json",
+    "embedding_dim.json",
+    CHUNK_DEDUP_INDEX_FILENAME,
+]
+STAGE_FILE_PATTERNS = ["vdb_chunks.*"]
+
+
+def stage_key(file_hashes, settings):
+    """file_hashes为{文件路径: 内容sha256}，settings为影响切分和向量的参数"""
+    payload = {"files": sorted(file_hashes.items()), "settings": settings}
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:16]
+
+
+def stage_files(directory):
+    """directory中属于预抽取阶段的存储文件名"""
+    names = [
+        name for name in STAGE_FILES if os.path.exists(os.path.join(directory, name))
+    ]
+    for pattern in STAGE_FILE_PATTERNS:
+        names += sorted(
+            os.path.basename(p)
+            for p in glob.glob(os.path.join(directory, pattern))
+            if not p.endswith(".tmp")
+        )
+    return names
+
+
+class PreExtractionStage:
+    def __init__(self, root, file_hashes, settings):
+        self.root = root
+        self.file_hashes = file_hashes
+        self.settings = settings
+        self.key = stage_key(file_hashes, settings)
+        self.path = os.path.join(root, self.key)
+        self._chunks = None
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, STATE_FILENAME))
+
+    def seed(self, working_dir):
+        """把阶段中的存储文件复制进working_dir，返回复制的文件名
+
+        不使用硬链接：工作目录中的文件之后会被LightRAG原地改写或追加。
+        """
+        names = stage_files(self.path)
+        for name in names:
+            target = os.path.join(working_dir, name)
+            clone_file(os.path.join(self.path, name), target + ".tmp")
+            os.replace(target + ".tmp", target)
+        logger.info(f"Seeded {working_dir} from pre-extraction stage {self.key}")
+        return names
+
+    def _load_chunks(self):
+        if self._chunks is None:
+            with open(
+                os.path.join(self.path, CHUNKS_FILENAME), "r", encoding="utf-8"
+            ) as f:
+                self._chunks = json.load(f)
+        return self._chunks
+
+    def wrap(self, chunking_func):
+        """包装LightRAG的chunking_func：阶段中有该文档时直接返回缓存的切分结果"""
+
+        def chunking_from_stage(tokenizer, content, *args, **kwargs):
+            cached = self._load_chunks().get(compute_mdhash_id(content, prefix="doc-"))
+            if cached is None:
+                return chunking_func(tokenizer, content, *args, **kwargs)
+            return [dict(chunk) for chunk in cached]
+
+        return chunking_from_stage
+
+    async def build(self, rag, documents, chunking_func, chunk_dedup=None):
+        """在rag的工作目录中完成切分、chunk向量和full_docs，不做实体抽取
+
+        documents产生 (文件路径, 文本)；chunk和文档的写法与LightRAG的处理流水线一致，
+        保证版本运行时重新写入的是完全相同的记录。
+        """
+        self._chunks = {}
+        for file_path, content in documents:
+            content = clean_text(content)
+            doc_id = compute_mdhash_id(content, prefix="doc-")
+            raw_chunks = chunking_func(
+                rag.tokenizer,
+                content,
+                None,
+                False,
+                rag.chunk_overlap_token_size,
+                rag.chunk_token_size,
+            )
+            self._chunks[doc_id] = raw_chunks
+            # 重复的chunk同样存储，这里只建立去重索引，抽取时再跳过
+            if chunk_dedup:
+                chunk_dedup.mark_duplicates(doc_id, raw_chunks)
+            chunks = {
+                compute_mdhash_id(dp["content"], prefix="chunk-"): {
+                    **dp,
+                    "full_doc_id": doc_id,
+                    "file_path": file_path,
+                }
+                for dp in raw_chunks
+            }
+            await rag.chunks_vdb.upsert(chunks)
+            await rag.text_chunks.upsert(chunks)
+            await rag.full_docs.upsert({doc_id: {"content": content}})
+            logger.info(f"Staged {file_path}: {doc_id} ({len(chunks)} chunks)")
+
+        for storage in (rag.full_docs, rag.text_chunks, rag.chunks_vdb):
+            await storage.index_done_callback()
+        if chunk_dedup:
+            chunk_dedup.save()
+
+    def publish(self, working_dir):
+        """把working_dir中构建好的阶段发布到STAGE_CACHE_DIR/<key>
+
+        先写临时目录再改名，其他进程同时发布同一个阶段时保留先完成的那份。
+        """
+        tmp_path = os.path.join(self.root, f".{self.key}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        names = stage_files(working_dir)
+        for name in names:
+            clone_file(os.path.join(working_dir, name), os.path.join(tmp_path, name))
+        with open(os.path.join(tmp_path, CHUNKS_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(self._chunks, f, ensure_ascii=False)
+        state = {
+            "key": self.key,
+            "settings": self.settings,
+            "files": self.file_hashes,
+            "documents": len(self._chunks),
+            "chunks": sum(len(chunks) for chunks in self._chunks.values()),
+            "created_at": time.time(),
+        }
+        with open(os.path.join(tmp_path, STATE_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            if not self.exists():
+                raise
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            logger.info(f"Pre-extraction stage {self.key} was published concurrently")
+        return state
@@ -0,0 +1,172 @@
+"""
+insert.py子进程的监控
+基于asyncio同时读取子进程的stdout和stderr（不会因为某个管道写满而卡住子进程），
+逐行写入每个版本自己的日志文件，解析insert.py输出的结构化进度事件：
+
+    INSERT_EVENT {"event": "progress", "doc_status": {...}}
+
+并负责超时和退出：
+    - 看到完成/失败标志后等待子进程自行退出，超过grace_period才发送SIGTERM
+    - 超过timeout（墙钟时间）时先发送SIGTERM让其清理退出，grace_period后仍未退出则SIGKILL
+等待期间不轮询，不占用CPU。
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+
+EVENT_PREFIX = "INSERT_EVENT "
+SUCCESS_SENTINEL = "INSERT_COMPLETED_SUCCESSFULLY"
+FAILURE_SENTINEL = "INSERT_FAILED"
+
+# 单行输出的上限（LightRAG会把整段提示词打进日志）
+STREAM_LIMIT = 16 * 1024 * 1024
+# 结果中保留的最后若干行输出
+TAIL_LINES = 50
+
+
+def parse_event(line):
+    """解析一行INSERT_EVENT，不是事件或无法解析时返回None"""
+    if not line.startswith(EVENT_PREFIX):
+        return None
+    try:
+        event = json.loads(line[len(EVENT_PREFIX) :])
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) else None
+
+
+async def _pump(stream, name, log_file, on_line):
+    while True:
+        raw = await stream.readline()
+        if not raw:
+            return
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        log_file.write(f"[{name}] {line}\n")
+        on_line(name, line)
+
+
+async def _shutdown(process, wait_task, grace_period):
+    """先发送SIGTERM让子进程自行清理，grace_period后仍未退出则强制结束"""
+    try:
+        process.terminate()
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(asyncio.shield(wait_task), grace_period)
+    except TimeoutError:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+        await wait_task
+
+
+async def supervise(
+    command,
+    log_file,
+    env=None,
+    cwd=None,
+    timeout=None,
+    grace_period=30,
+    on_event=None,
+):
+    """运行command直到退出，返回结果：
+
+    {"returncode", "completed", "error", "timed_out", "seconds", "events",
+     "stdout_tail", "stderr_tail"}
+
+    completed表示看到了完成标志；error为失败标志所在行（没有时为None）。
+    log_file为已打开的文本文件（行缓冲），由调用方在事件循环之外打开和关闭。
+    on_event(event) 在每个进度事件到达时被调用。
+    """
+    result = {
+        "returncode": None,
+        "completed": False,
+        "error": None,
+        "timed_out": False,
+        "seconds": 0.0,
+        "events": [],
+    }
+    tails = {
+        "stdout": deque(maxlen=TAIL_LINES),
+        "stderr": deque(maxlen=TAIL_LINES),
+    }
+    finished = asyncio.Event()
+
+    def on_line(name, line):
+        tails[name].append(line)
+        if name != "stdout":
+            return
+        event = parse_event(line)
+        if event is not None:
+            result["events"].append(event)
+            if on_event:
+                on_event(event)
+        elif SUCCESS_SENTINEL in line:
+            result["completed"] = True
+            finished.set()
+        elif FAILURE_SENTINEL in line:
+            result["error"] = line
+            finished.set()
+
+    start = time.monotonic()
+    log_file.write(f"# {time.strftime('%Y-%m-%d %H:%M:%S')} {' '.join(command)}\n")
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env,
+        cwd=cwd,
+        limit=STREAM_LIMIT,
+    )
+    pumps = asyncio.gather(
+        _pump(process.stdout, "stdout", log_file, on_line),
+        _pump(process.stderr, "stderr", log_file, on_line),
+    )
+    wait_task = asyncio.ensure_future(process.wait())
+    finished_task = asyncio.ensure_future(finished.wait())
+    try:
+        done, _ = await asyncio.wait(
+            {wait_task, finished_task},
+            timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if wait_task not in done:
+            if finished_task in done:
+                # 已经给出结果，给子进程留出自行清理退出的时间
+                remaining = (
+                    None
+                    if timeout is None
+                    else max(timeout - (time.monotonic() - start), 0)
+                )
+                wait_limit = (
+                    grace_period if remaining is None else min(grace_period, remaining)
+                )
+                try:
+                    await asyncio.wait_for(asyncio.shield(wait_task), wait_limit)
+                except TimeoutError:
+                    await _shutdown(process, wait_task, grace_period)
+            else:
+                result["timed_out"] = True
+                await _shutdown(process, wait_task, grace_period)
+        # 子进程退出后管道关闭，读完剩余输出
+        await pumps
+    finally:
+        finished_task.cancel()
+        if process.returncode is None:
+            process.kill()
+            await wait_task
+
+    result["returncode"] = process.returncode
+    result["seconds"] = time.monotonic() - start
+    result["stdout_tail"] = "\n".join(tails["stdout"])
+    result["stderr_tail"] = "\n".join(tails["stderr"])
+    return result
+
+
+def run_supervised(command, log_path, **kwargs):
+    """在新的事件循环中运行supervise（供线程池中的每个线程调用），输出追加到log_path"""
+    with open(log_path, "a", encoding="utf-8", buffering=1) as log_file:
+        return asyncio.run(supervise(command, log_file, **kwargs))
@@ -0,0 +1,114 @@
+"""
+进程内提示词覆盖
+LightRAG在每次抽取时才从lightrag.prompt.PROMPTS中读取提示词，直接修改这个字典即可生效，
+不需要改写site-packages中的prompt.py、备份和恢复，也不需要为每个版本重新启动解释器。
+
+覆盖文件是一个JSON对象，键为PROMPTS中的条目名：
+    {
+        "entity_extraction": "...",
+        "entity_continue_extraction": "...",
+        "entity_extraction_examples": ["...", "..."]
+    }
+"""
+
+import json
+import string
+from contextlib import contextmanager
+
+from lightrag.prompt import PROMPTS
+
+# 抽取提示词在LightRAG中格式化时可用的占位符
+EXTRACTION_PLACEHOLDERS = {
+    "tuple_delimiter",
+    "record_delimiter",
+    "completion_delimiter",
+    "entity_types",
+    "examples",
+    "language",
+    "input_text",
+}
+CHECKED_PROMPT_KEYS = {
+    "entity_extraction",
+    "entity_continue_extraction",
+    "entity_extraction_examples",
+}
+
+
+def placeholders(template):
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field}
+
+
+def validate_prompt_overrides(overrides):
+    """检查覆盖项的键、类型和占位符：值的类型不对时抛出TypeError，其他问题抛出ValueError
+
+    占位符写错时LightRAG会在每个chunk上抛KeyError，这里在任何LLM调用之前就报错。
+    """
+    for key, value in overrides.items():
+        if key not in PROMPTS:
+            raise ValueError(f"Unknown prompt key: {key}")
+        if not isinstance(value, type(PROMPTS[key])):
+            raise TypeError(
+                f"Prompt {key} must be a {type(PROMPTS[key]).__name__}, "
+                f"got {type(value).__name__}"
+            )
+        if key not in CHECKED_PROMPT_KEYS:
+            continue
+        templates = value if isinstance(value, list) else [value]
+        for template in templates:
+            try:
+                unknown = placeholders(template) - EXTRACTION_PLACEHOLDERS
+            except ValueError as e:
+                raise ValueError(f"Prompt {key} is not a valid template: {e}") from e
+            if unknown:
+                raise ValueError(
+                    f"Prompt {key} uses unknown placeholders: {sorted(unknown)}"
+                )
+
+
+def load_prompt_overrides(path):
+    with open(path, "r", encoding="utf-8") as f:
+        overrides = json.load(f)
+    if not isinstance(overrides, dict):
+        raise TypeError(f"{path} must contain a JSON object")
+    return overrides
+
+
+def parse_prompt_argument(argument):
+    """解析命令行中的 KEY=VALUE；VALUE以@开头时从该文件读取"""
+    key, sep, value = argument.partition("=")
+    if not sep:
+        raise ValueError(f"Expected KEY=VALUE, got: {argument}")
+    if value.startswith("@"):
+        with open(value[1:], "r", encoding="utf-8") as f:
+            value = f.read()
+    # 列表类型的条目（如entity_extraction_examples）以JSON数组给出
+    if isinstance(PROMPTS.get(key), list):
+        value = json.loads(value)
+    return key, value
+
+
+def save_prompt_overrides(path, overrides):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(overrides, f, ensure_ascii=False, indent=2)
+
+
+def apply_prompt_overrides(overrides):
+    """把覆盖项写入PROMPTS，返回被替换的原始值（用于restore_prompts）"""
+    validate_prompt_overrides(overrides)
+    originals = {key: PROMPTS[key] for key in overrides}
+    PROMPTS.update(overrides)
+    return originals
+
+
+def restore_prompts(originals):
+    PROMPTS.update(originals)
+
+
+@contextmanager
+def prompt_overrides(overrides):
+    """在with块内使用覆盖后的提示词，退出时恢复原值"""
+    originals = apply_prompt_overrides(overrides)
+    try:
+        yield PROMPTS
+    finally:
+        restore_prompts(originals)
@@ -1,25 +1,26 @@
 import pipmaster
 
-if not pipmaster.is_installed("networkx"):
-    pm_result = pipmaster.install("networkx")
-    print(f"networkx installation result: {pm_result}")
 if not pipmaster.is_installed("scikit-learn"):
     pm_result = pipmaster.install("scikit-learn")
     print(f"scikit-learn installation result: {pm_result}")
 
-import networkx as nx
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 import os
 
+from graphml_stream import iter_graphml
 
-def get_edge_descriptions(graph):
-    """Extracts edge descriptions from a NetworkX graph.
+
+def get_edge_descriptions(graphml_file):
+    """Extracts edge descriptions from a GraphML file, streaming its edges.
     Assumes edges are uniquely identified by (source_id, target_id, relation_label).
     The description is stored in the 'description' attribute of the edge.
     """
     edge_data = {}
-    for u, v, data in graph.edges(data=True):
+    for kind, data in iter_graphml(graphml_file):
+        if kind != "edge":
+            continue
+        u, v = data["source"], data["target"]
         # Node IDs are usually strings in GraphML if read directly.
         # Ensure consistent ordering for undirected graphs if necessary,
         # but relations are often directed. Let's assume directed or order matters.
@@ -57,16 +58,13 @@ def compare_graph_relations(
         return
 
     try:
-        # node_type=str ensures node IDs are read as strings, aiding consistency
-        g1 = nx.read_graphml(graphml_file1, node_type=str)
-        g2 = nx.read_graphml(graphml_file2, node_type=str)
+        # Only the edge descriptions are kept, not the whole graphs
+        edges1 = get_edge_descriptions(graphml_file1)
+        edges2 = get_edge_descriptions(graphml_file2)
     except Exception as e:
         print(f"Error reading GraphML files: {e}")
         return
 
-    edges1 = get_edge_descriptions(g1)
-    edges2 = get_edge_descriptions(g2)
-
     common_relations_keys = set(edges1.keys()).intersection(set(edges2.keys()))
 
     if not common_relations_keys:
@@ -0,0 +1,238 @@
+"""
+去重的实验结果快照存储
+tobe/<版本>_源码修改版 原来是工作目录的完整副本，但不同版本之间很多文件完全相同
+（kv_store_full_docs.json、kv_store_text_chunks.json、vdb_chunks等），每个版本都要复制一遍。
+
+这里按内容寻址保存文件：
+    tobe/.blobs/<sha256前两位>/<sha256>      只读的文件内容，每份内容只存一次
+    tobe/<快照名>/...                         指向blob的硬链接（不支持时退回reflink/复制）
+    tobe/<快照名>/.snapshot_manifest.json     {"created_at", "files": {相对路径: {"sha256", "size"}}}
+快照先在临时目录中建好，再用改名替换旧快照，任何时刻读到的都是完整的快照。
+快照目录中的文件与其他快照共享同一个inode，不能原地改写，只能写临时文件后替换。
+
+已有的完整副本可以就地转换为去重快照：
+    python snapshot_store.py tobe
+
+快照中的vdb_*.json可以转换为内存映射向量存储（见mmap_vector_store.py）：
+    python mmap_vector_store.py tobe [--remove-json]
+转换器新增.npy/.meta.jsonl、按需删除JSON后会重新保存该快照，清单与目录内容保持一致；
+直接在快照目录中增删文件会使verify失败，source_modifier.py会把该版本当作未完成而重新运行。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台没有文件锁和reflink，直接复制
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIRNAME = ".blobs"
+MANIFEST_FILENAME = ".snapshot_manifest.json"
+# Linux的FICLONE ioctl（btrfs/xfs等支持reflink的文件系统上零拷贝复制）
+FICLONE = 0x40049409
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def clone_file(src, dst):
+    """尽量用reflink复制文件，不支持时退回普通复制"""
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+def iter_files(root):
+    """root下所有文件的相对路径（跳过检查点目录）"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith(".checkpoint"))
+        for name in sorted(filenames):
+            if name == MANIFEST_FILENAME and dirpath == root:
+                continue
+            yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def list_snapshot_dirs(root):
+    """root下的实验目录（跳过.blobs和临时目录等以.开头的目录）"""
+    return sorted(
+        name
+        for name in os.listdir(root)
+        if not name.startswith(".") and os.path.isdir(os.path.join(root, name))
+    )
+
+
+class SnapshotStore:
+    def __init__(self, root):
+        self.root = root
+        self.blobs_dir = os.path.join(root, BLOBS_DIRNAME)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        """保存快照和回收blob时持有的文件锁（并行保存的多个版本之间互斥）"""
+        with open(os.path.join(self.blobs_dir, ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blobs_dir, digest[:2], digest)
+
+    def _store_blob(self, path):
+        """把文件内容存入blob（已存在时不写入），返回 (sha256, 是否新写入)"""
+        digest = file_sha256(path)
+        blob = self.blob_path(digest)
+        if os.path.exists(blob):
+            return digest, False
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        # 复制而不是硬链接源文件：工作目录中的文件之后可能被原地改写
+        tmp_path = f"{blob}.{os.getpid()}.tmp"
+        clone_file(path, tmp_path)
+        os.chmod(tmp_path, 0o444)
+        os.replace(tmp_path, blob)
+        return digest, True
+
+    def _link_blob(self, digest, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(self.blob_path(digest), target)
+        except OSError:
+            # 不支持硬链接（如跨文件系统）时退回reflink/复制
+            clone_file(self.blob_path(digest), target)
+
+    def save(self, name, source_dir):
+        """把source_dir保存为快照name（source_dir可以就是已有的快照目录），返回统计信息"""
+        start = time.perf_counter()
+        files = {}
+        new_bytes = 0
+        target = os.path.join(self.root, name)
+        tmp_dir = os.path.join(self.root, f".{name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        with self._locked():
+            try:
+                for rel_path in iter_files(source_dir):
+                    digest, is_new = self._store_blob(
+                        os.path.join(source_dir, rel_path)
+                    )
+                    size = os.path.getsize(self.blob_path(digest))
+                    files[rel_path] = {"sha256": digest, "size": size}
+                    new_bytes += size if is_new else 0
+                    self._link_blob(digest, os.path.join(tmp_dir, rel_path))
+                manifest = {"created_at": time.time(), "files": files}
+                with open(
+                    os.path.join(tmp_dir, MANIFEST_FILENAME), "w", encoding="utf-8"
+                ) as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+                self._swap_in(tmp_dir, target)
+            except BaseException:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                raise
+            self._gc()
+
+        stats = {
+            "files": len(files),
+            "bytes": sum(entry["size"] for entry in files.values()),
+            "new_bytes": new_bytes,
+            "seconds": time.perf_counter() - start,
+        }
+        return stats
+
+    def _swap_in(self, tmp_dir, target):
+        """用改名把新快照换上去；旧快照先改名再删除"""
+        old_dir = None
+        if os.path.exists(target):
+            old_dir = os.path.join(
+                self.root, f".{os.path.basename(target)}.{os.getpid()}.old"
+            )
+            shutil.rmtree(old_dir, ignore_errors=True)
+            os.rename(target, old_dir)
+        os.rename(tmp_dir, target)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def load_manifest(self, name):
+        path = os.path.join(self.root, name, MANIFEST_FILENAME)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def verify(self, name):
+        """快照完整：清单存在，且清单中的文件都在、大小一致"""
+        manifest = self.load_manifest(name)
+        if manifest is None:
+            return False
+        for rel_path, entry in manifest["files"].items():
+            path = os.path.join(self.root, name, rel_path)
+            if not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+                return False
+        return True
+
+    def gc(self):
+        """删除没有任何快照清单引用的blob，返回释放的字节数"""
+        with self._locked():
+            return self._gc()
+
+    def _gc(self):
+        referenced = set()
+        for name in list_snapshot_dirs(self.root):
+            manifest = self.load_manifest(name)
+            if manifest:
+                referenced.update(e["sha256"] for e in manifest["files"].values())
+        freed = 0
+        for dirpath, _, filenames in os.walk(self.blobs_dir):
+            if dirpath == self.blobs_dir:
+                continue
+            for digest in filenames:
+                if digest in referenced:
+                    continue
+                path = os.path.join(dirpath, digest)
+                freed += os.path.getsize(path)
+                os.remove(path)
+        if freed:
+            logger.info(f"Removed {freed} bytes of unreferenced snapshot blobs")
+        return freed
+
+    def disk_usage(self):
+        """blob存储实际占用的字节数"""
+        return sum(
+            os.path.getsize(os.path.join(dirpath, name))
+            for dirpath, _, filenames in os.walk(self.blobs_dir)
+            for name in filenames
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    root = sys.argv[1] if len(sys.argv) > 1 else "./tobe"
+    store = SnapshotStore(root)
+    total = 0
+    for name in list_snapshot_dirs(root):
+        stats = store.save(name, os.path.join(root, name))
+        total += stats["bytes"]
+        logger.info(f"{name}: {stats['files']} files, {stats['new_bytes']} new bytes")
+    logger.info(f"{total} bytes in snapshots, {store.disk_usage()} bytes of blobs")
@@ -1,17 +1,40 @@
 #!/usr/bin/env python3
 """
-LightRAG源码提示词修改管理器
-直接修改LightRAG源码中的提示词，每次修改后重新运行insert.py测试
-确保提示词修改真正生效
+LightRAG提示词版本测试管理器
+把每个版本的提示词写成覆盖文件（见prompt_overrides.py）交给insert.py，
+insert.py在进程内替换PROMPTS后运行，不再改写site-packages中的prompt.py
 """
 
 import os
+import glob
+import hashlib
+import json
 import sys
+import argparse
 import shutil
+import time
 import logging
-import subprocess
+import math
+import threading
 import pandas as pd
-import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+from graph_analysis import get_graph_data_and_config, score_graphs_unsupervised
+from ingest_manifest import file_sha256
+from pipeline_settings import extraction_settings
+from process_supervisor import run_supervised
+from prompt_overrides import save_prompt_overrides, validate_prompt_overrides
+from snapshot_store import SnapshotStore
+
+# 提示词覆盖文件名，随工作目录一起保存到tobe，记录该版本使用的提示词
+PROMPT_OVERRIDES_FILENAME = "prompt_overrides.json"
+# 版本运行记录，随快照保存到tobe：{"version_name", "sweep_hash", "completed_at"}
+SWEEP_RECORD_FILENAME = "sweep_record.json"
+
+# 与insert.py读取同一份.env，子进程继承这些变量，sweep_hash也按它们计算
+load_dotenv()
 
 # 设置日志
 logging.basicConfig(
@@ -19,160 +42,105 @@ logging.basicConfig(
 )
 
 
-class LightRAGSourceModifier:
-    def __init__(self):
-        # LightRAG安装路径
-        self.lightrag_path = (
-            "/root/miniconda3/envs/dev/lib/python3.12/site-packages/lightrag"
-        )
-        self.prompt_file = os.path.join(self.lightrag_path, "prompt.py")
+def performance_columns(report):
+    """把insert.py的report事件展开成结果文件中的列"""
+    columns = {
+        f"stage_{stage}_seconds": seconds
+        for stage, seconds in report.get("stages", {}).items()
+    }
+    for key in (
+        "chunks",
+        "llm_calls",
+        "prompt_tokens",
+        "completion_tokens",
+        "llm_cache_hit_rate",
+        "embedding_calls",
+        "peak_rss_mb",
+        "graph_nodes",
+        "graph_edges",
+    ):
+        columns[key] = report.get(key)
+    return columns
 
+
+class LightRAGSourceModifier:
+    def __init__(
+        self,
+        resume=False,
+        rerun_all=False,
+        parallel=1,
+        llm_budget=None,
+        timeout=None,
+        use_stage=True,
+        halving_start=None,
+        halving_eta=2,
+    ):
         # 配置文件
         self.prompt_versions_file = "prompt_versions.xlsx"
         self.results_file = "source_modification_results.csv"
 
-        # 备份文件
-        self.backup_prompt_file = "original_prompt.py.backup"
-
         # 工作目录
         self.working_dir = "./dickens"
         self.tobe_dir = "./tobe"
+        # 记录工作目录当前属于哪个版本，--resume时据此决定是否从检查点继续
+        self.version_marker_file = os.path.join(self.working_dir, ".sweep_version")
+        self.prompt_overrides_file = os.path.join(
+            self.working_dir, PROMPT_OVERRIDES_FILENAME
+        )
+        # 并行模式下每个版本在这里使用独立的工作目录，成功保存到tobe后删除
+        self.sweep_dir = "./sweep_runs"
+        # 所有版本共用的预抽取阶段（切分、chunk向量、full_docs，见pre_extraction_stage.py），
+        # 在运行版本之前构建一次，每个版本只运行抽取和合并
+        self.use_stage = use_stage
+        self.stage_build_dir = os.path.join(self.sweep_dir, ".pre_extraction")
+
+        # 每个版本insert.py的输出日志
+        self.log_dir = "./sweep_logs"
+        # 单个版本的墙钟时间上限（秒），超过后终止该版本；None表示不限制
+        self.timeout = timeout
+
+        # 同时运行的版本数，以及所有版本共享的LLM并发总预算
+        self.llm_budget = llm_budget or int(os.getenv("LLM_MAX_ASYNC", "32"))
+        if self.llm_budget < 1:
+            raise ValueError(f"LLM budget must be at least 1, got {self.llm_budget}")
+        self.parallel = max(1, parallel)
+        if self.parallel > self.llm_budget:
+            # 每个版本至少要有1个LLM并发，否则总并发会超出预算
+            logging.warning(
+                f"⚠️ 同时运行的版本数 {self.parallel} 超过LLM并发总预算 {self.llm_budget}，"
+                f"减少为 {self.llm_budget}"
+            )
+            self.parallel = self.llm_budget
+        # 预算按正在运行的版本动态分配（见llm_share）
+        self._budget_lock = threading.Lock()
+        self._versions_pending = 0
+        self._versions_running = 0
+        self._budget_allocated = 0
+
+        # 逐步淘汰（successive halving）：所有版本先在halving_start比例的chunk样本上运行并评分，
+        # 每轮只保留得分前1/halving_eta的版本，样本比例乘以halving_eta后继续；None表示不淘汰
+        if halving_start is not None and not 0 < halving_start < 1:
+            raise ValueError(
+                f"Halving start fraction must be between 0 and 1, got {halving_start}"
+            )
+        if halving_eta < 2:
+            # ETA为1时每轮保留全部版本、样本比例也不增长，淘汰永远不会结束
+            raise ValueError(f"Halving eta must be at least 2, got {halving_eta}")
+        self.halving_start = halving_start
+        self.halving_eta = halving_eta
 
-        # 确保目录存在
-        os.makedirs(self.tobe_dir, exist_ok=True)
-
-    def backup_original_prompt(self):
-        """备份原始的prompt.py文件"""
-        if not os.path.exists(self.backup_prompt_file):
-            try:
-                shutil.copy2(self.prompt_file, self.backup_prompt_file)
-                logging.info(f"✓ 已备份原始prompt.py到: {self.backup_prompt_file}")
-                return True
-            except Exception as e:
-                logging.error(f"✗ 备份原始prompt.py失败: {e}")
-                return False
-        else:
-            logging.info(f"✓ 备份文件已存在: {self.backup_prompt_file}")
-            return True
-
-    def restore_original_prompt(self):
-        """恢复原始的prompt.py文件"""
-        if os.path.exists(self.backup_prompt_file):
-            try:
-                shutil.copy2(self.backup_prompt_file, self.prompt_file)
-                logging.info("✓ 已恢复原始prompt.py文件")
-                return True
-            except Exception as e:
-                logging.error(f"✗ 恢复原始prompt.py失败: {e}")
-                return False
-        else:
-            logging.error("✗ 备份文件不存在，无法恢复")
-            return False
-
-    def read_prompt_file(self):
-        """读取prompt.py文件内容"""
-        try:
-            with open(self.prompt_file, "r", encoding="utf-8") as f:
-                return f.read()
-        except Exception as e:
-            logging.error(f"✗ 读取prompt.py文件失败: {e}")
-            return None
-
-    def write_prompt_file(self, content):
-        """写入prompt.py文件内容"""
-        try:
-            with open(self.prompt_file, "w", encoding="utf-8") as f:
-                f.write(content)
-            logging.info("✓ 已更新prompt.py源码文件")
-            return True
-        except Exception as e:
-            logging.error(f"✗ 写入prompt.py文件失败: {e}")
-            return False
-
-    def modify_source_prompts(
-        self, entity_extraction_prompt, entity_continue_prompt, version_name
-    ):
-        """直接修改源码中的提示词"""
-        content = self.read_prompt_file()
-        if not content:
-            return False
-
-        marked_entity_extraction = entity_extraction_prompt
-        marked_entity_continue = entity_continue_prompt
-
-        try:
-            # 替换entity_extraction
-            entity_start = content.find('PROMPTS["entity_extraction"] = """')
-            if entity_start == -1:
-                entity_start = content.find("PROMPTS['entity_extraction'] = '''")
-                quote_type = "'''"
-            else:
-                quote_type = '"""'
-
-            if entity_start != -1:
-                # 找到开始位置后的第一个三引号
-                start_pos = content.find(quote_type, entity_start) + len(quote_type)
-                # 找到对应的结束三引号
-                end_pos = content.find(quote_type, start_pos)
-
-                if start_pos != -1 and end_pos != -1:
-                    # 替换entity_extraction内容
-                    new_content = (
-                        content[:start_pos]
-                        + marked_entity_extraction
-                        + content[end_pos:]
-                    )
-                    content = new_content
-                    logging.info(
-                        f"✓ 成功替换entity_extraction提示词 (版本: {version_name})"
-                    )
-                else:
-                    logging.error("✗ 无法找到entity_extraction的结束位置")
-                    return False
-            else:
-                logging.error("✗ 无法找到entity_extraction的开始位置")
-                return False
-
-            # 替换entity_continue_extraction
-            continue_start = content.find('PROMPTS["entity_continue_extraction"] = """')
-            if continue_start == -1:
-                continue_start = content.find(
-                    "PROMPTS['entity_continue_extraction'] = '''"
-                )
-                quote_type_continue = "'''"
-            else:
-                quote_type_continue = '"""'
-
-            if continue_start != -1:
-                # 找到开始位置后的第一个三引号
-                start_pos = content.find(quote_type_continue, continue_start) + len(
-                    quote_type_continue
-                )
-                # 找到对应的结束三引号
-                end_pos = content.find(quote_type_continue, start_pos)
-
-                if start_pos != -1 and end_pos != -1:
-                    # 替换entity_continue_extraction内容
-                    new_content = (
-                        content[:start_pos] + marked_entity_continue + content[end_pos:]
-                    )
-                    content = new_content
-                    logging.info(
-                        f"✓ 成功替换entity_continue_extraction提示词 (版本: {version_name})"
-                    )
-                else:
-                    logging.error("✗ 无法找到entity_continue_extraction的结束位置")
-                    return False
-            else:
-                logging.error("✗ 无法找到entity_continue_extraction的开始位置")
-                return False
+        # 是否从上次中断处继续：中断的版本从检查点继续
+        self.resume = resume
+        # 默认跳过提示词、流水线参数和输入都与tobe中完整快照相同的版本；rerun_all为True时全部重新运行
+        self.rerun_all = rerun_all
+        self._corpus_manifest = None
 
-            # 写入修改后的内容
-            return self.write_prompt_file(content)
+        # 每次insert.py运行的性能报告（按运行名），写进结果文件中该版本的那一行
+        self.reports = {}
 
-        except Exception as e:
-            logging.error(f"✗ 修改源码提示词时出错: {e}")
-            return False
+        # 确保目录存在
+        os.makedirs(self.tobe_dir, exist_ok=True)
+        self.snapshots = SnapshotStore(self.tobe_dir)
 
     def clean_working_dir(self):
         """彻底清理工作目录"""
@@ -199,6 +167,14 @@ class LightRAGSourceModifier:
                     "vdb_entities.json",
                     "vdb_relationships.json",
                     "kv_store_llm_response_cache.json",
+                    # 去重索引必须随图谱一起清掉，否则新版本的chunk都会被当成重复跳过
+                    "chunk_dedup_index.json",
+                ]
+                # 内存映射向量存储的文件（vdb_<namespace>.meta.jsonl / vdb_<namespace>.<gen>.npy）
+                files_to_clean += [
+                    os.path.basename(p)
+                    for p in glob.glob(os.path.join(self.working_dir, "vdb_*.*"))
+                    if not p.endswith(".json")
                 ]
 
                 for filename in files_to_clean:
@@ -214,112 +190,197 @@ class LightRAGSourceModifier:
             os.makedirs(self.working_dir, exist_ok=True)
             logging.info(f"  - 已创建工作目录: {self.working_dir}")
 
-    def save_working_dir_to_tobe(self, version_name):
-        """完整保存工作目录到tobe文件夹"""
-        tobe_version_dir = os.path.join(self.tobe_dir, f"{version_name}_源码修改版")
-
-        # 如果目标目录已存在，先删除
-        if os.path.exists(tobe_version_dir):
-            try:
-                shutil.rmtree(tobe_version_dir)
-                logging.info(f"  - 已删除已存在的目录: {tobe_version_dir}")
-            except Exception as e:
-                logging.warning(f"  - 删除已存在目录失败: {e}")
-
+    def read_working_dir_version(self):
+        """返回当前工作目录所属的版本名（没有记录时返回None）"""
+        if not os.path.exists(self.version_marker_file):
+            return None
+        with open(self.version_marker_file, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def write_working_dir_version(self, version_name):
+        with open(self.version_marker_file, "w", encoding="utf-8") as f:
+            f.write(version_name)
+
+    def corpus_manifest(self):
+        """输入语料清单：INSERT_DIR中每个.txt文件的内容哈希"""
+        if self._corpus_manifest is None:
+            insert_dir = os.getenv("INSERT_DIR", "inputs")
+            self._corpus_manifest = {
+                name: file_sha256(os.path.join(insert_dir, name))
+                for name in sorted(os.listdir(insert_dir))
+                if name.endswith(".txt")
+            }
+        return self._corpus_manifest
+
+    def version_hash(self, overrides):
+        """(提示词, 流水线参数, 输入语料清单) 的哈希，三者都不变时版本的结果不变
+
+        流水线参数与insert.py读取的相同（模型、切分、去重、补充抽取轮数等，见pipeline_settings.py）
+        """
+        payload = {
+            "prompts": overrides,
+            "settings": extraction_settings(),
+            "inputs": self.corpus_manifest(),
+        }
+        encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def write_sweep_record(self, version_name, overrides, working_dir=None):
+        path = os.path.join(working_dir or self.working_dir, SWEEP_RECORD_FILENAME)
+        record = {
+            "version_name": version_name,
+            "sweep_hash": self.version_hash(overrides),
+            "completed_at": time.time(),
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+
+    def load_sweep_record(self, version_name):
+        """tobe中该版本快照的运行记录；快照不完整或没有记录时返回None"""
+        snapshot = f"{version_name}_源码修改版"
+        if not self.snapshots.verify(snapshot):
+            return None
+        path = os.path.join(self.tobe_dir, snapshot, SWEEP_RECORD_FILENAME)
         try:
-            # 确保工作目录存在
-            if not os.path.exists(self.working_dir):
-                logging.warning(f"  - 工作目录不存在: {self.working_dir}")
-                return False
-
-            # 完整复制工作目录
-            shutil.copytree(self.working_dir, tobe_version_dir)
-
-            # 验证复制结果
-            copied_files = []
-            for root, dirs, files in os.walk(tobe_version_dir):
-                for file in files:
-                    rel_path = os.path.relpath(
-                        os.path.join(root, file), tobe_version_dir
-                    )
-                    copied_files.append(rel_path)
-
-            if copied_files:
-                logging.info(f"✓ 已完整保存工作目录到: {tobe_version_dir}")
-                logging.info(f"  - 共保存 {len(copied_files)} 个文件:")
-                for file in sorted(copied_files):
-                    logging.info(f"    * {file}")
-            else:
-                logging.warning("  - 工作目录为空，未保存任何文件")
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
 
-            return True
+    def save_working_dir_to_tobe(self, version_name, working_dir=None):
+        """把工作目录保存为tobe中的去重快照（内容相同的文件只存一份，见snapshot_store.py）"""
+        working_dir = working_dir or self.working_dir
+        tobe_version_dir = f"{version_name}_源码修改版"
 
+        # 确保工作目录存在
+        if not os.path.exists(working_dir):
+            logging.warning(f"  - 工作目录不存在: {working_dir}")
+            return False
+
+        try:
+            stats = self.snapshots.save(tobe_version_dir, working_dir)
         except Exception as e:
             logging.error(f"✗ 保存工作目录失败: {e}")
             return False
 
-    def run_insert_script(self, version_name):
-        """运行insert.py脚本"""
+        if not stats["files"]:
+            logging.warning("  - 工作目录为空，未保存任何文件")
+        logging.info(
+            f"✓ 已保存工作目录到: {os.path.join(self.tobe_dir, tobe_version_dir)} "
+            f"({stats['files']} 个文件, {stats['bytes'] / 1024 / 1024:.1f} MB, "
+            f"其中新增 {stats['new_bytes'] / 1024 / 1024:.1f} MB, "
+            f"{stats['seconds']:.2f}s)"
+        )
+        return True
+
+    def run_insert_script(self, version_name, resume=False, working_dir=None, env=None):
+        """运行insert.py脚本（resume为True时从检查点继续）
+
+        working_dir为None时使用默认工作目录./dickens；env为子进程的环境变量。
+        子进程的stdout/stderr写入sweep_logs/<版本名>.log，进度事件实时输出到日志。
+        """
         logging.info(f"🚀 开始运行insert.py (版本: {version_name})")
 
+        prompt_file = os.path.join(
+            working_dir or self.working_dir, PROMPT_OVERRIDES_FILENAME
+        )
+        command = [sys.executable, "insert.py", "--prompts", prompt_file]
+        if resume:
+            command.append("--resume")
+        if self.use_stage:
+            command.append("--stage")
+        log_path = self.version_log_file(version_name)
+
+        def on_event(event):
+            if event["event"] == "progress":
+                counts = ", ".join(
+                    f"{status} {count}"
+                    for status, count in event["doc_status"].items()
+                    if count
+                )
+                logging.info(f"  [{version_name}] 文档进度: {counts}")
+            elif event["event"] == "report":
+                self.reports[version_name] = performance_columns(event)
+            elif event["event"] == "planned":
+                logging.info(
+                    f"  [{version_name}] 待插入 {event['to_insert']}/{event['files']} 个文件"
+                )
+
         try:
-            # 使用Popen进行实时监控
-            process = subprocess.Popen(
-                [sys.executable, "insert.py"],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
+            result = run_supervised(
+                command,
+                log_path,
+                env=env,
+                timeout=self.timeout,
+                on_event=on_event,
             )
-
-            stdout_lines = []
-            stderr_lines = []
-
-            # 实时读取输出
-            while True:
-                stdout_line = process.stdout.readline()  # type: ignore
-                if stdout_line:
-                    stdout_lines.append(stdout_line)
-                    # 检测完成标志
-                    if "INSERT_COMPLETED_SUCCESSFULLY" in stdout_line:
-                        logging.info("✓ 检测到插入完成信号")
-                        process.terminate()  # 优雅终止进程
-                        return True, "\n".join(stdout_lines)
-                    elif "INSERT_FAILED" in stdout_line:
-                        logging.error("✗ 检测到插入失败信号")
-                        process.terminate()
-                        return False, "\n".join(stdout_lines + stderr_lines)
-
-                # 检查进程是否已经结束
-                if process.poll() is not None:
-                    # 进程已经结束，读取剩余输出
-                    remaining_stdout, remaining_stderr = process.communicate()
-                    if remaining_stdout:
-                        stdout_lines.append(remaining_stdout)
-                    if remaining_stderr:
-                        stderr_lines.append(remaining_stderr)
-                    break
-
-            # 检查最终结果
-            full_stdout = "\n".join(stdout_lines)
-            full_stderr = "\n".join(stderr_lines)
-
-            if "INSERT_COMPLETED_SUCCESSFULLY" in full_stdout:
-                logging.info(f"✓ 版本 {version_name} 运行成功")
-                return True, full_stdout
-            elif process.returncode == 0:
-                logging.info(f"✓ 版本 {version_name} 运行成功")
-                return True, full_stdout
-            else:
-                logging.error(f"✗ 版本 {version_name} 运行失败")
-                logging.error(f"错误输出: {full_stderr}")
-                return False, full_stderr
-
         except Exception as e:
             logging.error(f"✗ 运行版本 {version_name} 时出错: {e}")
             return False, str(e)
 
+        self.reports.setdefault(version_name, {})["wall_seconds"] = result["seconds"]
+        if result["completed"]:
+            logging.info(
+                f"✓ 版本 {version_name} 运行成功 ({result['seconds']:.0f}s, 日志: {log_path})"
+            )
+            return True, result["stdout_tail"]
+        if result["timed_out"]:
+            logging.error(
+                f"✗ 版本 {version_name} 超时（{self.timeout}s），已终止，日志: {log_path}"
+            )
+        else:
+            logging.error(
+                f"✗ 版本 {version_name} 运行失败 (退出码 {result['returncode']})，"
+                f"日志: {log_path}"
+            )
+        logging.error(f"错误输出: {result['stderr_tail'][-2000:]}")
+        return False, result["error"] or result["stderr_tail"]
+
+    def build_pre_extraction_stage(self):
+        """运行一次insert.py --build-stage，返回是否可以使用预抽取阶段
+
+        阶段按输入内容和切分参数缓存在STAGE_CACHE_DIR中，输入不变时直接复用。
+        """
+        logging.info("🧱 构建预抽取阶段（切分、chunk向量、full_docs）...")
+        shutil.rmtree(self.stage_build_dir, ignore_errors=True)
+        os.makedirs(self.stage_build_dir)
+        env = os.environ.copy()
+        env["WORKING_DIR"] = self.stage_build_dir
+        log_path = self.version_log_file("_pre_extraction")
+        stage = {}
+
+        def on_event(event):
+            if event["event"] == "stage":
+                stage.update(event)
+
+        try:
+            result = run_supervised(
+                [sys.executable, "insert.py", "--build-stage"],
+                log_path,
+                env=env,
+                timeout=self.timeout,
+                on_event=on_event,
+            )
+        except Exception as e:
+            logging.warning(f"⚠️ 构建预抽取阶段时出错，各版本将运行完整流程: {e}")
+            return False
+        finally:
+            shutil.rmtree(self.stage_build_dir, ignore_errors=True)
+
+        if not result["completed"]:
+            logging.warning(
+                f"⚠️ 预抽取阶段构建失败，各版本将运行完整流程，日志: {log_path}"
+            )
+            return False
+        logging.info(
+            f"✓ 预抽取阶段已就绪: {stage.get('path')} ({result['seconds']:.0f}s)"
+        )
+        return True
+
+    def version_log_file(self, version_name):
+        os.makedirs(self.log_dir, exist_ok=True)
+        return os.path.join(self.log_dir, f"{version_name}.log")
+
     def load_prompt_versions(self):
         """加载提示词版本配置"""
         try:
@@ -329,96 +390,318 @@ class LightRAGSourceModifier:
             logging.error(f"✗ 加载提示词版本失败: {e}")
             return []
 
-    def run_all_versions(self):
-        """运行所有版本的测试"""
-        # 备份原始文件
-        if not self.backup_original_prompt():
-            logging.error("无法备份原始文件，停止执行")
-            return []
-
-        # 加载版本配置
-        prompt_versions = self.load_prompt_versions()
-        if not prompt_versions:
-            logging.error("没有找到提示词版本配置")
-            return []
-
-        results = []
-
+    def plan_versions(self, prompt_versions):
+        """检查每个版本的提示词，返回 (待运行的版本, 已确定结果的版本)
+
+        待运行的版本为 [(序号, 版本名, 提示词覆盖)]，已确定结果的版本为 {序号: 结果}。
+        """
+        runnable = []
+        finished = {}
+        for i, version_info in enumerate(prompt_versions, 1):
+            version_name = version_info.get("name", f"Version_{i}")
+            entity_extraction = version_info.get("entity_extraction")
+            entity_continue = version_info.get("entity_continue_extraction")
+
+            if not entity_extraction or not entity_continue:
+                logging.warning(f"⚠️ 跳过版本 {version_name}，缺少提示词定义")
+                finished[i] = {
+                    "version_name": version_name,
+                    "success": False,
+                    "error": "Missing prompt definition",
+                }
+                continue
+
+            # 占位符写错时在运行前就跳过该版本
+            overrides = {
+                "entity_extraction": entity_extraction,
+                "entity_continue_extraction": entity_continue,
+            }
+            try:
+                validate_prompt_overrides(overrides)
+            except (TypeError, ValueError) as e:
+                logging.error(f"✗ 提示词无效，跳过版本 {version_name}: {e}")
+                finished[i] = {
+                    "version_name": version_name,
+                    "success": False,
+                    "error": f"Invalid prompt definition: {e}",
+                }
+                continue
+
+            # 提示词、流水线参数和输入都没有变化，且tobe中有完整的快照时不再运行
+            record = None if self.rerun_all else self.load_sweep_record(version_name)
+            if record and record.get("sweep_hash") == self.version_hash(overrides):
+                logging.info(f"⏭️ 版本 {version_name} 未变化且已保存到tobe，跳过")
+                finished[i] = {
+                    "version_name": version_name,
+                    "success": True,
+                    "output": "Skipped: unchanged since the saved snapshot",
+                    "sweep_hash": record["sweep_hash"],
+                    "unchanged": True,
+                }
+                continue
+
+            runnable.append((i, version_name, overrides))
+        return runnable, finished
+
+    def run_version(self, version_name, overrides):
+        """在默认工作目录中运行一个版本"""
+        # 清理工作目录（--resume且工作目录属于本版本时保留，从检查点继续）
+        resume_version = self.resume and self.read_working_dir_version() == version_name
+        if resume_version:
+            logging.info("♻️ 工作目录属于本版本，从检查点继续...")
+        else:
+            logging.info("🧹 清理工作目录...")
+            self.clean_working_dir()
+            self.write_working_dir_version(version_name)
+        save_prompt_overrides(self.prompt_overrides_file, overrides)
+
+        with self.llm_share() as share:
+            success, output = self.run_insert_script(
+                version_name,
+                resume=resume_version,
+                env=self.version_env(self.working_dir, share),
+            )
+        if success:
+            self.write_sweep_record(version_name, overrides)
+            self.save_working_dir_to_tobe(version_name)
+        return success, output
+
+    @contextmanager
+    def llm_share(self):
+        """为即将启动的版本分配LLM并发份额，版本结束后归还
+
+        未分配的预算平均分给还能同时启动的版本（空闲槽位和尚未启动的版本数中较小者），
+        运行的版本少于parallel时（淘汰轮次、最后留下的版本、末尾的版本）预算不会闲置。
+        """
+        with self._budget_lock:
+            slots = min(
+                self.parallel - self._versions_running, max(1, self._versions_pending)
+            )
+            share = max(1, (self.llm_budget - self._budget_allocated) // max(1, slots))
+            self._versions_pending = max(0, self._versions_pending - 1)
+            self._versions_running += 1
+            self._budget_allocated += share
         try:
-            for i, version_info in enumerate(prompt_versions, 1):
-                version_name = version_info.get("name", f"Version_{i}")
-                entity_extraction = version_info.get("entity_extraction")
-                entity_continue = version_info.get("entity_continue_extraction")
-
-                if not entity_extraction or not entity_continue:
-                    logging.warning(f"⚠️ 跳过版本 {version_name}，缺少提示词定义")
-                    results.append(
-                        {
-                            "version_name": version_name,
-                            "success": False,
-                            "error": "Missing prompt definition",
-                        }
-                    )
-                    continue
-
-                logging.info(f"\n{'=' * 60}")
-                logging.info(f"📝 处理版本 {i}/{len(prompt_versions)}: {version_name}")
-                logging.info(f"{'=' * 60}")
-
-                # 1. 修改源码
-                logging.info("🔧 修改LightRAG源码中的提示词...")
-                if not self.modify_source_prompts(
-                    entity_extraction, entity_continue, version_name
-                ):
-                    logging.error(f"✗ 修改源码失败，跳过版本 {version_name}")
-                    results.append(
-                        {
-                            "version_name": version_name,
-                            "success": False,
-                            "error": "Failed to modify source code",
-                        }
-                    )
-                    continue
-
-                # 2. 清理工作目录
-                logging.info("🧹 清理工作目录...")
-                self.clean_working_dir()
-
-                # 3. 运行测试
-                success, output = self.run_insert_script(version_name)
-
-                # 4. 保存结果
-                if success:
-                    self.save_working_dir_to_tobe(version_name)
+            yield share
+        finally:
+            with self._budget_lock:
+                self._versions_running -= 1
+                self._budget_allocated -= share
+
+    def version_env(self, working_dir, share):
+        """并行模式下子进程的环境变量：独立的工作目录，以及分到的LLM并发份额"""
+        env = os.environ.copy()
+        env["WORKING_DIR"] = working_dir
+        env["LLM_MAX_ASYNC"] = str(share)
+        env["LLM_INITIAL_ASYNC"] = str(
+            min(share, int(os.getenv("LLM_INITIAL_ASYNC", "5")))
+        )
+        env["LLM_MIN_ASYNC"] = str(min(share, int(os.getenv("LLM_MIN_ASYNC", "1"))))
+        return env
+
+    def run_version_isolated(self, version_name, overrides):
+        """在sweep_runs下该版本独立的工作目录中运行一个版本（可与其他版本同时运行）"""
+        working_dir = os.path.join(self.sweep_dir, version_name)
+        # 工作目录只属于本版本，--resume时存在即可从检查点继续
+        resume_version = self.resume and os.path.isdir(working_dir)
+        if not resume_version:
+            shutil.rmtree(working_dir, ignore_errors=True)
+            os.makedirs(working_dir)
+        save_prompt_overrides(
+            os.path.join(working_dir, PROMPT_OVERRIDES_FILENAME), overrides
+        )
 
-                results.append(
-                    {
-                        "version_name": version_name,
-                        "success": success,
-                        "output": output[:500] if output else "",  # 限制输出长度
-                    }
+        with self.llm_share() as share:
+            success, output = self.run_insert_script(
+                version_name,
+                resume=resume_version,
+                working_dir=working_dir,
+                env=self.version_env(working_dir, share),
+            )
+        if success:
+            self.write_sweep_record(version_name, overrides, working_dir)
+        if success and self.save_working_dir_to_tobe(version_name, working_dir):
+            shutil.rmtree(working_dir, ignore_errors=True)
+        return success, output
+
+    def run_sample(self, version_name, overrides, fraction, rung):
+        """在独立工作目录中只抽取fraction比例的chunk运行一个版本，返回 (图谱数据, 主角id)，失败时返回None"""
+        run_name = f"{version_name}.rung{rung}"
+        working_dir = os.path.join(self.sweep_dir, run_name)
+        shutil.rmtree(working_dir, ignore_errors=True)
+        os.makedirs(working_dir)
+        save_prompt_overrides(
+            os.path.join(working_dir, PROMPT_OVERRIDES_FILENAME), overrides
+        )
+        graph = None
+        with self.llm_share() as share:
+            env = self.version_env(working_dir, share)
+            env["CHUNK_SAMPLE_FRACTION"] = str(fraction)
+            success, _ = self.run_insert_script(
+                run_name, working_dir=working_dir, env=env
+            )
+        if success:
+            graph_data, protagonist_id, error_info = get_graph_data_and_config(
+                working_dir
+            )
+            if not error_info:
+                graph = (graph_data, protagonist_id)
+        shutil.rmtree(working_dir, ignore_errors=True)
+        return graph
+
+    def run_successive_halving(self, runnable):
+        """在逐渐增大的chunk样本上淘汰版本，返回 (留到最后的版本, 被淘汰版本的结果)
+
+        样本按文档和位置分层抽取且逐轮嵌套，上一轮抽取过的chunk在下一轮直接命中LLM响应缓存。
+        样本比例达到1之前只剩一个版本时提前结束；留下的版本由调用方完整运行。
+        某一轮的样本全部失败（如接口暂时不可用）时放弃淘汰，当前留下的版本全部完整运行。
+        """
+        eliminated = {}
+        survivors = list(runnable)
+        fraction = self.halving_start
+        rung = 0
+        while fraction < 1 and len(survivors) > 1:
+            logging.info(
+                f"🪜 第 {rung + 1} 轮淘汰：{len(survivors)} 个版本，chunk样本比例 {fraction:.1%}"
+            )
+            graphs = dict(
+                self.map_versions(
+                    lambda item: (
+                        item[1],
+                        self.run_sample(item[1], item[2], fraction, rung),
+                    ),
+                    survivors,
                 )
-
+            )
+            scores = score_graphs_unsupervised(
+                {name: graph for name, graph in graphs.items() if graph}
+            )
+            for name, score in scores.items():
                 logging.info(
-                    f"📊 版本 {version_name} 测试完成: {'✅ 成功' if success else '❌ 失败'}"
+                    f"  {name}: novel_graph_score {score['novel_graph_score']:.4f} "
+                    f"({score['nodes_count']} 个节点, {score['edges_count']} 条边)"
                 )
 
-                # 等待一下，确保文件操作完成
-                time.sleep(2)
+            ranked = sorted(
+                (item for item in survivors if item[1] in scores),
+                key=lambda item: scores[item[1]]["novel_graph_score"],
+                reverse=True,
+            )
+            if not ranked:
+                logging.warning(
+                    f"⚠️ 第 {rung + 1} 轮的样本全部失败，停止淘汰，完整运行剩下的 {len(survivors)} 个版本"
+                )
+                break
+            keep = {
+                item[1] for item in ranked[: math.ceil(len(ranked) / self.halving_eta)]
+            }
+            for i, version_name, _ in survivors:
+                if version_name in keep:
+                    continue
+                if version_name in scores:
+                    score = scores[version_name]["novel_graph_score"]
+                    logging.info(f"✂️ 淘汰版本 {version_name}（样本得分 {score:.4f}）")
+                    eliminated[i] = {
+                        "version_name": version_name,
+                        "success": False,
+                        "eliminated": True,
+                        "output": f"Eliminated on a {fraction:.1%} chunk sample",
+                        "sample_fraction": fraction,
+                        "sample_score": score,
+                    }
+                else:
+                    eliminated[i] = {
+                        "version_name": version_name,
+                        "success": False,
+                        "eliminated": True,
+                        "error": f"Failed on a {fraction:.1%} chunk sample",
+                        "sample_fraction": fraction,
+                    }
+            survivors = [item for item in survivors if item[1] in keep]
+            fraction = min(1.0, fraction * self.halving_eta)
+            rung += 1
+        return survivors, eliminated
+
+    def map_versions(self, func, items):
+        """对每个版本调用func（parallel > 1 时同时运行多个），按items的顺序返回结果"""
+        with self._budget_lock:
+            self._versions_pending = len(items)
+        if self.parallel > 1:
+            # 每个线程只负责等待一个insert.py子进程，真正的工作都在子进程中完成
+            with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+                return list(pool.map(func, items))
+        return list(map(func, items))
 
-        finally:
-            # 恢复原始文件
-            logging.info("🔄 恢复原始prompt.py文件...")
-            self.restore_original_prompt()
+    def run_all_versions(self):
+        """运行所有版本的测试（parallel > 1 时同时运行多个版本）"""
+        # 加载版本配置
+        prompt_versions = self.load_prompt_versions()
+        if not prompt_versions:
+            logging.error("没有找到提示词版本配置")
+            return []
 
-        # 保存结果
+        runnable, results = self.plan_versions(prompt_versions)
+        if runnable and self.use_stage:
+            self.use_stage = self.build_pre_extraction_stage()
+        if self.halving_start and len(runnable) > 1:
+            runnable, eliminated = self.run_successive_halving(runnable)
+            results.update(eliminated)
+
+        def run(item):
+            i, version_name, overrides = item
+            logging.info(f"\n{'=' * 60}")
+            logging.info(f"📝 处理版本 {i}/{len(prompt_versions)}: {version_name}")
+            logging.info(f"{'=' * 60}")
+            if self.parallel > 1:
+                success, output = self.run_version_isolated(version_name, overrides)
+            else:
+                success, output = self.run_version(version_name, overrides)
+            logging.info(
+                f"📊 版本 {version_name} 测试完成: {'✅ 成功' if success else '❌ 失败'}"
+            )
+            return i, {
+                "version_name": version_name,
+                "success": success,
+                "output": output[:500] if output else "",  # 限制输出长度
+                "sweep_hash": self.version_hash(overrides),
+                **self.reports.get(version_name, {}),
+            }
+
+        if self.parallel > 1:
+            logging.info(
+                f"⚡ 并行运行 {len(runnable)} 个版本（同时 {self.parallel} 个，"
+                f"LLM并发总预算 {self.llm_budget}）"
+            )
+        results.update(self.map_versions(run, runnable))
+
+        # 保存结果（按版本顺序）
+        results = [results[i] for i in sorted(results)]
         self.save_results(results)
         return results
 
     def save_results(self, results):
-        """保存测试结果"""
+        """把本次的测试结果合并进结果文件
+
+        未变化而跳过的版本保留文件中原有的那一行，其余版本按版本名替换或追加。
+        被淘汰的版本没有完整运行，也不会保存到tobe：文件中已有该版本之前完整运行的那一行时
+        保留那一行（它与tobe中仍在的快照对应），没有时才写入淘汰记录。
+        """
         try:
-            df = pd.DataFrame(results)
+            merged = {}
+            if os.path.exists(self.results_file):
+                previous = pd.read_csv(self.results_file, encoding="utf-8")
+                merged = {
+                    row["version_name"]: row for row in previous.to_dict("records")
+                }
+            for result in results:
+                result = dict(result)
+                keep_previous = result.pop("unchanged", False) or result.get(
+                    "eliminated", False
+                )
+                if keep_previous and result["version_name"] in merged:
+                    continue
+                merged[result["version_name"]] = result
+            df = pd.DataFrame(list(merged.values()))
             df.to_csv(self.results_file, index=False, encoding="utf-8")
             logging.info(f"💾 测试结果已保存到: {self.results_file}")
         except Exception as e:
@@ -426,10 +709,74 @@ class LightRAGSourceModifier:
 
 
 def main():
-    modifier = LightRAGSourceModifier()
+    parser = argparse.ArgumentParser(description="LightRAG提示词版本测试")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="让中断的版本从检查点继续",
+    )
+    parser.add_argument(
+        "--rerun-all",
+        action="store_true",
+        help="重新运行所有版本（默认跳过提示词、流水线参数和输入都未变化且已保存到tobe的版本）",
+    )
+    parser.add_argument(
+        "--parallel",
+        type=int,
+        default=1,
+        help="同时运行的版本数，大于1时每个版本使用sweep_runs下独立的工作目录",
+    )
+    parser.add_argument(
+        "--llm-budget",
+        type=int,
+        default=None,
+        help="所有同时运行的版本共享的LLM并发总数（默认LLM_MAX_ASYNC或32），分给正在运行的版本；"
+        "小于--parallel时同时运行的版本数减少为该值",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=float(os.getenv("INSERT_TIMEOUT", "0")) or None,
+        help="单个版本的最长运行时间（秒，默认INSERT_TIMEOUT，不设置则不限制）",
+    )
+    parser.add_argument(
+        "--no-stage",
+        action="store_true",
+        help="不使用预抽取阶段缓存，每个版本都从切分开始运行完整流程",
+    )
+    parser.add_argument(
+        "--halving",
+        type=float,
+        default=None,
+        metavar="FRACTION",
+        help="逐步淘汰：所有版本先在该比例的chunk样本上运行并评分（0到1之间，如0.125），只完整运行最后留下的版本",
+    )
+    parser.add_argument(
+        "--halving-eta",
+        type=int,
+        default=2,
+        help="逐步淘汰时每轮保留前1/ETA的版本，并把样本比例乘以ETA（至少为2，默认2）",
+    )
+    args = parser.parse_args()
+
+    try:
+        modifier = LightRAGSourceModifier(
+            resume=args.resume,
+            rerun_all=args.rerun_all,
+            parallel=args.parallel,
+            llm_budget=args.llm_budget,
+            timeout=args.timeout,
+            use_stage=not args.no_stage,
+            halving_start=args.halving,
+            halving_eta=args.halving_eta,
+        )
+    except ValueError as e:
+        parser.error(str(e))
 
-    logging.info("🎯 开始LightRAG源码提示词修改测试")
-    logging.info("📋 策略：直接修改源码 → 运行insert.py → 保存结果")
+    logging.info("🎯 开始LightRAG提示词版本测试")
+    logging.info(
+        "📋 策略：构建预抽取阶段 → 生成提示词覆盖文件 → 运行insert.py → 保存结果"
+    )
 
     results = modifier.run_all_versions()
 
@@ -439,12 +786,20 @@ def main():
 
     if results:
         success_count = sum(1 for r in results if r["success"])
+        eliminated_count = sum(1 for r in results if r.get("eliminated"))
         total_count = len(results)
 
         logging.info(f"📈 成功: {success_count}/{total_count}")
+        if eliminated_count:
+            logging.info(f"✂️ 逐步淘汰: {eliminated_count}/{total_count}")
 
         for result in results:
-            status = "✅ 成功" if result["success"] else "❌ 失败"
+            if result["success"]:
+                status = "✅ 成功"
+            elif result.get("eliminated") and "error" not in result:
+                status = "✂️ 已淘汰"
+            else:
+                status = "❌ 失败"
             logging.info(f"  {result['version_name']}: {status}")
             if not result["success"] and "error" in result:
                 logging.info(f"    错误: {result['error']}")
@@ -0,0 +1,230 @@
+"""
+LLM / Embedding 调用遥测
+每次调用记录延迟、token数、缓存命中、重试次数和错误，逐行写入JSONL追踪文件；
+运行结束时汇总p50/p95/p99、tokens/sec、平均每个chunk的调用次数和各阶段的墙钟时间，
+并可导出Prometheus文本格式。
+
+追踪文件只追加，--resume和增量插入时会包含之前进程的记录；每条记录和汇总都带有
+本次进程的run_id，按run_id筛选出的记录与telemetry_summary.json描述的是同一次运行。
+"""
+
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+TRACE_FILENAME = "llm_trace.jsonl"
+SUMMARY_FILENAME = "telemetry_summary.json"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Telemetry:
+    def __init__(self, working_dir):
+        self.working_dir = working_dir
+        self.trace_path = os.path.join(working_dir, TRACE_FILENAME)
+        self.started_at = time.time()
+        # 区分追踪文件中不同运行写入的记录
+        self.run_id = uuid.uuid4().hex[:12]
+        self._trace = None
+        self._latencies = defaultdict(list)
+        self._counters = defaultdict(lambda: defaultdict(int))
+        # 阶段名 -> 墙钟时间（秒），当前阶段在下一个start_stage或汇总时结束计时
+        self._stages = {}
+        self._current_stage = None
+        # 阶段内部可能并发的步骤：步骤名 -> [进行中的调用数, 最早一个开始的时刻]
+        self._steps = {}
+
+    def start_stage(self, name):
+        """结束当前阶段并开始name阶段的计时（同名阶段的时间累加）"""
+        now = time.monotonic()
+        if self._current_stage:
+            stage, started = self._current_stage
+            self._stages[stage] = self._stages.get(stage, 0.0) + now - started
+        self._current_stage = (name, now) if name else None
+
+    @asynccontextmanager
+    async def step(self, name):
+        """计时阶段内部的步骤（如insert中的实体抽取与合并）
+
+        多个文档的同一步骤会并发进行，记录的是至少有一个调用处于该步骤的墙钟时间，
+        与所在阶段的时间重叠，不与其他阶段相加。
+        """
+        step = self._steps.setdefault(name, [0, None])
+        if step[0] == 0:
+            step[1] = time.monotonic()
+        step[0] += 1
+        try:
+            yield
+        finally:
+            step[0] -= 1
+            if step[0] == 0:
+                self._stages[name] = (
+                    self._stages.get(name, 0.0) + time.monotonic() - step[1]
+                )
+
+    def stage_seconds(self):
+        stages = dict(self._stages)
+        now = time.monotonic()
+        if self._current_stage:
+            stage, started = self._current_stage
+            stages[stage] = stages.get(stage, 0.0) + now - started
+        for name, (active, started) in self._steps.items():
+            if active:
+                stages[name] = stages.get(name, 0.0) + now - started
+        return stages
+
+    def _write(self, record):
+        if self._trace is None:
+            self._trace = open(self.trace_path, "a", encoding="utf-8")
+        self._trace.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._trace.flush()
+
+    @asynccontextmanager
+    async def track(self, kind, **fields):
+        """记录一次调用。yield出的字典可由被调用方补充字段：
+        prompt_tokens / completion_tokens / retries / cache_hits / cache_misses
+        """
+        call = {"run_id": self.run_id, "kind": kind, **fields}
+        start = time.monotonic()
+        try:
+            yield call
+        except Exception as e:
+            call["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            call["latency"] = time.monotonic() - start
+            call["ts"] = time.time()
+            self._latencies[kind].append(call["latency"])
+            counters = self._counters[kind]
+            counters["calls"] += 1
+            counters["errors"] += int("error" in call)
+            for key in (
+                "prompt_tokens",
+                "completion_tokens",
+                "retries",
+                "cache_hits",
+                "cache_misses",
+            ):
+                counters[key] += call.get(key, 0) or 0
+            self._write(call)
+
+    def summary(self, chunks=0):
+        """汇总所有调用；chunks为本次处理的chunk总数，用于计算每个chunk的调用次数"""
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        result = {
+            "run_id": self.run_id,
+            "elapsed_seconds": elapsed,
+            "chunks": chunks,
+            "stages": self.stage_seconds(),
+            "kinds": {},
+        }
+        for kind, counters in self._counters.items():
+            latencies = self._latencies[kind]
+            tokens = counters["prompt_tokens"] + counters["completion_tokens"]
+            cache_lookups = counters["cache_hits"] + counters["cache_misses"]
+            result["kinds"][kind] = {
+                **counters,
+                "latency_p50": percentile(latencies, 0.50),
+                "latency_p95": percentile(latencies, 0.95),
+                "latency_p99": percentile(latencies, 0.99),
+                "latency_sum": sum(latencies),
+                "tokens_per_sec": tokens / elapsed,
+                "completion_tokens_per_sec": counters["completion_tokens"] / elapsed,
+                "cache_hit_rate": counters["cache_hits"] / cache_lookups
+                if cache_lookups
+                else 0.0,
+                "calls_per_chunk": counters["calls"] / chunks if chunks else 0.0,
+            }
+        return result
+
+    def write_summary(self, chunks=0, **extra):
+        """写入汇总；extra中的内容（如去重统计）原样附加到汇总里"""
+        summary = {**self.summary(chunks), **extra}
+        with open(
+            os.path.join(self.working_dir, SUMMARY_FILENAME), "w", encoding="utf-8"
+        ) as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        return summary
+
+    def write_prometheus(self, path, chunks=0):
+        """以Prometheus文本格式导出汇总指标"""
+        summary = self.summary(chunks)
+        lines = [
+            "# HELP insert_calls_total Number of LLM/embedding calls.",
+            "# TYPE insert_calls_total counter",
+        ]
+        kinds = summary["kinds"]
+        for kind, stats in kinds.items():
+            lines.append(f'insert_calls_total{{kind="{kind}"}} {stats["calls"]}')
+        lines += [
+            "# HELP insert_call_errors_total Number of failed calls.",
+            "# TYPE insert_call_errors_total counter",
+        ]
+        for kind, stats in kinds.items():
+            lines.append(f'insert_call_errors_total{{kind="{kind}"}} {stats["errors"]}')
+        lines += [
+            "# HELP insert_call_retries_total Number of retried attempts.",
+            "# TYPE insert_call_retries_total counter",
+        ]
+        for kind, stats in kinds.items():
+            lines.append(
+                f'insert_call_retries_total{{kind="{kind}"}} {stats["retries"]}'
+            )
+        lines += [
+            "# HELP insert_tokens_total Tokens reported by the endpoint.",
+            "# TYPE insert_tokens_total counter",
+        ]
+        for kind, stats in kinds.items():
+            for token_type in ("prompt", "completion"):
+                lines.append(
+                    f'insert_tokens_total{{kind="{kind}",type="{token_type}"}} '
+                    f"{stats[f'{token_type}_tokens']}"
+                )
+        lines += [
+            "# HELP insert_cache_lookups_total Cache lookups by result.",
+            "# TYPE insert_cache_lookups_total counter",
+        ]
+        for kind, stats in kinds.items():
+            lines.append(
+                f'insert_cache_lookups_total{{kind="{kind}",result="hit"}} {stats["cache_hits"]}'
+            )
+            lines.append(
+                f'insert_cache_lookups_total{{kind="{kind}",result="miss"}} {stats["cache_misses"]}'
+            )
+        lines += [
+            "# HELP insert_call_latency_seconds Call latency.",
+            "# TYPE insert_call_latency_seconds summary",
+        ]
+        for kind, stats in kinds.items():
+            for q in ("50", "95", "99"):
+                lines.append(
+                    f'insert_call_latency_seconds{{kind="{kind}",quantile="0.{q}"}} '
+                    f"{stats[f'latency_p{q}']:.6f}"
+                )
+            lines.append(
+                f'insert_call_latency_seconds_sum{{kind="{kind}"}} {stats["latency_sum"]:.6f}'
+            )
+            lines.append(
+                f'insert_call_latency_seconds_count{{kind="{kind}"}} {stats["calls"]}'
+            )
+        lines += [
+            "# HELP insert_stage_seconds Wall time spent in each insert stage.",
+            "# TYPE insert_stage_seconds gauge",
+        ]
+        for stage, seconds in summary["stages"].items():
+            lines.append(f'insert_stage_seconds{{stage="{stage}"}} {seconds:.6f}')
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None